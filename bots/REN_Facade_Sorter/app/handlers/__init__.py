@@ -6,6 +6,7 @@ from telebot.async_telebot import AsyncTeleBot
 from .start import register_handlers as register_start_handlers
 from .callbacks import register_handlers as register_callback_handlers
 from .photos import register_handlers as register_photo_handlers
+from .stats import register_handlers as register_stats_handlers
 
 
 def register_handlers(bot: AsyncTeleBot):
@@ -18,6 +19,9 @@ def register_handlers(bot: AsyncTeleBot):
     # Регистрируем хендлеры команд start, help, cancel
     register_start_handlers(bot)
     
+    # Регистрируем хендлер статистики /stats
+    register_stats_handlers(bot)
+    
     # Регистрируем хендлеры для inline кнопок
     register_callback_handlers(bot)
     
@@ -2,12 +2,21 @@
 Callback handlers for inline buttons in the REN Facade Sorter bot.
 """
 
-import os
 from telebot.async_telebot import AsyncTeleBot
-from telebot.types import CallbackQuery, InputMediaPhoto
+from telebot.types import CallbackQuery
 from app.utils.logger import logger
+from app.services.assets import GENERAL_SCHEME, block_scheme, edit_scheme, scheme_path, send_scheme
 from app.keyboards import selection_menu
+from app.keyboards.callback_data import (
+    CallbackPayload, decode,
+    OP_BACK_TO_LEVEL, OP_BACK_TO_SELECTION, OP_BLOCK, OP_CONFIRM, OP_INSPECTION,
+    OP_LEVEL, OP_NEXT_LOCATION, OP_ORIENTATION, OP_START_OVER
+)
 from app.states import PhotoUploadStates
+from app.locations import orientations_for
+from app.services.metrics import callbacks_total
+from app.services.rate_limiter import callback_edits
+from app.services.tracing import rename_trace
 from app.messages import WELCOME_MESSAGE, SCHEME_NOT_FOUND_WARNING, BLOCK_SCHEME_NOT_FOUND_WARNING
 
 
@@ -33,12 +42,11 @@ def register_handlers(bot: AsyncTeleBot):
     Register all callback handlers for inline buttons.
     """
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("inspection_"))
-    async def handle_inspection_selection(call: CallbackQuery):
+    async def handle_inspection_selection(call: CallbackQuery, payload: CallbackPayload):
         """
         Handle inspection type selection (BW/SR).
         """
-        inspection = call.data.split("_")[1]  # "inspection_BW" -> "BW"
+        inspection = payload.inspection
         
         # Сохраняем выбор в состоянии пользователя
         async with bot.retrieve_data(call.from_user.id, call.message.chat.id) as data:
@@ -50,18 +58,16 @@ def register_handlers(bot: AsyncTeleBot):
             data.pop('level', None)
         
         # Если до этого был выбран блок, меняем картинку на общую схему
-        scheme_path = os.path.join("app", "assets", "images", "scheme", "scheme.png")
-        if had_block and os.path.exists(scheme_path):
-            from telebot.types import InputMediaPhoto
-            with open(scheme_path, 'rb') as photo:
-                media = InputMediaPhoto(photo, caption=WELCOME_MESSAGE, parse_mode='Markdown')
-                await bot.edit_message_media(
-                    media,
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=selection_menu(inspection=inspection)
-                )
-        else:
+        scheme_name = GENERAL_SCHEME
+        edited = had_block and await edit_scheme(
+            bot,
+            call.message.chat.id,
+            call.message.message_id,
+            scheme_name,
+            WELCOME_MESSAGE,
+            reply_markup=selection_menu(inspection=inspection)
+        )
+        if not edited:
             # Обновляем клавиатуру с выбранной инспекцией
             await bot.edit_message_reply_markup(
                 call.message.chat.id,
@@ -70,14 +76,13 @@ def register_handlers(bot: AsyncTeleBot):
             )
         
         await bot.answer_callback_query(call.id, f"✅ Selected inspection: {inspection}")
-        logger.info(f"User {call.from_user.id} selected inspection: {inspection}")
+        logger.info("User {user_id} selected inspection: {inspection}", user_id=call.from_user.id, inspection=inspection)
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("block_"))
-    async def handle_block_selection(call: CallbackQuery):
+    async def handle_block_selection(call: CallbackQuery, payload: CallbackPayload):
         """
         Handle building block selection (A/B) and update scheme image.
         """
-        block = call.data.split("_")[1]  # "block_A" -> "A"
+        block = payload.block
         
         # Получаем текущие данные и обновляем блок
         async with bot.retrieve_data(call.from_user.id, call.message.chat.id) as data:
@@ -91,22 +96,21 @@ def register_handlers(bot: AsyncTeleBot):
             data.pop('orientation', None)
             data.pop('level', None)
         
-        # Путь к схеме конкретного блока
-        scheme_path = os.path.join("app", "assets", "images", "scheme", f"scheme_block_{block}.png")
+        # Схема конкретного блока
+        scheme_name = block_scheme(block)
         
         # Обновляем картинку и клавиатуру
-        if os.path.exists(scheme_path):
-            with open(scheme_path, 'rb') as photo:
-                media = InputMediaPhoto(photo, caption=WELCOME_MESSAGE, parse_mode='Markdown')
-                await bot.edit_message_media(
-                    media,
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=selection_menu(inspection=inspection, block=block)
-                )
-        else:
+        edited = await edit_scheme(
+            bot,
+            call.message.chat.id,
+            call.message.message_id,
+            scheme_name,
+            WELCOME_MESSAGE,
+            reply_markup=selection_menu(inspection=inspection, block=block)
+        )
+        if not edited:
             # Если файл схемы блока не найден, обновляем только клавиатуру и добавляем предупреждение
-            logger.warning(f"Block scheme image not found at {scheme_path}")
+            logger.warning("Block scheme image not found at {path}", path=scheme_path(scheme_name))
             await bot.edit_message_caption(
                 call.message.chat.id,
                 call.message.message_id,
@@ -116,14 +120,13 @@ def register_handlers(bot: AsyncTeleBot):
             )
         
         await bot.answer_callback_query(call.id, f"✅ Selected block: {block}")
-        logger.info(f"User {call.from_user.id} selected block: {block}")
+        logger.info("User {user_id} selected block: {block}", user_id=call.from_user.id, block=block)
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("orient_"))
-    async def handle_orientation_selection(call: CallbackQuery):
+    async def handle_orientation_selection(call: CallbackQuery, payload: CallbackPayload):
         """
         Handle orientation selection (East/North/South/West/Courtyard_*).
         """
-        orientation = call.data.replace("orient_", "")  # "orient_East" -> "East"
+        orientation = payload.orientation
         
         # Получаем текущие данные
         async with bot.retrieve_data(call.from_user.id, call.message.chat.id) as data:
@@ -133,6 +136,9 @@ def register_handlers(bot: AsyncTeleBot):
             if not inspection or not block:
                 await bot.answer_callback_query(call.id, "❌ Please select inspection and block first!")
                 return
+            if orientation not in orientations_for(block):
+                await bot.answer_callback_query(call.id, "❌ Orientation is not available for this block!")
+                return
             
             data['orientation'] = orientation
             # Сбрасываем уровень при смене ориентации
@@ -146,23 +152,16 @@ def register_handlers(bot: AsyncTeleBot):
         )
         
         await bot.answer_callback_query(call.id, f"✅ Selected orientation: {orientation}")
-        logger.info(f"User {call.from_user.id} selected orientation: {orientation}")
+        logger.info("User {user_id} selected orientation: {orientation}", user_id=call.from_user.id, orientation=orientation)
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("level_"))
-    async def handle_level_selection(call: CallbackQuery):
+    async def handle_level_selection(call: CallbackQuery, payload: CallbackPayload):
         """
         Handle level (floor) selection.
         """
-        # Парсим данные: "level_BW_A_East_L5" -> ["level", "BW", "A", "East", "L5"]
-        parts = call.data.split("_")
-        if len(parts) < 5:
-            await bot.answer_callback_query(call.id, "❌ Invalid level data!")
-            return
-        
-        inspection = parts[1]
-        block = parts[2]
-        orientation = "_".join(parts[3:-1])  # Поддержка "Courtyard_East"
-        level = parts[-1]
+        inspection = payload.inspection
+        block = payload.block
+        orientation = payload.orientation
+        level = payload.level
         
         # Сохраняем данные
         async with bot.retrieve_data(call.from_user.id, call.message.chat.id) as data:
@@ -184,23 +183,16 @@ def register_handlers(bot: AsyncTeleBot):
         )
         
         await bot.answer_callback_query(call.id, f"✅ Selected level: {level}")
-        logger.info(f"User {call.from_user.id} selected level: {level}")
+        logger.info("User {user_id} selected level: {level}", user_id=call.from_user.id, level=level)
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_"))
-    async def handle_confirm_selection(call: CallbackQuery):
+    async def handle_confirm_selection(call: CallbackQuery, payload: CallbackPayload):
         """
         Handle selection confirmation - ready for photo upload.
         """
-        # Парсим данные из callback: "confirm_BW_A_East_L5"
-        parts = call.data.replace("confirm_", "").split("_")
-        if len(parts) < 4:
-            await bot.answer_callback_query(call.id, "❌ Invalid selection data!")
-            return
-        
-        inspection = parts[0]
-        block = parts[1]
-        orientation = "_".join(parts[2:-1])  # Поддержка "Courtyard_East"
-        level = parts[-1]
+        inspection = payload.inspection
+        block = payload.block
+        orientation = payload.orientation
+        level = payload.level
         
         # Переходим к состоянию ожидания фотографий
         await bot.set_state(call.from_user.id, PhotoUploadStates.waiting_for_photos, call.message.chat.id)
@@ -227,10 +219,10 @@ def register_handlers(bot: AsyncTeleBot):
         )
         
         await bot.answer_callback_query(call.id, "📸 Ready! Send your photos now.")
-        logger.info(f"User {call.from_user.id} confirmed selection: {inspection}/{block}/{orientation}/{level}, waiting for photos")
+        logger.info("User {user_id} confirmed selection: {location}, waiting for photos",
+                    user_id=call.from_user.id, location=f"{inspection}/{block}/{orientation}/{level}")
     
-    @bot.callback_query_handler(func=lambda call: call.data == "back_to_selection")
-    async def handle_back_to_selection(call: CallbackQuery):
+    async def handle_back_to_selection(call: CallbackQuery, payload: CallbackPayload):
         """
         Handle back to parameter selection.
         """
@@ -247,22 +239,21 @@ def register_handlers(bot: AsyncTeleBot):
         
         # Отправляем исходное сообщение с картинкой схемы
 
-        # Путь к общей схеме
-        scheme_path = os.path.join("app", "assets", "images", "scheme", "scheme.png")
+        # Общая схема
+        scheme_name = GENERAL_SCHEME
         
         # Отправляем с общей схемой
-        if os.path.exists(scheme_path):
-            with open(scheme_path, 'rb') as photo:
-                await bot.send_photo(
-                    call.message.chat.id,
-                    photo,
-                    caption=WELCOME_MESSAGE,
-                    reply_markup=selection_menu(inspection=inspection, block=block),
-                    parse_mode='Markdown'
-                )
-        else:
+        sent = await send_scheme(
+            bot,
+            call.message.chat.id,
+            scheme_name,
+            caption=WELCOME_MESSAGE,
+            reply_markup=selection_menu(inspection=inspection, block=block),
+            parse_mode='Markdown'
+        )
+        if not sent:
             # Если файл схемы не найден, отправляем только текст
-            logger.warning(f"General scheme image not found at {scheme_path}")
+            logger.warning("General scheme image not found at {path}", path=scheme_path(scheme_name))
             await bot.send_message(
                 call.message.chat.id,
                 WELCOME_MESSAGE + SCHEME_NOT_FOUND_WARNING,
@@ -271,22 +262,15 @@ def register_handlers(bot: AsyncTeleBot):
             )
         
         await bot.answer_callback_query(call.id, "⬅️ Back to parameter selection")
-        logger.info(f"User {call.from_user.id} went back to parameter selection")
+        logger.info("User {user_id} went back to parameter selection", user_id=call.from_user.id)
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("back_to_level_"))
-    async def handle_back_to_level(call: CallbackQuery):
+    async def handle_back_to_level(call: CallbackQuery, payload: CallbackPayload):
         """
         Handle back to level selection.
         """
-        # Парсим данные: "back_to_level_BW_A_East"
-        parts = call.data.replace("back_to_level_", "").split("_")
-        if len(parts) < 3:
-            await bot.answer_callback_query(call.id, "❌ Invalid back data!")
-            return
-            
-        inspection = parts[0]
-        block = parts[1] 
-        orientation = "_".join(parts[2:])  # Поддержка "Courtyard_East"
+        inspection = payload.inspection
+        block = payload.block
+        orientation = payload.orientation
         
         # Возвращаемся к состоянию выбора уровня
         await bot.set_state(call.from_user.id, PhotoUploadStates.selecting_level, call.message.chat.id)
@@ -304,22 +288,21 @@ def register_handlers(bot: AsyncTeleBot):
 
 **Choose level (floor):**"""
 
-        # Путь к схеме конкретного блока
-        scheme_path = os.path.join("app", "assets", "images", "scheme", f"scheme_block_{block}.png")
+        # Схема конкретного блока
+        scheme_name = block_scheme(block)
         
         # Отправляем сообщение с картинкой схемы блока
-        if os.path.exists(scheme_path):
-            with open(scheme_path, 'rb') as photo:
-                await bot.send_photo(
-                    call.message.chat.id,
-                    photo,
-                    caption=level_text,
-                    reply_markup=selection_menu(inspection, block, orientation),
-                    parse_mode='Markdown'
-                )
-        else:
+        sent = await send_scheme(
+            bot,
+            call.message.chat.id,
+            scheme_name,
+            caption=level_text,
+            reply_markup=selection_menu(inspection, block, orientation),
+            parse_mode='Markdown'
+        )
+        if not sent:
             # Если файл схемы блока не найден, отправляем только текст
-            logger.warning(f"Block scheme image not found at {scheme_path}")
+            logger.warning("Block scheme image not found at {path}", path=scheme_path(scheme_name))
             await bot.send_message(
                 call.message.chat.id,
                 level_text + BLOCK_SCHEME_NOT_FOUND_WARNING.format(block),
@@ -328,10 +311,9 @@ def register_handlers(bot: AsyncTeleBot):
             )
         
         await bot.answer_callback_query(call.id, "⬅️ Back to level selection")
-        logger.info(f"User {call.from_user.id} went back to level selection")
+        logger.info("User {user_id} went back to level selection", user_id=call.from_user.id)
     
-    @bot.callback_query_handler(func=lambda call: call.data in ["next_location", "start_over"])
-    async def handle_start_over(call: CallbackQuery):
+    async def handle_start_over(call: CallbackQuery, payload: CallbackPayload):
         """
         Handle start over/another location - reset all data and return to beginning.
         """
@@ -352,7 +334,7 @@ def register_handlers(bot: AsyncTeleBot):
         # Находим строки с результатами сохранения
         result_lines = []
         for line in lines:
-            if "Successfully saved:" in line or "Failed to save:" in line:
+            if "Successfully saved:" in line or "Duplicates (already stored):" in line or "Failed to save:" in line:
                 result_lines.append(line)
         
         # Формируем сокращенный текст
@@ -368,22 +350,21 @@ def register_handlers(bot: AsyncTeleBot):
         
         # Отправляем новое сообщение с картинкой схемы
 
-        # Путь к общей схеме
-        scheme_path = os.path.join("app", "assets", "images", "scheme", "scheme.png")
+        # Общая схема
+        scheme_name = GENERAL_SCHEME
         
         # Отправляем с общей схемой
-        if os.path.exists(scheme_path):
-            with open(scheme_path, 'rb') as photo:
-                await bot.send_photo(
-                    chat_id,
-                    photo,
-                    caption=WELCOME_MESSAGE,
-                    reply_markup=selection_menu(),
-                    parse_mode='Markdown'
-                )
-        else:
+        sent = await send_scheme(
+            bot,
+            chat_id,
+            scheme_name,
+            caption=WELCOME_MESSAGE,
+            reply_markup=selection_menu(),
+            parse_mode='Markdown'
+        )
+        if not sent:
             # Если файл схемы не найден, отправляем только текст
-            logger.warning(f"General scheme image not found at {scheme_path}")
+            logger.warning("General scheme image not found at {path}", path=scheme_path(scheme_name))
             await bot.send_message(
                 chat_id,
                 WELCOME_MESSAGE + SCHEME_NOT_FOUND_WARNING,
@@ -392,8 +373,39 @@ def register_handlers(bot: AsyncTeleBot):
             )
         
         # Определяем текст ответа в зависимости от действия
-        callback_text = "🏠 Another location selected" if call.data == "next_location" else "🏠 Starting over..."
+        callback_text = "🏠 Another location selected" if payload.op == OP_NEXT_LOCATION else "🏠 Starting over..."
         await bot.answer_callback_query(call.id, callback_text)
         
-        action = "moved to another location" if call.data == "next_location" else "started over"
-        logger.info(f"User {user_id} {action}")
\ No newline at end of file
+        action = "moved to another location" if payload.op == OP_NEXT_LOCATION else "started over"
+        logger.info("User {user_id} {action}", user_id=user_id, action=action)
+    
+    # Таблица операций: метка для метрик и обработчик каждой inline-кнопки
+    handlers = {
+        OP_INSPECTION: ("inspection_selection", handle_inspection_selection),
+        OP_BLOCK: ("block_selection", handle_block_selection),
+        OP_ORIENTATION: ("orientation_selection", handle_orientation_selection),
+        OP_LEVEL: ("level_selection", handle_level_selection),
+        OP_CONFIRM: ("confirm_selection", handle_confirm_selection),
+        OP_BACK_TO_SELECTION: ("back_to_selection", handle_back_to_selection),
+        OP_BACK_TO_LEVEL: ("back_to_level", handle_back_to_level),
+        OP_NEXT_LOCATION: ("next_location", handle_start_over),
+        OP_START_OVER: ("start_over", handle_start_over),
+    }
+    
+    @bot.callback_query_handler(func=lambda call: True)
+    async def dispatch_callback(call: CallbackQuery):
+        """
+        Decode callback_data and route it to the handler of its opcode.
+        """
+        payload = decode(call.data)
+        if payload is None:
+            # Кнопка старого формата или поврежденные данные
+            logger.warning("User {user_id} sent unknown callback data: {data!r}", user_id=call.from_user.id, data=call.data)
+            await bot.answer_callback_query(call.id, "⚠️ This menu is outdated, please use /start")
+            callbacks_total.inc(action='outdated')
+            return
+        action, handler = handlers[payload.op]
+        callbacks_total.inc(action=action)
+        rename_trace(f"callback:{action}")
+        with callback_edits():
+            await handler(call, payload)
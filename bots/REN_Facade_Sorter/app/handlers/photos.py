@@ -2,19 +2,24 @@
 Photo upload handlers for the REN Facade Sorter bot.
 """
 
-import os
 import asyncio
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Set, Tuple
 from telebot.async_telebot import AsyncTeleBot
 from telebot.types import Message
 from app.utils.logger import logger
 from app.keyboards.inline import post_upload_menu
+from app.services.downloader import DownloadResult
+from app.services.location_tree import location_tree
+from app.services.media_groups import media_group_aggregator
+from app.services.tracing import span
+from app.services.upload_queue import UploadTicket, upload_queue, wait_for_tickets
 from app.states import PhotoUploadStates
 
-# Global dictionary to store media groups
-media_groups: Dict[str, List[Message]] = {}
-media_group_timers: Dict[str, asyncio.Task] = {}
+# Задания элементов альбомов, которые еще собираются: (chat_id, message_id) -> job_id
+_held_jobs: Dict[Tuple[int, int], int] = {}
+# Отчеты о возобновленных после перезапуска загрузках
+_report_tasks: Set[asyncio.Task] = set()
 
 
 def register_handlers(bot: AsyncTeleBot):
@@ -44,12 +49,12 @@ def register_handlers(bot: AsyncTeleBot):
                     "❌ **Error:** Missing selection parameters. Please start over with /start",
                     parse_mode='Markdown'
                 )
-                logger.error(f"User {user_id} missing parameters: {data}")
+                logger.error("User {user_id} missing parameters: {data}", user_id=user_id, data=dict(data))
                 return
         
         # Проверяем, является ли это частью медиагруппы
         if message.media_group_id:
-            await handle_media_group_photo(bot, message)
+            await handle_media_group_item(bot, message)
         else:
             await handle_single_photo(bot, message)
 
@@ -74,7 +79,7 @@ def register_handlers(bot: AsyncTeleBot):
                     "❌ **Error:** Missing selection parameters. Please start over with /start",
                     parse_mode='Markdown'
                 )
-                logger.error(f"User {user_id} missing parameters: {data}")
+                logger.error("User {user_id} missing parameters: {data}", user_id=user_id, data=dict(data))
                 return
         
         # Проверяем, что это изображение
@@ -89,7 +94,7 @@ def register_handlers(bot: AsyncTeleBot):
         
         # Проверяем, является ли это частью медиагруппы
         if message.media_group_id:
-            await handle_media_group_document(bot, message)
+            await handle_media_group_item(bot, message)
         else:
             await handle_single_document(bot, message)
 
@@ -109,127 +114,88 @@ def register_handlers(bot: AsyncTeleBot):
             )
 
 
-async def handle_media_group_photo(bot: AsyncTeleBot, message: Message):
+def build_photo_info(message: Message) -> dict:
     """
-    Handle photo that is part of a media group.
+    Photo info dictionary of a photo or an image document message.
     """
-    media_group_id = message.media_group_id
-    user_id = message.from_user.id
-    
-    # Создаем уникальный ключ для пользователя и медиагруппы
-    group_key = f"{user_id}_{media_group_id}"
-    
-    # Добавляем фото в медиагруппу
-    if group_key not in media_groups:
-        media_groups[group_key] = []
-    
-    media_groups[group_key].append(message)
-    
-    # Отменяем предыдущий таймер если он есть
-    if group_key in media_group_timers:
-        media_group_timers[group_key].cancel()
-    
-    # Запускаем новый таймер (ждем 1 секунду после последнего фото)
-    media_group_timers[group_key] = asyncio.create_task(
-        process_media_group_delayed(bot, group_key, user_id, message.chat.id)
-    )
+    if message.photo:
+        # Фотография
+        photo = message.photo[-1]  # Наивысшее качество
+        return {
+            'file_id': photo.file_id,
+            'file_unique_id': photo.file_unique_id,
+            'width': photo.width,
+            'height': photo.height,
+            'file_size': photo.file_size,
+            'timestamp': datetime.now().isoformat(),
+            'caption': message.caption or "",
+            'type': 'photo'
+        }
+    # Документ (изображение)
+    document = message.document
+    return {
+        'file_id': document.file_id,
+        'file_unique_id': document.file_unique_id,
+        'width': getattr(document, 'width', 0),
+        'height': getattr(document, 'height', 0),
+        'file_size': document.file_size,
+        'timestamp': datetime.now().isoformat(),
+        'caption': message.caption or "",
+        'type': 'document',
+        'file_name': document.file_name or 'image'
+    }
 
 
-async def handle_media_group_document(bot: AsyncTeleBot, message: Message):
+async def handle_media_group_item(bot: AsyncTeleBot, message: Message):
     """
-    Handle document (image file) that is part of a media group.
+    Handle photo or document (image file) that is part of a media group.
+    Each item is recorded in the upload queue as soon as it arrives; items are
+    collected by the media group aggregator and processed together.
     """
-    media_group_id = message.media_group_id
     user_id = message.from_user.id
+    chat_id = message.chat.id
     
-    # Создаем уникальный ключ для пользователя и медиагруппы
-    group_key = f"{user_id}_{media_group_id}"
-    
-    # Добавляем документ в медиагруппу
-    if group_key not in media_groups:
-        media_groups[group_key] = []
+    # Получаем параметры пользователя
+    async with bot.retrieve_data(user_id, chat_id) as data:
+        location = (data.get('inspection'), data.get('block'), data.get('orientation'), data.get('level'))
     
-    media_groups[group_key].append(message)
+    try:
+        save_path = await location_tree.path(location)
+        # Элемент альбома переживает перезапуск, даже если альбом еще собирается
+        job_id = await upload_queue.hold(
+            f"{user_id}_{message.media_group_id}", user_id, chat_id, build_photo_info(message), save_path, location
+        )
+    except Exception as e:
+        await send_save_error(bot, user_id, chat_id, e)
+        return
+    _held_jobs[(chat_id, message.message_id)] = job_id
     
-    # Отменяем предыдущий таймер если он есть
-    if group_key in media_group_timers:
-        media_group_timers[group_key].cancel()
+    async def flush(user_id: int, chat_id: int, messages: List[Message]):
+        await process_media_group(bot, user_id, chat_id, messages)
     
-    # Запускаем новый таймер (ждем 1 секунду после последнего файла)
-    media_group_timers[group_key] = asyncio.create_task(
-        process_media_group_delayed(bot, group_key, user_id, message.chat.id)
-    )
+    media_group_aggregator.add(message, flush)
 
 
-async def process_media_group_delayed(bot: AsyncTeleBot, group_key: str, user_id: int, chat_id: int):
+async def process_media_group(bot: AsyncTeleBot, user_id: int, chat_id: int, messages: List[Message]):
     """
-    Process media group after a delay to ensure all photos are received.
-    Now saves photos immediately without confirmation.
+    Process all collected items of a media group.
+    Saves photos immediately without confirmation.
     """
+    job_ids = [_held_jobs.pop((chat_id, msg.message_id)) for msg in messages
+               if (chat_id, msg.message_id) in _held_jobs]
     try:
-        # Ждем 1 секунду чтобы получить все фото из группы
-        await asyncio.sleep(1.0)
-        
-        if group_key not in media_groups:
-            return
-        
-        messages = media_groups[group_key]
-        photo_count = len(messages)
-        
-        # Получаем параметры пользователя
-        async with bot.retrieve_data(user_id, chat_id) as data:
-            inspection = data.get('inspection')
-            block = data.get('block')
-            orientation = data.get('orientation')
-            level = data.get('level')
-        
-        # Подготавливаем список фотографий для сохранения
-        photos_to_save = []
-        for msg in messages:
-            if msg.photo:
-                # Фотография
-                photo = msg.photo[-1]  # Наивысшее качество
-                photo_info = {
-                    'file_id': photo.file_id,
-                    'file_unique_id': photo.file_unique_id,
-                    'width': photo.width,
-                    'height': photo.height,
-                    'file_size': photo.file_size,
-                    'timestamp': datetime.now().isoformat(),
-                    'caption': msg.caption or "",
-                    'type': 'photo'
-                }
-            elif msg.document:
-                # Документ (изображение)
-                document = msg.document
-                photo_info = {
-                    'file_id': document.file_id,
-                    'file_unique_id': document.file_unique_id,
-                    'width': getattr(document, 'width', 0),
-                    'height': getattr(document, 'height', 0),
-                    'file_size': document.file_size,
-                    'timestamp': datetime.now().isoformat(),
-                    'caption': msg.caption or "",
-                    'type': 'document',
-                    'file_name': document.file_name or 'image'
-                }
-            
-            photos_to_save.append(photo_info)
-        
-        # Сразу сохраняем фотографии
-        await save_photos_immediate(bot, user_id, chat_id, photos_to_save, inspection, block, orientation, level)
-        
-        logger.info(f"User {user_id} uploaded media group with {photo_count} photos for {inspection}/{block}/{level}/{orientation}")
-        
-        # Очищаем медиагруппу
-        del media_groups[group_key]
-        del media_group_timers[group_key]
-        
-    except asyncio.CancelledError:
-        # Таймер был отменен, ничего не делаем
-        pass
+        tickets = await upload_queue.release(job_ids)
     except Exception as e:
-        logger.error(f"Error processing media group {group_key}: {e}")
+        await send_save_error(bot, user_id, chat_id, e)
+        return
+    if not tickets:
+        return
+    
+    job = tickets[0].job
+    await report_saving(bot, user_id, chat_id, tickets, job.save_path, job.inspection, job.block, job.orientation, job.level)
+    
+    logger.info("User {user_id} uploaded media group with {files} photos for {location}",
+                user_id=user_id, files=len(tickets), location=f"{job.inspection}/{job.block}/{job.level}/{job.orientation}")
 
 
 async def handle_single_photo(bot: AsyncTeleBot, message: Message):
@@ -247,24 +213,13 @@ async def handle_single_photo(bot: AsyncTeleBot, message: Message):
         level = data.get('level')
     
     # Получаем фото в наивысшем качестве
-    photo = message.photo[-1]
-    
-    # Подготавливаем информацию о фото
-    photo_info = {
-        'file_id': photo.file_id,
-        'file_unique_id': photo.file_unique_id,
-        'width': photo.width,
-        'height': photo.height,
-        'file_size': photo.file_size,
-        'timestamp': datetime.now().isoformat(),
-        'caption': message.caption or "",
-        'type': 'photo'
-    }
+    photo_info = build_photo_info(message)
     
     # Сразу сохраняем фотографию
     await save_photos_immediate(bot, user_id, chat_id, [photo_info], inspection, block, orientation, level)
     
-    logger.info(f"User {user_id} uploaded single photo for {inspection}/{block}/{level}/{orientation}")
+    logger.info("User {user_id} uploaded single photo for {location}",
+                user_id=user_id, location=f"{inspection}/{block}/{level}/{orientation}")
 
 
 async def handle_single_document(bot: AsyncTeleBot, message: Message):
@@ -281,26 +236,49 @@ async def handle_single_document(bot: AsyncTeleBot, message: Message):
         orientation = data.get('orientation')
         level = data.get('level')
     
-    # Получаем документ
-    document = message.document
-    
     # Подготавливаем информацию о файле
-    photo_info = {
-        'file_id': document.file_id,
-        'file_unique_id': document.file_unique_id,
-        'width': getattr(document, 'width', 0),
-        'height': getattr(document, 'height', 0),
-        'file_size': document.file_size,
-        'timestamp': datetime.now().isoformat(),
-        'caption': message.caption or "",
-        'type': 'document',
-        'file_name': document.file_name or 'image'
-    }
+    photo_info = build_photo_info(message)
     
     # Сразу сохраняем файл
     await save_photos_immediate(bot, user_id, chat_id, [photo_info], inspection, block, orientation, level)
     
-    logger.info(f"User {user_id} uploaded single document for {inspection}/{block}/{level}/{orientation}")
+    logger.info("User {user_id} uploaded single document for {location}",
+                user_id=user_id, location=f"{inspection}/{block}/{level}/{orientation}")
+
+
+def count_results(results: List[DownloadResult]) -> Tuple[int, int, int]:
+    """
+    Count saved, duplicate and failed files among download results.
+    """
+    saved_count = sum(1 for r in results if r.ok and not r.duplicate)
+    duplicate_count = sum(1 for r in results if r.ok and r.duplicate)
+    failed_count = sum(1 for r in results if r.done and not r.ok)
+    return saved_count, duplicate_count, failed_count
+
+
+def build_report_text(results: List[DownloadResult], counts: Tuple[int, int, int]) -> str:
+    """
+    Build the upload report shown after files are saved.
+    
+    Args:
+        results: Download results of the upload
+        counts: Saved, duplicate and failed counts (see count_results)
+    """
+    saved_count, duplicate_count, failed_count = counts
+    
+    file_word = "file" if len(results) == 1 else "files"
+    report_text = f"✅ Successfully saved: **{saved_count}** {file_word}"
+    
+    # Дубликаты не скачиваются повторно, показываем их отдельно
+    if duplicate_count > 0:
+        report_text += f"\n♻️ Duplicates (already stored): **{duplicate_count}** {file_word}"
+    
+    # Показываем ошибки только если они были
+    if failed_count > 0:
+        report_text += f"\n❌ Failed to save: **{failed_count}** {file_word}"
+    
+    report_text += "\n\n📸 *Continue uploading photos or press* **Another Location** *to change location*"
+    return report_text
 
 
 async def save_photos_immediate(bot: AsyncTeleBot, user_id: int, chat_id: int, photos: List[dict], 
@@ -319,85 +297,79 @@ async def save_photos_immediate(bot: AsyncTeleBot, user_id: int, chat_id: int, p
         level: Level/floor
     """
     try:
-        # Создаем путь для сохранения
-        save_path = os.path.join(
-            "structure_inspections",
-            inspection,
-            block,
-            level,
-            orientation,
-            "unsorted"
-        )
-        
-        # Создаем директорию если она не существует
-        os.makedirs(save_path, exist_ok=True)
+        # Папки локаций созданы при запуске, путь берется из памяти
+        save_path = await location_tree.path((inspection, block, orientation, level))
         
+        # Записываем задания в очередь до ответа пользователю, чтобы пережить перезапуск
+        tickets = await upload_queue.submit(
+            user_id, chat_id, photos, save_path, (inspection, block, orientation, level)
+        )
+    except Exception as e:
+        await send_save_error(bot, user_id, chat_id, e)
+        return
+    
+    await report_saving(bot, user_id, chat_id, tickets, save_path, inspection, block, orientation, level)
+
+
+async def report_saving(bot: AsyncTeleBot, user_id: int, chat_id: int, tickets: List[UploadTicket], save_path: str,
+                        inspection: str, block: str, orientation: str, level: str):
+    """
+    Show progress of submitted upload jobs and send the final report.
+    """
+    try:
         # Отправляем сообщение о начале сохранения только если больше 1 фото
         progress_msg = None
-        if len(photos) > 1:
+        if len(tickets) > 1:
             progress_msg = await bot.send_message(
                 chat_id,
-                f"💾 **Saving {len(photos)} files...**\n\n🔄 Processing...",
+                f"💾 **Saving {len(tickets)} files...**\n\n🔄 Processing...",
                 parse_mode='Markdown'
             )
         
-        saved_count = 0
-        failed_count = 0
-        saved_files = []
+        progress_edits: Set[asyncio.Task] = set()
         
-        # Сохраняем каждое фото
-        for i, photo_info in enumerate(photos, 1):
+        async def edit_progress(text: str):
             try:
-                # Получаем файл
-                file_path = await bot.get_file(photo_info['file_id'])
-                downloaded_file = await bot.download_file(file_path.file_path)
-                
-                # Генерируем имя файла
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                
-                if photo_info['type'] == 'document' and 'file_name' in photo_info:
-                    # Для документов сохраняем оригинальное расширение
-                    original_name = photo_info['file_name']
-                    extension = os.path.splitext(original_name)[1] or '.jpg'
-                    filename = f"{timestamp}_{i:03d}_{photo_info['file_unique_id']}{extension}"
-                else:
-                    # Для фотографий используем .jpg
-                    filename = f"{timestamp}_{i:03d}_{photo_info['file_unique_id']}.jpg"
-                
-                full_path = os.path.join(save_path, filename)
-                
-                # Сохраняем файл
-                with open(full_path, 'wb') as f:
-                    f.write(downloaded_file)
-                
-                saved_files.append(filename)
-                saved_count += 1
-                
-                # Обновляем прогресс каждые 3 фото или на последнем (только если есть progress_msg)
-                if progress_msg and (i % 3 == 0 or i == len(photos)):
-                    await bot.edit_message_text(
-                        f"💾 **Saving {len(photos)} files...**\n\n"
-                        f"📊 Progress: {i}/{len(photos)}\n"
-                        f"✅ Saved: {saved_count}\n"
-                        f"❌ Failed: {failed_count}",
-                        chat_id,
-                        progress_msg.message_id,
-                        parse_mode='Markdown'
-                    )
-                
+                await bot.edit_message_text(text, chat_id, progress_msg.message_id, parse_mode='Markdown')
             except Exception as e:
-                failed_count += 1
-                logger.error(f"Failed to save photo {i} for user {user_id}: {e}")
+                logger.warning("Failed to update progress for user {user_id}: {error}", user_id=user_id, error=e)
         
-        # Создаем отчет
-        file_word = "file" if len(photos) == 1 else "files"
-        report_text = f"✅ Successfully saved: **{saved_count}** {file_word}"
+        async def report_progress(completed: int, results: List[DownloadResult]):
+            # Обновляем прогресс каждые 3 фото или на последнем (только если есть progress_msg)
+            if not progress_msg or (completed % 3 != 0 and completed != len(tickets)):
+                return
+            saved_count, duplicate_count, failed_count = count_results(results)
+            downloaded_mb = sum(r.bytes_downloaded for r in results) / (1024 * 1024)
+            # Правку не ждем: пока она в очереди лимита, следующая заменяет ее текст
+            task = asyncio.create_task(edit_progress(
+                f"💾 **Saving {len(tickets)} files...**\n\n"
+                f"📊 Progress: {completed}/{len(tickets)}\n"
+                f"📦 Downloaded: {downloaded_mb:.1f} MB\n"
+                f"✅ Saved: {saved_count}\n"
+                f"♻️ Duplicates: {duplicate_count}\n"
+                f"❌ Failed: {failed_count}"
+            ))
+            progress_edits.add(task)
+            task.add_done_callback(progress_edits.discard)
+        
+        # Скачиваем файлы пулом воркеров, результаты возвращаются в исходном порядке
+        with span("uploads:wait"):
+            results = await wait_for_tickets(tickets, on_progress=report_progress)
+        
+        # Сообщение прогресса сейчас будет удалено, правки в очереди больше не нужны
+        for task in progress_edits:
+            task.cancel()
+        await asyncio.gather(*progress_edits, return_exceptions=True)
         
-        # Показываем ошибки только если они были
-        if failed_count > 0:
-            report_text += f"\n❌ Failed to save: **{failed_count}** {file_word}"
+        counts = count_results(results)
+        saved_count, duplicate_count, failed_count = counts
+        for r in results:
+            if not r.ok:
+                logger.error("Failed to save photo {index} for user {user_id}: {error}",
+                             index=r.index, user_id=user_id, error=r.error)
         
-        report_text += "\n\n📸 *Continue uploading photos or press* **Another Location** *to change location*"
+        # Создаем отчет
+        report_text = build_report_text(results, counts)
 
         # Удаляем сообщение прогресса если оно было и отправляем финальный отчет
         if progress_msg:
@@ -413,13 +385,49 @@ async def save_photos_immediate(bot: AsyncTeleBot, user_id: int, chat_id: int, p
             parse_mode='Markdown'
         )
         
-        logger.info(f"User {user_id} saved {saved_count} files to {save_path}, {failed_count} failed")
+        logger.info("User {user_id} saved {files} files to {save_path}, {duplicates} duplicates, {failed} failed",
+                    user_id=user_id, files=saved_count, save_path=save_path, duplicates=duplicate_count, failed=failed_count)
         
     except Exception as e:
-        logger.error(f"Error saving photos for user {user_id}: {e}")
-        await bot.send_message(
-            chat_id,
-            f"❌ **Error saving files**\n\n{str(e)}\n\nPlease try again or contact support.",
-            parse_mode='Markdown'
-        )
-        
\ No newline at end of file
+        await send_save_error(bot, user_id, chat_id, e)
+
+
+async def send_save_error(bot: AsyncTeleBot, user_id: int, chat_id: int, error: Exception):
+    """Log a failed save and tell the user about it."""
+    logger.error("Error saving photos for user {user_id}: {error}", user_id=user_id, error=error)
+    await bot.send_message(
+        chat_id,
+        f"❌ **Error saving files**\n\n{str(error)}\n\nPlease try again or contact support.",
+        parse_mode='Markdown'
+    )
+
+
+async def resume_interrupted_uploads(bot: AsyncTeleBot, recovered: Dict[str, List[UploadTicket]]):
+    """
+    Report uploads that were replayed from the job queue after a restart.
+    
+    Args:
+        bot: Telegram bot instance
+        recovered: Replayed tickets grouped by batch (from upload_queue.start)
+    """
+    async def report_batch(tickets: List[UploadTicket]):
+        job = tickets[0].job
+        try:
+            results = await wait_for_tickets(tickets)
+            await bot.send_message(
+                job.chat_id,
+                f"♻️ **Upload resumed after restart** "
+                f"({job.inspection}/{job.block}/{job.level}/{job.orientation})\n\n"
+                + build_report_text(results, count_results(results)),
+                reply_markup=post_upload_menu(job.inspection, job.block, job.orientation, job.level),
+                parse_mode='Markdown'
+            )
+            logger.info("Resumed {files} files for user {user_id} after restart", files=len(results), user_id=job.user_id)
+        except Exception as e:
+            logger.error("Error reporting resumed upload for user {user_id}: {error}", user_id=job.user_id, error=e)
+    
+    for tickets in recovered.values():
+        # Ссылка на задачу хранится до ее завершения, иначе ее может собрать сборщик мусора
+        task = asyncio.create_task(report_batch(tickets))
+        _report_tasks.add(task)
+        task.add_done_callback(_report_tasks.discard)
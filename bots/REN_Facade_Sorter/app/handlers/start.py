@@ -2,10 +2,10 @@
 /start command handler for the REN Facade Sorter bot.
 """
 
-import os
 from telebot.async_telebot import AsyncTeleBot
 from telebot.types import Message
 from app.utils.logger import logger
+from app.services.assets import GENERAL_SCHEME, scheme_path, send_scheme
 from app.keyboards import selection_menu
 from app.states import PhotoUploadStates
 from app.messages import WELCOME_MESSAGE, HELP_MESSAGE, CANCEL_MESSAGE, SCHEME_NOT_FOUND_WARNING
@@ -27,28 +27,24 @@ def register_handlers(bot: AsyncTeleBot):
         last_name = message.from_user.last_name or ""
         
         # Логируем начало взаимодействия с пользователем
-        logger.info(f"User started bot: {telegram_id} (@{username}) - {first_name} {last_name}")
+        logger.info("User started bot: {user_id} (@{username}) - {first_name} {last_name}",
+                    user_id=telegram_id, username=username, first_name=first_name, last_name=last_name)
 
-        # Путь к схеме
-        scheme_path = os.path.join("app", "assets", "images", "scheme", "scheme.png")
-        
         # Устанавливаем состояние выбора параметров
         await bot.set_state(message.from_user.id, PhotoUploadStates.selecting_parameters, message.chat.id)
         
-        # Проверяем существование файла схемы
-        if os.path.exists(scheme_path):
-            # Отправляем сообщение с картинкой схемы и инлайн кнопками
-            with open(scheme_path, 'rb') as photo:
-                await bot.send_photo(
-                    message.chat.id,
-                    photo,
-                    caption=WELCOME_MESSAGE,
-                    reply_markup=selection_menu(),
-                    parse_mode='Markdown'
-                )
-        else:
+        # Отправляем сообщение с картинкой схемы (по кэшированному file_id) и инлайн кнопками
+        sent = await send_scheme(
+            bot,
+            message.chat.id,
+            GENERAL_SCHEME,
+            caption=WELCOME_MESSAGE,
+            reply_markup=selection_menu(),
+            parse_mode='Markdown'
+        )
+        if not sent:
             # Если файл схемы не найден, отправляем только текст с кнопками
-            logger.warning(f"Scheme image not found at {scheme_path}")
+            logger.warning("Scheme image not found at {path}", path=scheme_path(GENERAL_SCHEME))
             await bot.send_message(
                 message.chat.id,
                 WELCOME_MESSAGE + SCHEME_NOT_FOUND_WARNING,
@@ -80,4 +76,4 @@ def register_handlers(bot: AsyncTeleBot):
             parse_mode='Markdown'
         )
         
-        logger.info(f"User {message.from_user.id} cancelled operation") 
\ No newline at end of file
+        logger.info("User {user_id} cancelled operation", user_id=message.from_user.id) 
\ No newline at end of file
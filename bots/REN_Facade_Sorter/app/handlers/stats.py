@@ -0,0 +1,145 @@
+"""
+/stats and /coverage command handlers for the REN Facade Sorter bot.
+"""
+
+from typing import List, Optional
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Message
+from app.utils.logger import logger
+from app.locations import BLOCKS, COURTYARD_ORIENTATIONS, INSPECTIONS, LEVELS, MAIN_ORIENTATIONS, orientations_for
+from app.services.catalog import LocationStats, catalog
+
+STATS_USAGE = "Usage: `/stats [inspection] [block] [orientation] [level]`, e.g. `/stats BW A East L5`"
+COVERAGE_USAGE = "Usage: `/coverage [inspection] [block]`, e.g. `/coverage BW A`"
+
+# Короткие подписи столбцов матрицы покрытия
+ORIENTATION_LABELS = {
+    "East": "E", "North": "N", "South": "S", "West": "W",
+    "Courtyard_East": "cE", "Courtyard_North": "cN", "Courtyard_South": "cS", "Courtyard_West": "cW",
+}
+
+
+def format_stats(stats: LocationStats) -> str:
+    """
+    One-line summary of a location's counters.
+    """
+    text = f"{stats.files} files, {stats.bytes / (1024 * 1024):.1f} MB"
+    if stats.last_upload:
+        text += f", last {stats.last_upload:%Y-%m-%d %H:%M}"
+    return text
+
+
+def parse_location_args(args: List[str]) -> Optional[dict]:
+    """
+    Match command arguments against the location grid in any order.
+    Returns None if an argument is not a known inspection, block, orientation or level.
+    """
+    fields = {}
+    for arg in args:
+        value = arg.strip()
+        if value.upper() in INSPECTIONS:
+            fields['inspection'] = value.upper()
+        elif value.upper() in BLOCKS:
+            fields['block'] = value.upper()
+        elif value.upper() in LEVELS:
+            fields['level'] = value.upper()
+        else:
+            orientation = next(
+                (o for o in MAIN_ORIENTATIONS + COURTYARD_ORIENTATIONS if o.lower() == value.lower()),
+                None
+            )
+            if orientation is None:
+                return None
+            fields['orientation'] = orientation
+    return fields
+
+
+def build_stats_text(inspection: Optional[str] = None, block: Optional[str] = None,
+                     orientation: Optional[str] = None, level: Optional[str] = None) -> str:
+    """
+    Statistics message for a location filter, answered from the catalog.
+    """
+    selected = [part for part in (inspection, block, orientation, level) if part]
+    title = " / ".join(selected).replace("_", " ") if selected else "All locations"
+    lines = [f"📊 **Photo statistics: {title}**", "", f"Total: {format_stats(catalog.get(inspection, block, orientation, level))}"]
+
+    # Разбивка по следующему невыбранному уровню иерархии
+    if not inspection:
+        rows = [((i, b), catalog.get(i, b)) for i in INSPECTIONS for b in BLOCKS]
+    elif not block:
+        rows = [((inspection, b), catalog.get(inspection, b)) for b in BLOCKS]
+    elif not level:
+        rows = [((lvl,), catalog.get(inspection, block, orientation, lvl)) for lvl in LEVELS]
+    elif not orientation:
+        rows = [((o,), catalog.get(inspection, block, o, level)) for o in orientations_for(block)]
+    else:
+        rows = []
+
+    breakdown = [f"• **{' / '.join(key).replace('_', ' ')}**: {format_stats(stats)}" for key, stats in rows if stats.files]
+    if breakdown:
+        lines += [""] + breakdown
+    return "\n".join(lines)
+
+
+def _cell(count: int) -> str:
+    if not count:
+        return "·"
+    return str(count) if count < 1000 else f"{count // 1000}k"
+
+
+def build_coverage_text(inspection: Optional[str] = None, block: Optional[str] = None) -> str:
+    """
+    Coverage matrices (levels × orientations with photo counts) per inspection
+    and block, computed from the catalog counters.
+    """
+    counts = catalog.counts()
+    sections = []
+    for i in ([inspection] if inspection else INSPECTIONS):
+        for b in ([block] if block else BLOCKS):
+            orientations = orientations_for(b)
+            empty = sum(1 for o in orientations for lvl in LEVELS if not counts.get((i, b, o, lvl)))
+            header = "Lvl " + "".join(f"{ORIENTATION_LABELS[o]:>4}" for o in orientations)
+            rows = [
+                f"{lvl:<4}" + "".join(f"{_cell(counts.get((i, b, o, lvl), 0)):>4}" for o in orientations)
+                for lvl in reversed(LEVELS)
+            ]
+            total = len(orientations) * len(LEVELS)
+            sections.append(
+                f"🗺 **{i} / Block {b}**: {total - empty}/{total} cells covered\n"
+                + "```\n" + "\n".join([header] + rows) + "\n```"
+            )
+    legend = "E/N/S/W - facades, cE..cW - courtyard facades, · - no photos"
+    return "\n\n".join(sections) + f"\n\n{legend}"
+
+
+def register_handlers(bot: AsyncTeleBot):
+    """
+    Register the /stats and /coverage command handlers.
+    """
+
+    @bot.message_handler(commands=["stats"])
+    async def handle_stats(message: Message):
+        """
+        Handle the /stats command - photo counts from the location catalog.
+        """
+        args = message.text.split()[1:]
+        fields = parse_location_args(args)
+        if fields is None:
+            await bot.send_message(message.chat.id, f"❌ Unknown location.\n\n{STATS_USAGE}", parse_mode='Markdown')
+            return
+
+        await bot.send_message(message.chat.id, build_stats_text(**fields), parse_mode='Markdown')
+        logger.info("User {user_id} requested stats for {location}", user_id=message.from_user.id, location=fields or "all locations")
+
+    @bot.message_handler(commands=["coverage"])
+    async def handle_coverage(message: Message):
+        """
+        Handle the /coverage command - which facade locations still lack photos.
+        """
+        fields = parse_location_args(message.text.split()[1:])
+        if fields is None or set(fields) - {'inspection', 'block'}:
+            await bot.send_message(message.chat.id, f"❌ Unknown location.\n\n{COVERAGE_USAGE}", parse_mode='Markdown')
+            return
+
+        await bot.send_message(message.chat.id, build_coverage_text(**fields), parse_mode='Markdown')
+        logger.info("User {user_id} requested coverage for {location}", user_id=message.from_user.id, location=fields or "all locations")
@@ -4,10 +4,12 @@ Keyboards module for the REN Facade Sorter bot.
 
 from .inline import (
     selection_menu,
-    post_upload_menu
+    post_upload_menu,
+    warm_keyboard_cache
 )
 
 __all__ = [
     "selection_menu",
-    "post_upload_menu"
+    "post_upload_menu",
+    "warm_keyboard_cache"
 ] 
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Compact callback_data protocol for inline buttons.
+
+callback_data is "<version><opcode><fields>", for example "1L0055" for
+"level BW / Block A / Courtyard_North / L5". Every field is a single
+character: the index of the value in the location grid (app.locations).
+The longest payload is 6 bytes, far below Telegram's 64-byte limit.
+
+decode() returns None for anything that is not a well-formed payload of the
+current version, so buttons of outdated menus are rejected without parsing.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from app.locations import BLOCKS, COURTYARD_ORIENTATIONS, INSPECTIONS, LEVELS, MAIN_ORIENTATIONS, orientations_for
+
+CALLBACK_VERSION = "1"
+
+OP_INSPECTION = "I"
+OP_BLOCK = "B"
+OP_ORIENTATION = "O"
+OP_LEVEL = "L"
+OP_CONFIRM = "C"
+OP_BACK_TO_SELECTION = "S"
+OP_BACK_TO_LEVEL = "V"
+OP_NEXT_LOCATION = "N"
+OP_START_OVER = "R"
+
+_ORIENTATIONS = MAIN_ORIENTATIONS + COURTYARD_ORIENTATIONS
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Поля каждой операции по порядку: имя поля и допустимые значения
+_FIELDS: Dict[str, Tuple[Tuple[str, Tuple[str, ...]], ...]] = {
+    OP_INSPECTION: (("inspection", INSPECTIONS),),
+    OP_BLOCK: (("block", BLOCKS),),
+    OP_ORIENTATION: (("orientation", _ORIENTATIONS),),
+    OP_LEVEL: (("inspection", INSPECTIONS), ("block", BLOCKS), ("orientation", _ORIENTATIONS), ("level", LEVELS)),
+    OP_CONFIRM: (("inspection", INSPECTIONS), ("block", BLOCKS), ("orientation", _ORIENTATIONS), ("level", LEVELS)),
+    OP_BACK_TO_SELECTION: (),
+    OP_BACK_TO_LEVEL: (("inspection", INSPECTIONS), ("block", BLOCKS), ("orientation", _ORIENTATIONS)),
+    OP_NEXT_LOCATION: (),
+    OP_START_OVER: (),
+}
+
+# Обратные таблицы: значение -> символ
+_CODES = {
+    values: {value: _DIGITS[index] for index, value in enumerate(values)}
+    for values in (INSPECTIONS, BLOCKS, _ORIENTATIONS, LEVELS)
+}
+
+
+@dataclass(frozen=True)
+class CallbackPayload:
+    """Decoded callback_data."""
+
+    op: str
+    inspection: Optional[str] = None
+    block: Optional[str] = None
+    orientation: Optional[str] = None
+    level: Optional[str] = None
+
+
+def encode(op: str, *values: str) -> str:
+    """
+    Build callback_data for an operation.
+
+    Args:
+        op: One of the OP_* opcodes
+        values: Field values in the order defined for the opcode
+    """
+    fields = _FIELDS[op]
+    if len(values) != len(fields):
+        raise ValueError(f"Opcode {op} expects {len(fields)} fields, got {len(values)}")
+    return CALLBACK_VERSION + op + "".join(_CODES[allowed][value] for (_, allowed), value in zip(fields, values))
+
+
+def decode(data: Optional[str]) -> Optional[CallbackPayload]:
+    """
+    Parse callback_data. Returns None for malformed or outdated payloads.
+    """
+    if not data or len(data) < 2 or data[0] != CALLBACK_VERSION:
+        return None
+    fields = _FIELDS.get(data[1])
+    if fields is None or len(data) != 2 + len(fields):
+        return None
+
+    values = {}
+    for (name, allowed), code in zip(fields, data[2:]):
+        index = _DIGITS.find(code)
+        if index < 0 or index >= len(allowed):
+            return None
+        values[name] = allowed[index]
+
+    # Courtyard-фасады есть только у блока A
+    if "block" in values and "orientation" in values and values["orientation"] not in orientations_for(values["block"]):
+        return None
+    return CallbackPayload(data[1], **values)
@@ -1,9 +1,33 @@
 """
 Inline keyboards for the REN Facade Sorter bot with radio button logic.
+
+The selection menu has a small finite set of states, so every keyboard is
+built and serialized once (see warm_keyboard_cache) and reused afterwards.
 """
 
+from functools import lru_cache
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from typing import Optional
+from typing import FrozenSet, Optional
+from app.keyboards.callback_data import (
+    OP_BLOCK, OP_CONFIRM, OP_INSPECTION, OP_LEVEL, OP_NEXT_LOCATION, OP_ORIENTATION, encode
+)
+from app.locations import BLOCKS, INSPECTIONS, iter_locations, orientations_for
+from app.services.catalog import catalog
+from config import settings
+
+
+class FrozenKeyboard(InlineKeyboardMarkup):
+    """
+    Shared, read-only keyboard whose JSON is serialized once.
+    Do not add rows to it; build a new InlineKeyboardMarkup instead.
+    """
+
+    def __init__(self, keyboard: InlineKeyboardMarkup):
+        super().__init__(inline_keyboard=keyboard.inline_keyboard, row_width=keyboard.row_width)
+        self._json = keyboard.to_json()
+
+    def to_json(self) -> str:
+        return self._json
 
 
 def selection_menu(
@@ -21,6 +45,46 @@ def selection_menu(
         orientation: Selected orientation
         level: Selected level
     """
+    covered = frozenset()
+    if orientation and settings.COVERAGE_LEVEL_MARKS:
+        # Уровни, для которых уже есть фото, отмечаются на кнопках
+        covered = catalog.covered_levels(inspection, block, orientation)
+    # Позиционные аргументы, чтобы вызовы с именованными аргументами попадали в тот же кэш
+    return _cached_selection_menu(inspection, block, orientation, level, covered)
+
+
+@lru_cache(maxsize=4096)
+def _cached_selection_menu(inspection, block, orientation, level, covered) -> FrozenKeyboard:
+    return FrozenKeyboard(_build_selection_menu(inspection, block, orientation, level, covered))
+
+
+def warm_keyboard_cache() -> int:
+    """
+    Build every reachable selection menu ahead of time.
+
+    Returns:
+        Number of cached keyboards
+    """
+    selection_menu()
+    for inspection in INSPECTIONS:
+        selection_menu(inspection)
+        for block in BLOCKS:
+            selection_menu(inspection, block)
+            for orientation in orientations_for(block):
+                selection_menu(inspection, block, orientation)
+    for location in iter_locations():
+        selection_menu(*location)
+    _post_upload_menu()
+    return _cached_selection_menu.cache_info().currsize
+
+
+def _build_selection_menu(
+    inspection: Optional[str],
+    block: Optional[str],
+    orientation: Optional[str],
+    level: Optional[str],
+    covered: FrozenSet[str] = frozenset()
+) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup()
     
     # First row - inspection selection
@@ -28,8 +92,8 @@ def selection_menu(
     bw_text = "✅ BW" if inspection == "BW" else "BW"
     sr_text = "✅ SR" if inspection == "SR" else "SR"
     
-    row1.append(InlineKeyboardButton(bw_text, callback_data="inspection_BW"))
-    row1.append(InlineKeyboardButton(sr_text, callback_data="inspection_SR"))
+    row1.append(InlineKeyboardButton(bw_text, callback_data=encode(OP_INSPECTION, "BW")))
+    row1.append(InlineKeyboardButton(sr_text, callback_data=encode(OP_INSPECTION, "SR")))
     keyboard.row(*row1)
     
     # Second row - block selection (shown only if inspection is selected)
@@ -38,8 +102,8 @@ def selection_menu(
         block_a_text = "✅ Block A" if block == "A" else "Block A"
         block_b_text = "✅ Block B" if block == "B" else "Block B"
         
-        row2.append(InlineKeyboardButton(block_a_text, callback_data="block_A"))
-        row2.append(InlineKeyboardButton(block_b_text, callback_data="block_B"))
+        row2.append(InlineKeyboardButton(block_a_text, callback_data=encode(OP_BLOCK, "A")))
+        row2.append(InlineKeyboardButton(block_b_text, callback_data=encode(OP_BLOCK, "B")))
         keyboard.row(*row2)
         
         # Directions (shown only if block is selected)
@@ -51,10 +115,10 @@ def selection_menu(
             south_text = "✅ South" if orientation == "South" else "🧭 South"
             west_text = "✅ West" if orientation == "West" else "🧭 West"
             
-            directions_row.append(InlineKeyboardButton(east_text, callback_data="orient_East"))
-            directions_row.append(InlineKeyboardButton(north_text, callback_data="orient_North"))
-            directions_row.append(InlineKeyboardButton(south_text, callback_data="orient_South"))
-            directions_row.append(InlineKeyboardButton(west_text, callback_data="orient_West"))
+            directions_row.append(InlineKeyboardButton(east_text, callback_data=encode(OP_ORIENTATION, "East")))
+            directions_row.append(InlineKeyboardButton(north_text, callback_data=encode(OP_ORIENTATION, "North")))
+            directions_row.append(InlineKeyboardButton(south_text, callback_data=encode(OP_ORIENTATION, "South")))
+            directions_row.append(InlineKeyboardButton(west_text, callback_data=encode(OP_ORIENTATION, "West")))
             keyboard.row(*directions_row)
 
             # Courtyard направления только для блока A
@@ -67,49 +131,57 @@ def selection_menu(
                 courtyard_south_text = "✅ Courtyard South" if orientation == "Courtyard_South" else "🏛️ Courtyard South"
                 courtyard_west_text = "✅ Courtyard West" if orientation == "Courtyard_West" else "🏛️ Courtyard West"
                 
-                row5.append(InlineKeyboardButton(courtyard_east_text, callback_data="orient_Courtyard_East"))
-                row5.append(InlineKeyboardButton(courtyard_north_text, callback_data="orient_Courtyard_North"))
+                row5.append(InlineKeyboardButton(courtyard_east_text, callback_data=encode(OP_ORIENTATION, "Courtyard_East")))
+                row5.append(InlineKeyboardButton(courtyard_north_text, callback_data=encode(OP_ORIENTATION, "Courtyard_North")))
                 keyboard.row(*row5)
                 
-                row6.append(InlineKeyboardButton(courtyard_south_text, callback_data="orient_Courtyard_South"))
-                row6.append(InlineKeyboardButton(courtyard_west_text, callback_data="orient_Courtyard_West"))
+                row6.append(InlineKeyboardButton(courtyard_south_text, callback_data=encode(OP_ORIENTATION, "Courtyard_South")))
+                row6.append(InlineKeyboardButton(courtyard_west_text, callback_data=encode(OP_ORIENTATION, "Courtyard_West")))
                 keyboard.row(*row6)
                 
             # Level selection (shown only if orientation is selected)
             if orientation:
                 # First row - GF to L3 (4 buttons)
                 level_row1 = []
-                gf_text = "✅ GF" if level == "GF" else "GF"
-                level_row1.append(InlineKeyboardButton(gf_text, callback_data=f"level_{inspection}_{block}_{orientation}_GF"))
+                gf_text = _level_text("GF", level, covered)
+                level_row1.append(InlineKeyboardButton(gf_text, callback_data=encode(OP_LEVEL, inspection, block, orientation, "GF")))
                 for i in range(1, 4):
-                    level_text = f"✅ L{i}" if level == f"L{i}" else f"L{i}"
-                    level_row1.append(InlineKeyboardButton(level_text, callback_data=f"level_{inspection}_{block}_{orientation}_L{i}"))
+                    level_text = _level_text(f"L{i}", level, covered)
+                    level_row1.append(InlineKeyboardButton(level_text, callback_data=encode(OP_LEVEL, inspection, block, orientation, f"L{i}")))
                 keyboard.row(*level_row1)
                 
                 # Second row - L4 to L7 (4 buttons)
                 level_row2 = []
                 for i in range(4, 8):
-                    level_text = f"✅ L{i}" if level == f"L{i}" else f"L{i}"
-                    level_row2.append(InlineKeyboardButton(level_text, callback_data=f"level_{inspection}_{block}_{orientation}_L{i}"))
+                    level_text = _level_text(f"L{i}", level, covered)
+                    level_row2.append(InlineKeyboardButton(level_text, callback_data=encode(OP_LEVEL, inspection, block, orientation, f"L{i}")))
                 keyboard.row(*level_row2)
                 
                 # Third row - L8 to L11 (4 buttons)
                 level_row3 = []
                 for i in range(8, 12):
-                    level_text = f"✅ L{i}" if level == f"L{i}" else f"L{i}"
-                    level_row3.append(InlineKeyboardButton(level_text, callback_data=f"level_{inspection}_{block}_{orientation}_L{i}"))
+                    level_text = _level_text(f"L{i}", level, covered)
+                    level_row3.append(InlineKeyboardButton(level_text, callback_data=encode(OP_LEVEL, inspection, block, orientation, f"L{i}")))
                 keyboard.row(*level_row3)
                 
                 # Show confirm button when all parameters are selected
                 if level:
                     keyboard.add(
                         InlineKeyboardButton("📎 Upload Pictures", 
-                                           callback_data=f"confirm_{inspection}_{block}_{orientation}_{level}")
+                                           callback_data=encode(OP_CONFIRM, inspection, block, orientation, level))
                     )
     
     return keyboard
 
 
+def _level_text(value: str, level: Optional[str], covered: FrozenSet[str]) -> str:
+    if value == level:
+        return f"✅ {value}"
+    if value in covered:
+        return f"☑️ {value}"
+    return value
+
+
 def post_upload_menu(inspection: str, block: str, orientation: str, level: str) -> InlineKeyboardMarkup:
     """
     Menu shown after successful photo upload with options to continue.
@@ -120,10 +192,16 @@ def post_upload_menu(inspection: str, block: str, orientation: str, level: str)
         orientation: Current orientation
         level: Current level
     """
+    # Меню не зависит от локации, поэтому строится один раз
+    return _post_upload_menu()
+
+
+@lru_cache(maxsize=1)
+def _post_upload_menu() -> FrozenKeyboard:
     keyboard = InlineKeyboardMarkup(row_width=1)
     
     keyboard.add(
-        InlineKeyboardButton("🏠 Another Location", callback_data="next_location")
+        InlineKeyboardButton("🏠 Another Location", callback_data=encode(OP_NEXT_LOCATION))
     )
     
-    return keyboard
\ No newline at end of file
+    return FrozenKeyboard(keyboard)
\ No newline at end of file
@@ -0,0 +1,48 @@
+"""
+Location grid of the structure inspections: inspection, block, facade orientation and level.
+"""
+
+import os
+from typing import Iterator, Tuple
+
+# Папка несортированных снимков в каждой локации
+UNSORTED_DIR = "unsorted"
+
+INSPECTIONS = ("BW", "SR")
+BLOCKS = ("A", "B")
+
+# Основные направления есть у всех блоков
+MAIN_ORIENTATIONS = ("East", "North", "South", "West")
+# Фасады внутреннего двора есть только у блока A
+COURTYARD_ORIENTATIONS = ("Courtyard_East", "Courtyard_North", "Courtyard_South", "Courtyard_West")
+
+LEVELS = ("GF",) + tuple(f"L{i}" for i in range(1, 12))
+
+Location = Tuple[str, str, str, str]
+
+
+def orientations_for(block: str) -> Tuple[str, ...]:
+    """
+    Facade orientations available for a block.
+    """
+    if block == "A":
+        return MAIN_ORIENTATIONS + COURTYARD_ORIENTATIONS
+    return MAIN_ORIENTATIONS
+
+
+def iter_locations() -> Iterator[Location]:
+    """
+    Yield every (inspection, block, orientation, level) of the grid.
+    """
+    for inspection in INSPECTIONS:
+        for block in BLOCKS:
+            for orientation in orientations_for(block):
+                for level in LEVELS:
+                    yield inspection, block, orientation, level
+
+
+def location_path(root: str, inspection: str, block: str, orientation: str, level: str) -> str:
+    """
+    Folder receiving uploads for a location: {root}/{Inspection}/{Block}/{Level}/{Orientation}/unsorted.
+    """
+    return os.path.join(root, inspection, block, level, orientation, UNSORTED_DIR)
@@ -12,6 +12,8 @@ HELP_MESSAGE = """🆘 *REN Facade Sorter Bot Help*
 • `/start` - start working with the bot
 • `/help` - show this help
 • `/cancel` - cancel current operation
+• `/stats` - photo counts, e.g. `/stats BW A` or `/stats BW A East L5`
+• `/coverage` - which facade locations still lack photos, e.g. `/coverage BW A`
 
 *Photo upload process:*
 1. *Choose inspection* - BW or SR
@@ -0,0 +1,11 @@
+"""
+Update middlewares for the REN Facade Sorter bot.
+"""
+
+from .metrics import UpdateMetricsMiddleware
+from .timing import HandlerTimingMiddleware
+
+__all__ = [
+    "UpdateMetricsMiddleware",
+    "HandlerTimingMiddleware"
+]
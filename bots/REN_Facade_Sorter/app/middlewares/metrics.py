@@ -0,0 +1,35 @@
+"""
+Middleware counting incoming updates for the metrics endpoint.
+"""
+
+from telebot.asyncio_handler_backends import BaseMiddleware
+from app.services.metrics import updates_total
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Counts every message, edited message and callback query by type.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.update_sensitive = True
+        self.update_types = ['message', 'edited_message', 'callback_query']
+
+    async def pre_process_message(self, message, data):
+        updates_total.inc(type='message', content_type=message.content_type)
+
+    async def pre_process_edited_message(self, message, data):
+        updates_total.inc(type='edited_message', content_type=message.content_type)
+
+    async def pre_process_callback_query(self, call, data):
+        updates_total.inc(type='callback_query', content_type='')
+
+    async def post_process_message(self, message, data, exception):
+        pass
+
+    async def post_process_edited_message(self, message, data, exception):
+        pass
+
+    async def post_process_callback_query(self, call, data, exception):
+        pass
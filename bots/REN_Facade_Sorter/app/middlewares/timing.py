@@ -0,0 +1,116 @@
+"""
+Middleware timing every message and callback handler.
+
+Each update gets a trace (app.services.tracing) with the wall time of its
+FSM, Bot API and file I/O sub-steps. Handlers slower than
+HANDLER_SLOW_THRESHOLD seconds are logged with their span breakdown, and a
+HANDLER_PROFILE_RATE share of updates is profiled (cProfile, or pyinstrument
+if selected and installed) into HANDLER_PROFILE_DIR. A profiler sees the
+whole event loop thread, so a capture also contains other updates processed
+meanwhile; only one capture runs at a time.
+"""
+
+import os
+import random
+import cProfile
+from datetime import datetime
+from telebot.asyncio_handler_backends import BaseMiddleware
+from telebot.types import CallbackQuery, Message
+from app.services import file_io
+from app.services.metrics import handler_seconds
+from app.services.tracing import start_trace
+from app.utils.logger import logger
+from config import settings
+
+try:
+    from pyinstrument import Profiler as InstrumentProfiler
+except ImportError:
+    InstrumentProfiler = None
+
+
+def update_name(update) -> str:
+    """
+    Initial trace name: the command, the message content type or "callback".
+    Callback dispatch renames the trace to the pressed button's action.
+    """
+    if isinstance(update, CallbackQuery):
+        return "callback"
+    if isinstance(update, Message):
+        if update.content_type == 'text' and update.text and update.text.startswith('/'):
+            return update.text.split()[0].split('@')[0]
+        return f"message:{update.content_type}"
+    return type(update).__name__
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Traces every update, logs slow handlers and writes sampled profiles.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['message', 'edited_message', 'callback_query']
+        self._profiling = False
+
+    def _start_profiler(self):
+        if self._profiling or random.random() >= settings.HANDLER_PROFILE_RATE:
+            return None
+        self._profiling = True
+        if settings.HANDLER_PROFILER == "pyinstrument" and InstrumentProfiler is not None:
+            profiler = InstrumentProfiler(async_mode="enabled")
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, profiler):
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        else:
+            profiler.stop()
+        self._profiling = False
+
+    async def pre_process(self, update, data):
+        data['trace'] = start_trace(update_name(update))
+        data['profiler'] = self._start_profiler()
+
+    async def post_process(self, update, data, exception):
+        trace = data.get('trace')
+        profiler = data.get('profiler')
+        if profiler is not None:
+            self._stop_profiler(profiler)
+        if trace is None:
+            return
+
+        duration = trace.finish()
+        # Текст команды задает пользователь, в метку метрики он не попадает
+        handler_seconds.observe(duration, handler="command" if trace.name.startswith("/") else trace.name)
+
+        if duration >= settings.HANDLER_SLOW_THRESHOLD:
+            spans = {name: {"calls": calls, "ms": round(total * 1000, 1)} for name, (calls, total) in trace.breakdown().items()}
+            summary = ", ".join(f"{name} {info['ms']:.0f} ms ({info['calls']}x)" for name, info in spans.items())
+            logger.bind(spans=spans).warning(
+                "Slow handler {handler}: {duration_ms:.0f} ms - {summary}",
+                handler=trace.name, duration_ms=round(duration * 1000, 1), summary=summary
+            )
+
+        if profiler is not None:
+            try:
+                await file_io.run_io(self._save_profile, profiler, trace.name, duration)
+            except Exception as e:
+                logger.warning("Failed to save handler profile: {error}", error=e)
+
+    @staticmethod
+    def _save_profile(profiler, name: str, duration: float):
+        os.makedirs(settings.HANDLER_PROFILE_DIR, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_")
+        base = os.path.join(
+            settings.HANDLER_PROFILE_DIR,
+            f"{datetime.now():%Y%m%d_%H%M%S_%f}_{safe_name}_{duration * 1000:.0f}ms"
+        )
+        if isinstance(profiler, cProfile.Profile):
+            profiler.dump_stats(base + ".prof")
+        else:
+            with open(base + ".html", "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
@@ -0,0 +1,3 @@
+"""
+Business logic services for the REN Facade Sorter bot.
+"""
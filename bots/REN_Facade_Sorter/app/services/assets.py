@@ -0,0 +1,192 @@
+"""
+Telegram file_id cache for the building scheme images.
+
+Each scheme is uploaded once; the file_id Telegram returns is remembered and
+sent instead of the image bytes on every later /start, block selection and
+back navigation. The cache is persisted to ASSET_CACHE_PATH and an entry is
+invalidated when the image changes on disk (mtime/size, confirmed by SHA-256).
+"""
+
+import os
+import json
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Union
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import InputMediaPhoto, Message
+from app.services import file_io
+from app.utils.logger import logger
+from config import settings
+
+SCHEME_DIR = os.path.join("app", "assets", "images", "scheme")
+GENERAL_SCHEME = "scheme.png"
+
+
+def block_scheme(block: str) -> str:
+    """
+    File name of the scheme image for a building block.
+    """
+    return f"scheme_block_{block}.png"
+
+
+def scheme_path(name: str) -> str:
+    return os.path.join(SCHEME_DIR, name)
+
+
+@dataclass
+class SchemeMedia:
+    """What to send for a scheme: a cached file_id or the raw bytes."""
+
+    name: str
+    payload: Union[str, bytes]
+    mtime_ns: int
+    size: int
+    sha256: Optional[str] = None
+
+    @property
+    def cached(self) -> bool:
+        return isinstance(self.payload, str)
+
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+class SchemeRegistry:
+    """
+    Registry of uploaded scheme images keyed by file name.
+    """
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self._bot_id: Optional[str] = None
+        self._entries: Dict[str, dict] = {}
+        # Параллельные сохранения пишут через один и тот же .tmp файл
+        self._lock = threading.Lock()
+
+    async def load(self, token: str):
+        """
+        Load the persisted cache. file_ids are only valid for the bot that
+        uploaded them, so entries saved under another token are discarded.
+        """
+        self._bot_id = token.split(':')[0]
+        raw = await file_io.read_optional(self.cache_path)
+        if raw is None:
+            return
+        try:
+            data = json.loads(raw)
+        except ValueError as e:
+            logger.warning("Ignoring corrupt asset cache {path}: {error}", path=self.cache_path, error=e)
+            return
+        if data.get('bot_id') == self._bot_id:
+            self._entries = data.get('entries', {})
+            logger.info("Loaded {entries} cached scheme file_ids", entries=len(self._entries))
+
+    async def _save(self):
+        payload = json.dumps({'bot_id': self._bot_id, 'entries': self._entries}, indent=2)
+
+        def _write():
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp_path = self.cache_path + ".tmp"
+            with self._lock:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                os.replace(tmp_path, self.cache_path)
+
+        await file_io.run_io(_write)
+
+    async def resolve(self, name: str) -> Optional[SchemeMedia]:
+        """
+        Return the media to send for a scheme, or None if the image is missing.
+        """
+        stat = await file_io.run_io(_stat, scheme_path(name))
+        if stat is None:
+            return None
+
+        entry = self._entries.get(name)
+        if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return SchemeMedia(name, entry['file_id'], stat.st_mtime_ns, stat.st_size, entry['sha256'])
+
+        data = await file_io.read_optional(scheme_path(name))
+        if data is None:
+            return None
+        sha256 = hashlib.sha256(data).hexdigest()
+
+        if entry and entry['sha256'] == sha256:
+            # Файл "тронули", но содержимое не изменилось
+            entry.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            await self._save()
+            return SchemeMedia(name, entry['file_id'], stat.st_mtime_ns, stat.st_size, sha256)
+
+        return SchemeMedia(name, data, stat.st_mtime_ns, stat.st_size, sha256)
+
+    async def remember(self, media: SchemeMedia, message: Message):
+        """
+        Record the file_id of a freshly uploaded scheme.
+        """
+        if media.cached or not isinstance(message, Message) or not message.photo:
+            return
+        self._entries[media.name] = {
+            'file_id': message.photo[-1].file_id,
+            'mtime_ns': media.mtime_ns,
+            'size': media.size,
+            'sha256': media.sha256,
+        }
+        await self._save()
+        logger.info("Cached file_id for scheme {scheme}", scheme=media.name)
+
+    async def invalidate(self, name: str):
+        if self._entries.pop(name, None) is not None:
+            await self._save()
+
+
+scheme_registry = SchemeRegistry(settings.ASSET_CACHE_PATH)
+
+
+async def _with_fallback(name: str, send):
+    """
+    Send a scheme, re-uploading it if Telegram rejects a stale file_id.
+    """
+    media = await scheme_registry.resolve(name)
+    if media is None:
+        return None
+    try:
+        result = await send(media.payload)
+    except ApiTelegramException as e:
+        if e.error_code == 400 and "message is not modified" in e.description:
+            # Схема уже показана в этом сообщении
+            return True
+        if not media.cached or e.error_code != 400:
+            raise
+        logger.warning("Cached file_id for scheme {scheme} rejected, re-uploading: {error}", scheme=name, error=e.description)
+        await scheme_registry.invalidate(name)
+        media = await scheme_registry.resolve(name)
+        if media is None:
+            return None
+        result = await send(media.payload)
+    await scheme_registry.remember(media, result)
+    return result
+
+
+async def send_scheme(bot: AsyncTeleBot, chat_id: int, name: str, **kwargs) -> Optional[Message]:
+    """
+    send_photo with a scheme image. Returns None if the image is missing.
+    """
+    return await _with_fallback(name, lambda photo: bot.send_photo(chat_id, photo, **kwargs))
+
+
+async def edit_scheme(bot: AsyncTeleBot, chat_id: int, message_id: int, name: str,
+                      caption: str, reply_markup=None) -> Union[Message, bool, None]:
+    """
+    edit_message_media to a scheme image. Returns None if the image is missing.
+    """
+    async def send(photo):
+        media = InputMediaPhoto(photo, caption=caption, parse_mode='Markdown')
+        return await bot.edit_message_media(media, chat_id, message_id, reply_markup=reply_markup)
+
+    return await _with_fallback(name, send)
@@ -0,0 +1,141 @@
+"""
+In-memory catalog of stored photos per location.
+
+For every (inspection, block, orientation, level) of the location grid the
+catalog keeps the number of files, their total size and the time of the last
+upload. It is built once at startup by scanning all location folders in
+parallel on the I/O executor (with s3 storage, by one listing of the bucket)
+and is then kept current by the upload queue's post-save stage, so queries
+never touch the storage.
+"""
+
+import os
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, FrozenSet, List, Optional
+from app.locations import LEVELS, UNSORTED_DIR, Location, iter_locations, location_path
+from app.services.photo_storage import StoredFile, photo_storage
+from app.utils.logger import logger
+
+
+@dataclass
+class LocationStats:
+    """Counters of one location (or an aggregate of several)."""
+
+    files: int = 0
+    bytes: int = 0
+    last_upload: Optional[datetime] = None
+
+    def add(self, files: int, size: int, modified: Optional[datetime]):
+        self.files += files
+        self.bytes += size
+        if modified and (self.last_upload is None or modified > self.last_upload):
+            self.last_upload = modified
+
+    def merge(self, other: "LocationStats"):
+        self.add(other.files, other.bytes, other.last_upload)
+
+
+def _stats_of(files: List[StoredFile]) -> LocationStats:
+    stats = LocationStats()
+    for _, size, modified in files:
+        stats.add(1, size, modified)
+    return stats
+
+
+def _location_of(path: str, root: str) -> Optional[Location]:
+    # {root}/{Inspection}/{Block}/{Level}/{Orientation}/unsorted/{filename}
+    parts = os.path.relpath(path, root).split(os.sep)
+    if len(parts) != 6 or parts[4] != UNSORTED_DIR:
+        return None
+    inspection, block, level, orientation = parts[:4]
+    return inspection, block, orientation, level
+
+
+class LocationCatalog:
+    """
+    Photo counts, byte totals and last upload time per location.
+    """
+
+    def __init__(self):
+        self._stats: Dict[Location, LocationStats] = {}
+        self.root: Optional[str] = None
+        self.built_at: Optional[datetime] = None
+
+    async def build(self, root: str):
+        """
+        Scan every location folder under root in parallel.
+        """
+        if photo_storage.local:
+            locations = list(iter_locations())
+            results = await asyncio.gather(
+                *(photo_storage.list_files(location_path(root, *location)) for location in locations)
+            )
+            self._stats = {location: _stats_of(files) for location, files in zip(locations, results) if files}
+        else:
+            # В S3 один листинг всего дерева дешевле запроса на каждую локацию
+            self._stats = {}
+            for path, size, modified in await photo_storage.list_files(root):
+                location = _location_of(path, root)
+                if location is not None:
+                    self._stats.setdefault(location, LocationStats()).add(1, size, modified)
+        self.root = root
+        self.built_at = datetime.now()
+        total = self.total()
+        logger.info("Catalog built: {files} files, {megabytes:.1f} MB in {locations} locations",
+                    files=total.files, megabytes=total.bytes / (1024 * 1024), locations=len(self._stats))
+
+    def record(self, location: Location, size: int, uploaded_at: Optional[datetime] = None):
+        """
+        Count a newly stored file.
+        """
+        self._stats.setdefault(location, LocationStats()).add(1, size, uploaded_at or datetime.now())
+
+    async def on_saved(self, job, result):
+        """
+        Upload queue listener: count every new file.
+        """
+        if result.skipped:
+            return
+        size = result.bytes_downloaded
+        if not size:
+            # Связанный дубликат: размер берем у файла
+            size = await photo_storage.size(os.path.join(job.save_path, result.filename))
+        self.record((job.inspection, job.block, job.orientation, job.level), size)
+
+    # --- queries ---
+
+    def get(self, inspection: Optional[str] = None, block: Optional[str] = None,
+            orientation: Optional[str] = None, level: Optional[str] = None) -> LocationStats:
+        """
+        Counters of a location. Omitted parts are aggregated, e.g.
+        get("BW", "A") covers every orientation and level of BW / Block A.
+        """
+        if None not in (inspection, block, orientation, level):
+            stats = self._stats.get((inspection, block, orientation, level))
+            return LocationStats(stats.files, stats.bytes, stats.last_upload) if stats else LocationStats()
+
+        pattern = (inspection, block, orientation, level)
+        result = LocationStats()
+        for location, stats in self._stats.items():
+            if all(wanted is None or wanted == value for wanted, value in zip(pattern, location)):
+                result.merge(stats)
+        return result
+
+    def total(self) -> LocationStats:
+        return self.get()
+
+    def covered_levels(self, inspection: str, block: str, orientation: str) -> FrozenSet[str]:
+        """Levels of a facade that already have photos."""
+        return frozenset(
+            level for level in LEVELS
+            if (inspection, block, orientation, level) in self._stats
+        )
+
+    def counts(self) -> Dict[Location, int]:
+        """Number of files per location (locations without files are omitted)."""
+        return {location: stats.files for location, stats in self._stats.items()}
+
+
+catalog = LocationCatalog()
@@ -0,0 +1,102 @@
+"""
+Persistent duplicate index for saved photos.
+
+Maps Telegram's file_unique_id and the SHA-256 of the content to the path the
+file was stored at, so a forwarded or re-sent photo is recognised before
+get_file is called and is skipped (same location) or hard-linked (another
+location) instead of being downloaded again.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Optional
+from app.services import file_io
+from app.services.photo_storage import photo_storage
+from app.utils.logger import logger
+from config import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_unique_id TEXT PRIMARY KEY,
+    sha256 TEXT,
+    path TEXT NOT NULL,
+    size INTEGER,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256);
+"""
+
+
+class DedupIndex:
+    """
+    SQLite-backed index of stored files. All queries run on the I/O executor.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _query_one(self, sql: str, params: tuple) -> Optional[str]:
+        with self._lock:
+            row = self._connect().execute(sql, params).fetchone()
+        return row[0] if row else None
+
+    async def _find(self, sql: str, params: tuple) -> Optional[str]:
+        path = await file_io.run_io(self._query_one, sql, params)
+        if path and await photo_storage.exists(path):
+            return path
+        return None
+
+    async def find_by_unique_id(self, file_unique_id: str) -> Optional[str]:
+        """
+        Return the stored path for file_unique_id if the file still exists.
+        """
+        return await self._find("SELECT path FROM files WHERE file_unique_id = ?", (file_unique_id,))
+
+    async def find_by_hash(self, sha256: str) -> Optional[str]:
+        """
+        Return a stored path with the same content if the file still exists.
+        """
+        return await self._find("SELECT path FROM files WHERE sha256 = ? ORDER BY created_at LIMIT 1", (sha256,))
+
+    def _add(self, file_unique_id: str, sha256: Optional[str], path: str, size: Optional[int]):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO files (file_unique_id, sha256, path, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                (file_unique_id, sha256, path, size, datetime.now().isoformat())
+            )
+            conn.commit()
+
+    async def add(self, file_unique_id: str, sha256: Optional[str], path: str, size: Optional[int] = None):
+        await file_io.run_io(self._add, file_unique_id, sha256, path, size)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+async def link_existing(src: str, dst: str):
+    """
+    Place an already stored file at dst (hard link falling back to a copy,
+    or a server-side copy in S3). An existing file at dst is replaced atomically.
+    """
+    await photo_storage.link(src, dst)
+    logger.debug("Linked duplicate {src} -> {dst}", src=src, dst=dst, sample="duplicate_link")
+
+
+dedup_index = DedupIndex(settings.DEDUP_DB_PATH)
@@ -0,0 +1,291 @@
+"""
+Single-file download primitives for uploaded photos.
+
+Scheduling, concurrency and retries live in app.services.upload_queue.
+Files of a local Bot API server are taken from its disk (app.services.local_files).
+Data is written through the configured backend (app.services.photo_storage).
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiHTTPException, ApiTelegramException
+from app.services import file_io
+from app.services.dedup import dedup_index, link_existing
+from app.services.http_pools import bulk_pool
+from app.services.local_files import ingest, local_source
+from app.services.metrics import (
+    bytes_written_total, disk_write_seconds, download_seconds, download_throughput, get_file_seconds
+)
+from app.services.photo_storage import photo_storage
+from app.utils.logger import logger
+from config import settings
+
+
+@dataclass
+class DownloadResult:
+    """Outcome of a single file download."""
+
+    index: int
+    photo_info: dict
+    filename: Optional[str] = None
+    error: Optional[Exception] = None
+    done: bool = False
+    duplicate: bool = False
+    skipped: bool = False
+    staged: bool = False
+    bytes_downloaded: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.done and self.error is None
+
+
+# Скачивания, идущие в данный момент (метрика active_downloads)
+_active_downloads = 0
+
+
+def active_downloads() -> int:
+    """Number of files being downloaded over HTTP right now."""
+    return _active_downloads
+
+
+def build_filename(index: int, photo_info: dict) -> str:
+    """
+    Generate the file name for a saved photo.
+
+    Args:
+        index: 1-based position of the photo in the upload
+        photo_info: Photo info dictionary
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    if photo_info['type'] == 'document' and 'file_name' in photo_info:
+        # Для документов сохраняем оригинальное расширение
+        extension = os.path.splitext(photo_info['file_name'])[1] or '.jpg'
+    else:
+        # Для фотографий используем .jpg
+        extension = '.jpg'
+
+    return f"{timestamp}_{index:03d}_{photo_info['file_unique_id']}{extension}"
+
+
+def _file_url(token: str, file_path: str) -> str:
+    """
+    Build the download URL, honouring a custom telebot FILE_URL.
+    """
+    if asyncio_helper.FILE_URL is None:
+        return "https://api.telegram.org/file/bot{0}/{1}".format(token, file_path)
+    return asyncio_helper.FILE_URL.format(token, file_path)
+
+
+async def stream_download(bot: AsyncTeleBot, file_path: str, destination: str,
+                          on_chunk: Optional[Callable[[bytes], None]] = None, durable: bool = False) -> int:
+    """
+    Stream a file from the Telegram file endpoint straight to storage.
+
+    The body is read in DOWNLOAD_CHUNK_SIZE pieces, so memory per transfer is
+    bounded by the chunk size (plus one S3_PART_SIZE part with s3 storage).
+    The file appears at destination only once the transfer completes: locally
+    a ".part" file is renamed into place, in S3 the upload is completed.
+
+    Args:
+        bot: Telegram bot instance
+        file_path: file_path returned by get_file
+        destination: Full path of the target file
+        on_chunk: Called with every chunk written
+        durable: fsync the file and its directory before returning
+
+    Returns:
+        Number of bytes written
+    """
+    global _active_downloads
+    url = _file_url(bot.token, file_path)
+    writer = None
+    written = 0
+    # Время записи на диск считается отдельно от времени скачивания
+    disk_time = 0.0
+    started = time.perf_counter()
+
+    # Скачивания идут через отдельный пул и не занимают соединения API
+    session = await bulk_pool.get_session()
+    _active_downloads += 1
+    try:
+        async with session.get(url, proxy=asyncio_helper.proxy) as response:
+            if response.status != 200:
+                raise ApiHTTPException('Download file', response)
+
+            writer = await photo_storage.open_writer(destination, durable)
+            async for chunk in response.content.iter_chunked(settings.DOWNLOAD_CHUNK_SIZE):
+                write_started = time.perf_counter()
+                await writer.write(chunk)
+                disk_time += time.perf_counter() - write_started
+                written += len(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+
+        write_started = time.perf_counter()
+        await writer.commit()
+        disk_time += time.perf_counter() - write_started
+    except BaseException:
+        if writer is not None:
+            await asyncio.shield(writer.abort())
+        raise
+    finally:
+        _active_downloads -= 1
+
+    duration = time.perf_counter() - started
+    download_seconds.observe(duration)
+    if duration > 0:
+        download_throughput.observe(written / duration)
+    disk_write_seconds.observe(disk_time)
+    bytes_written_total.inc(written)
+    return written
+
+
+async def upload_local(source: str, destination: str, on_chunk: Optional[Callable[[bytes], None]] = None) -> int:
+    """
+    Copy a local server file to non-local storage, chunk by chunk.
+
+    Returns:
+        Number of bytes written
+    """
+    written = 0
+    started = time.perf_counter()
+    writer = await photo_storage.open_writer(destination)
+    try:
+        async with await file_io.AsyncFile.open(source, 'rb') as f:
+            while chunk := await f.read(settings.DOWNLOAD_CHUNK_SIZE):
+                await writer.write(chunk)
+                written += len(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+        await writer.commit()
+    except BaseException:
+        await asyncio.shield(writer.abort())
+        raise
+
+    disk_write_seconds.observe(time.perf_counter() - started)
+    bytes_written_total.inc(written)
+    return written
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Client-side API errors (e.g. "file is too big") will not succeed on retry.
+    """
+    if isinstance(error, ApiTelegramException):
+        return error.error_code == 429 or error.error_code >= 500
+    return True
+
+
+def _same_dir(path: str, directory: str) -> bool:
+    return os.path.normpath(os.path.dirname(path)) == os.path.normpath(directory)
+
+
+async def _resolve_known(result: DownloadResult, existing: str, save_path: str, destination: Optional[str] = None):
+    """
+    Use an already stored copy instead of a new download.
+
+    In the same location the file is simply skipped; in another location the
+    stored copy is hard-linked under a new name.
+    """
+    result.duplicate = True
+    if _same_dir(existing, save_path):
+        if destination:
+            await photo_storage.remove(destination)
+        result.filename = os.path.basename(existing)
+        # Новый файл не появился: в папке уже есть этот снимок
+        result.skipped = True
+        return
+
+    filename = os.path.basename(destination) if destination else build_filename(result.index, result.photo_info)
+    await link_existing(existing, os.path.join(save_path, filename))
+    result.filename = filename
+
+
+async def download_one(bot: AsyncTeleBot, result: DownloadResult, save_path: str,
+                       staging_dir: Optional[str] = None):
+    """
+    Make one attempt to download a file into save_path.
+
+    Known duplicates are resolved without calling get_file. With staging_dir
+    a new file is written durably there instead and result.staged is set;
+    moving it to save_path is up to the caller. On success result.filename
+    (and result.duplicate) are set; errors are raised to the caller, which
+    owns the retry policy.
+    """
+    file_unique_id = result.photo_info['file_unique_id']
+    result.duplicate = False
+    result.skipped = False
+    result.staged = False
+
+    if settings.DEDUP_ENABLED:
+        # Дубликат определяется до вызова get_file
+        try:
+            existing = await dedup_index.find_by_unique_id(file_unique_id)
+            if existing:
+                await _resolve_known(result, existing, save_path)
+                logger.debug("File {file_unique_id} already stored at {existing}, not downloading again",
+                             file_unique_id=file_unique_id, existing=existing, sample="duplicate")
+                return
+        except Exception as e:
+            logger.warning("Dedup lookup failed for {file_unique_id}, downloading: {error}",
+                           file_unique_id=file_unique_id, error=e)
+            result.duplicate = False
+
+    started = time.perf_counter()
+    file_path = await bot.get_file(result.photo_info['file_id'])
+    get_file_seconds.observe(time.perf_counter() - started)
+
+    filename = build_filename(result.index, result.photo_info)
+    destination = os.path.join(save_path, filename)
+    # Новый файл пишется в промежуточную папку, если она задана
+    target = os.path.join(staging_dir, filename) if staging_dir else destination
+    result.bytes_downloaded = 0
+    source = local_source(file_path.file_path)
+    hasher = hashlib.sha256()
+
+    def on_chunk(chunk: bytes):
+        hasher.update(chunk)
+        result.bytes_downloaded += len(chunk)
+
+    if source is not None and photo_storage.local:
+        # Локальный сервер Bot API: файл уже на диске, HTTP не нужен
+        result.bytes_downloaded, sha256 = await ingest(source, target, hash_content=settings.DEDUP_ENABLED,
+                                                       durable=staging_dir is not None)
+    elif source is not None:
+        # Файл локального сервера отправляется в хранилище без скачивания
+        await upload_local(source, target, on_chunk=on_chunk)
+        sha256 = hasher.hexdigest()
+    else:
+        await stream_download(bot, file_path.file_path, target, on_chunk=on_chunk, durable=staging_dir is not None)
+        sha256 = hasher.hexdigest()
+    result.filename = filename
+    result.staged = staging_dir is not None
+
+    if not settings.DEDUP_ENABLED:
+        return
+
+    stored_path = destination
+    try:
+        # Тот же контент под другим file_unique_id (например, фото и документ)
+        existing = await dedup_index.find_by_hash(sha256) if sha256 else None
+        if existing and os.path.normpath(existing) != os.path.normpath(destination):
+            await _resolve_known(result, existing, save_path, destination)
+            stored_path = existing
+            if result.staged:
+                # Сохранена ссылка на существующий файл, скачанная копия не нужна
+                await file_io.remove(target)
+                result.staged = False
+        await dedup_index.add(file_unique_id, sha256, stored_path, result.bytes_downloaded)
+    except Exception as e:
+        # Индекс дубликатов не должен ломать сохранение
+        logger.warning("Dedup index update failed for {file_unique_id}: {error}",
+                       file_unique_id=file_unique_id, error=e)
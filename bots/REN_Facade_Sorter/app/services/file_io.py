@@ -0,0 +1,147 @@
+"""
+Dedicated thread pool for blocking filesystem work.
+
+Handlers must not touch the disk directly: a slow network share would stall
+the event loop and every other user's updates with it. All file operations
+go through the coroutines below, which run on a bounded ThreadPoolExecutor
+sized by IO_WORKERS.
+"""
+
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Optional
+from app.services.tracing import span
+from config import settings
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Return the shared I/O executor, creating it on first use.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IO_WORKERS, thread_name_prefix="file_io")
+    return _executor
+
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a blocking callable on the I/O executor and await its result.
+    """
+    loop = asyncio.get_running_loop()
+    with span(f"io:{getattr(func, '__name__', 'call')}"):
+        return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown(wait: bool = True):
+    """
+    Shut down the I/O executor (called on bot stop).
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+
+async def makedirs(path: str):
+    await run_io(os.makedirs, path, exist_ok=True)
+
+
+async def exists(path: str) -> bool:
+    return await run_io(os.path.exists, path)
+
+
+async def replace(src: str, dst: str):
+    await run_io(os.replace, src, dst)
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+async def fsync_dir(path: str):
+    """
+    Persist renames in a directory (no-op where directories cannot be opened).
+    """
+    if os.name == "posix":
+        await run_io(_fsync_dir, path)
+
+
+async def remove(path: str, missing_ok: bool = True):
+    try:
+        await run_io(os.remove, path)
+    except FileNotFoundError:
+        if not missing_ok:
+            raise
+
+
+def _read_optional(path: str) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+async def read_optional(path: str) -> Optional[bytes]:
+    """
+    Read a whole file, or return None if it does not exist.
+    """
+    return await run_io(_read_optional, path)
+
+
+async def write_bytes(path: str, data: bytes):
+    def _write():
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    await run_io(_write)
+
+
+class AsyncFile:
+    """
+    Minimal async wrapper around a binary file object.
+
+    Every call is dispatched to the I/O executor, so a chunked download can be
+    written without blocking the event loop.
+    """
+
+    def __init__(self, file: BinaryIO):
+        self._file = file
+
+    @classmethod
+    async def open(cls, path: str, mode: str = 'rb') -> "AsyncFile":
+        return cls(await run_io(open, path, mode))
+
+    async def write(self, data: bytes) -> int:
+        return await run_io(self._file.write, data)
+
+    async def read(self, size: int = -1) -> bytes:
+        return await run_io(self._file.read, size)
+
+    async def sync(self):
+        """
+        Flush buffered data and fsync it to disk.
+        """
+        def _sync():
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+        await run_io(_sync)
+
+    async def close(self):
+        await run_io(self._file.close)
+
+    async def __aenter__(self) -> "AsyncFile":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
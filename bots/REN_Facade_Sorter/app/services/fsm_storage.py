@@ -0,0 +1,202 @@
+"""
+FSM storage backends.
+
+create_storage() builds the storage selected by FSM_STORAGE:
+
+- memory: telebot's StateMemoryStorage, lost on restart;
+- sqlite: SQLiteStateStorage below, an in-memory cache with write-behind
+  batching to FSM_SQLITE_PATH, so state survives restarts;
+- redis: telebot's StateRedisStorage configured from REDIS_* settings
+  (requires the optional redis package).
+"""
+
+import os
+import json
+import asyncio
+import sqlite3
+from datetime import datetime
+from typing import Optional, Set
+from telebot.asyncio_storage import StateMemoryStorage, StateStorageBase
+from app.services import file_io
+from app.utils.logger import logger
+from config import settings
+
+STORAGE_PREFIX = "ren_facade_sorter_bot_"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+
+class SQLiteStateStorage(StateMemoryStorage):
+    """
+    State storage that serves reads and writes from memory and persists
+    changed keys to SQLite in batches every flush_interval seconds.
+
+    Changes made within the last flush interval may be lost on a crash;
+    a clean shutdown (close()) flushes everything.
+    """
+
+    def __init__(self, db_path: str, flush_interval: float, prefix: str = STORAGE_PREFIX):
+        super().__init__(prefix=prefix)
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._dirty: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    # --- persistence (runs on the I/O executor) ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _load_all(self) -> dict:
+        rows = self._connect().execute("SELECT key, state, data FROM fsm_states").fetchall()
+        return {key: {"state": state, "data": json.loads(data)} for key, state, data in rows}
+
+    def _write(self, upserts: list, deletes: list):
+        conn = self._connect()
+        now = datetime.now().isoformat()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                [(key, state, data, now) for key, state, data in upserts]
+            )
+            conn.executemany("DELETE FROM fsm_states WHERE key = ?", [(key,) for key in deletes])
+
+    # --- lifecycle ---
+
+    async def start(self):
+        """
+        Load persisted states into memory and start the write-behind task.
+        """
+        self.data = await file_io.run_io(self._load_all)
+        self._flush_task = asyncio.create_task(self._flush_loop(), name="fsm_flush")
+        logger.info("Loaded {states} FSM states from {db_path}", states=len(self.data), db_path=self.db_path)
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        if self._conn is not None:
+            await file_io.run_io(self._conn.close)
+            self._conn = None
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Failed to persist FSM states: {error}", error=e)
+
+    async def flush(self):
+        """
+        Write all changed keys to SQLite in one transaction.
+        """
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            keys, self._dirty = self._dirty, set()
+            upserts, deletes = [], []
+            for key in keys:
+                record = self.data.get(key)
+                if record is None:
+                    deletes.append(key)
+                else:
+                    upserts.append((key, record["state"], json.dumps(record["data"])))
+            try:
+                await file_io.run_io(self._write, upserts, deletes)
+            except Exception:
+                # Повторим запись при следующем сбросе
+                self._dirty |= keys
+                raise
+
+    # --- write tracking ---
+
+    def _mark(self, chat_id, user_id, business_connection_id, message_thread_id, bot_id):
+        self._dirty.add(self._get_key(
+            chat_id, user_id, self.prefix, self.separator,
+            business_connection_id, message_thread_id, bot_id
+        ))
+
+    async def set_state(self, chat_id, user_id, state, business_connection_id=None,
+                        message_thread_id=None, bot_id=None):
+        result = await super().set_state(chat_id, user_id, state, business_connection_id, message_thread_id, bot_id)
+        self._mark(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        return result
+
+    async def delete_state(self, chat_id, user_id, business_connection_id=None,
+                           message_thread_id=None, bot_id=None):
+        result = await super().delete_state(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        self._mark(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        return result
+
+    async def set_data(self, chat_id, user_id, key, value, business_connection_id=None,
+                       message_thread_id=None, bot_id=None):
+        result = await super().set_data(chat_id, user_id, key, value, business_connection_id, message_thread_id, bot_id)
+        self._mark(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        return result
+
+    async def reset_data(self, chat_id, user_id, business_connection_id=None,
+                         message_thread_id=None, bot_id=None):
+        result = await super().reset_data(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        self._mark(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        return result
+
+    async def save(self, chat_id, user_id, data, business_connection_id=None,
+                   message_thread_id=None, bot_id=None):
+        result = await super().save(chat_id, user_id, data, business_connection_id, message_thread_id, bot_id)
+        self._mark(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        return result
+
+    def __str__(self) -> str:
+        return f"<SQLiteStateStorage: {self.db_path}, {len(self.data)} states>"
+
+
+def create_storage() -> StateStorageBase:
+    """
+    Build the FSM storage selected by FSM_STORAGE.
+    """
+    if settings.FSM_STORAGE == "sqlite":
+        return SQLiteStateStorage(settings.FSM_SQLITE_PATH, settings.FSM_FLUSH_INTERVAL)
+
+    if settings.FSM_STORAGE == "redis":
+        from telebot.asyncio_storage import StateRedisStorage
+
+        return StateRedisStorage(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB,
+            password=settings.REDIS_PASSWORD,
+            redis_url=settings.REDIS_URL,
+            prefix=STORAGE_PREFIX
+        )
+
+    return StateMemoryStorage(prefix=STORAGE_PREFIX)
+
+
+async def start_storage(storage: StateStorageBase):
+    if isinstance(storage, SQLiteStateStorage):
+        await storage.start()
+
+
+async def close_storage(storage: StateStorageBase):
+    if isinstance(storage, SQLiteStateStorage):
+        await storage.close()
+    elif hasattr(storage, "redis"):
+        await storage.redis.aclose()
@@ -0,0 +1,183 @@
+"""
+Connection pools for outbound HTTP traffic to Telegram.
+
+Bot API calls and file downloads use separate aiohttp sessions, so a burst of
+multi-megabyte downloads cannot take the connections button presses need:
+
+- control: every telebot request (install() replaces telebot's session
+  manager), at most HTTP_CONTROL_CONNECTIONS connections;
+- bulk: file downloads (app.services.downloader), at most
+  HTTP_BULK_CONNECTIONS connections.
+
+Both pools keep idle connections alive for HTTP_KEEPALIVE_TIMEOUT seconds,
+give up opening a connection after HTTP_CONNECT_TIMEOUT seconds and cache DNS
+lookups for HTTP_DNS_CACHE_TTL seconds. New and reused connections
+and the time spent waiting for a free one are counted per pool.
+"""
+
+import ssl
+import time
+import attr
+import certifi
+import aiohttp
+from dataclasses import dataclass
+from typing import Optional
+from telebot import asyncio_helper
+from app.services.metrics import http_connections_total, http_pool_wait_seconds
+from app.utils.logger import logger
+from config import settings
+
+
+@dataclass
+class PoolStats:
+    """Counters of one connection pool."""
+
+    requests: int = 0
+    connections_created: int = 0
+    connections_reused: int = 0
+    queued: int = 0
+    queue_wait: float = 0.0
+
+
+class ConnectionPool:
+    """
+    Lazily created aiohttp session with a tuned connector and counters.
+    """
+
+    def __init__(self, name: str, limit: int, timeout: aiohttp.ClientTimeout):
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ssl_context = ssl.create_default_context(cafile=certifi.where())
+
+    @property
+    def session(self) -> Optional[aiohttp.ClientSession]:
+        return self._session
+
+    @property
+    def in_use(self) -> int:
+        """
+        Connections currently serving a request.
+        """
+        if self._session is None or self._session.closed:
+            return 0
+        # noinspection PyProtectedMember
+        return len(self._session.connector._acquired)
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        stats = self.stats
+
+        async def on_request_start(session, context, params):
+            stats.requests += 1
+
+        async def on_queued_start(session, context, params):
+            stats.queued += 1
+            context.queued_at = time.perf_counter()
+
+        async def on_queued_end(session, context, params):
+            waited = time.perf_counter() - context.queued_at
+            stats.queue_wait += waited
+            http_pool_wait_seconds.observe(waited, pool=self.name)
+
+        async def on_connection_create_end(session, context, params):
+            stats.connections_created += 1
+            http_connections_total.inc(pool=self.name, reused="false")
+
+        async def on_connection_reuseconn(session, context, params):
+            stats.connections_reused += 1
+            http_connections_total.inc(pool=self.name, reused="true")
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_queued_start.append(on_queued_start)
+        trace_config.on_connection_queued_end.append(on_queued_end)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=settings.HTTP_LIMIT_PER_HOST,
+                keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+                ssl=self._ssl_context,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout, trace_configs=[self._trace_config()]
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+class _ControlSession:
+    """
+    Control pool session as seen by telebot, adding the connect timeout to
+    the per-request timeout telebot passes.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, connect: Optional[float]):
+        self._session = session
+        self._connect = connect
+
+    def request(self, method: str, url, **kwargs):
+        # aiohttp не объединяет таймаут запроса с таймаутом сессии, а telebot задает только total
+        timeout = kwargs.get("timeout")
+        if isinstance(timeout, aiohttp.ClientTimeout) and timeout.connect is None:
+            kwargs["timeout"] = attr.evolve(timeout, connect=self._connect)
+        return self._session.request(method, url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class _ControlSessionManager:
+    """
+    Stand-in for telebot's session manager handing out the control pool session.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+
+    @property
+    def session(self) -> Optional[aiohttp.ClientSession]:
+        return self.pool.session
+
+    async def get_session(self) -> _ControlSession:
+        return _ControlSession(await self.pool.get_session(), self.pool.timeout.connect)
+
+
+# Общий таймаут запросов API задает telebot (REQUEST_TIMEOUT), у скачиваний ограничено ожидание данных
+control_pool = ConnectionPool(
+    "control", settings.HTTP_CONTROL_CONNECTIONS,
+    aiohttp.ClientTimeout(total=settings.HTTP_REQUEST_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+)
+bulk_pool = ConnectionPool(
+    "bulk", settings.HTTP_BULK_CONNECTIONS,
+    aiohttp.ClientTimeout(total=None, connect=settings.HTTP_CONNECT_TIMEOUT,
+                          sock_read=settings.HTTP_DOWNLOAD_READ_TIMEOUT)
+)
+
+
+def install():
+    """
+    Route all telebot requests through the control pool.
+    """
+    if isinstance(asyncio_helper.session_manager, _ControlSessionManager):
+        return
+    asyncio_helper.session_manager = _ControlSessionManager(control_pool)
+    asyncio_helper.REQUEST_TIMEOUT = settings.HTTP_REQUEST_TIMEOUT
+    logger.info("HTTP pools: {control} control, {bulk} bulk connections",
+                control=settings.HTTP_CONTROL_CONNECTIONS, bulk=settings.HTTP_BULK_CONNECTIONS)
+
+
+async def close():
+    await control_pool.close()
+    await bulk_pool.close()
@@ -0,0 +1,128 @@
+"""
+Ingestion of files stored by a local Bot API server.
+
+A telegram-bot-api server started with --local answers getFile with the
+absolute path of the file in its working directory and has no 20 MB limit.
+With BOT_API_LOCAL the file is placed into the location folder straight from
+that path instead of being downloaded over HTTP (BOT_API_LOCAL_INGEST):
+
+- link: hard link, the server keeps its copy (default);
+- move: rename, the server's copy is taken over;
+- copy: copy inside the kernel (copy_file_range).
+
+Link and move fall back to a copy when the server's files are on another
+filesystem. A durable ingest (into the staging directory) fsyncs a copied
+file and the target directory before returning. If the server's working directory is mounted elsewhere for the
+bot (e.g. a Docker volume), BOT_API_SERVER_DIR is replaced by BOT_API_LOCAL_DIR
+in the returned paths.
+"""
+
+import os
+import shutil
+import hashlib
+from typing import Optional, Tuple
+from app.services import file_io
+from app.services.metrics import local_ingest_total
+from config import settings
+
+# Размер блока при копировании и подсчете хэша
+_BLOCK_SIZE = 1024 * 1024
+
+
+def local_source(file_path: str) -> Optional[str]:
+    """
+    Path of a getFile result on this machine, or None if it has to be downloaded.
+    """
+    if not settings.BOT_API_LOCAL or not os.path.isabs(file_path):
+        return None
+    if settings.BOT_API_SERVER_DIR and settings.BOT_API_LOCAL_DIR:
+        relative = os.path.relpath(file_path, settings.BOT_API_SERVER_DIR)
+        if not relative.startswith(os.pardir):
+            return os.path.join(settings.BOT_API_LOCAL_DIR, relative)
+    return file_path
+
+
+def _copy(src: str, dst: str, durable: bool = False):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            while os.copy_file_range(fsrc.fileno(), fdst.fileno(), _BLOCK_SIZE):
+                pass
+        except (AttributeError, OSError):
+            # Нет copy_file_range (не Linux) или ФС его не поддерживает
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst, _BLOCK_SIZE)
+        if durable:
+            fdst.flush()
+            os.fsync(fdst.fileno())
+
+
+def _place(src: str, tmp_path: str, mode: str, durable: bool) -> str:
+    """
+    Put src at tmp_path; returns the method actually used.
+    """
+    try:
+        if mode == "link":
+            os.link(src, tmp_path)
+            return "link"
+        if mode == "move":
+            os.rename(src, tmp_path)
+            return "rename"
+    except OSError:
+        # Разные файловые системы или ФС без жестких ссылок
+        pass
+    # Ссылка и перенос указывают на уже записанные данные, fsync нужен только копии
+    _copy(src, tmp_path, durable)
+    return "copy"
+
+
+def _sha256(path: str) -> Optional[str]:
+    hasher = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            while block := f.read(_BLOCK_SIZE):
+                hasher.update(block)
+    except OSError:
+        return None
+    return hasher.hexdigest()
+
+
+def _ingest(src: str, destination: str, mode: str, hash_content: bool,
+            durable: bool) -> Tuple[int, Optional[str], str]:
+    tmp_path = destination + ".part"
+    try:
+        method = _place(src, tmp_path, mode, durable)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if mode == "move" and method == "copy":
+        # Перенос между файловыми системами: копия уже на месте
+        os.remove(src)
+    size = os.path.getsize(destination)
+    return size, _sha256(destination) if hash_content else None, method
+
+
+async def ingest(src: str, destination: str, hash_content: bool = False,
+                 durable: bool = False) -> Tuple[int, Optional[str]]:
+    """
+    Place a local server file at destination.
+
+    Args:
+        src: Path of the file on this machine (see local_source)
+        destination: Full path of the target file
+        hash_content: Also return the SHA-256 of the content (for duplicate detection)
+        durable: fsync the file and its directory before returning
+
+    Returns:
+        File size in bytes and the SHA-256 (None if not requested or unreadable)
+    """
+    size, sha256, method = await file_io.run_io(
+        _ingest, src, destination, settings.BOT_API_LOCAL_INGEST, hash_content, durable
+    )
+    if durable:
+        await file_io.fsync_dir(os.path.dirname(destination))
+    local_ingest_total.inc(method=method)
+    return size, sha256
@@ -0,0 +1,65 @@
+"""
+Upload folders of the location grid, prepared once at startup.
+
+INSPECTIONS_BASE_PATH is resolved to an absolute path, the unsorted folder of
+every location is created in parallel on the I/O executor and the resulting
+location -> folder map is kept in memory. Saving an upload then neither joins
+paths nor stats the parent chain on the (possibly network) storage again.
+With s3 photo storage the paths only address objects and no folders are created.
+"""
+
+import os
+import asyncio
+from typing import Dict, Optional
+from app.locations import Location, iter_locations, location_path
+from app.services import file_io
+from app.utils.logger import logger
+from config import settings
+
+
+class LocationTree:
+    """
+    Resolved storage root and the upload folder of each location.
+    """
+
+    def __init__(self):
+        self.root: Optional[str] = None
+        self._paths: Dict[Location, str] = {}
+
+    @property
+    def local(self) -> bool:
+        return settings.PHOTO_STORAGE == "local"
+
+    async def prepare(self, base_path: str) -> int:
+        """
+        Resolve base_path and create the folders of all locations.
+
+        Returns:
+            Number of location folders
+        """
+        root = await file_io.run_io(os.path.realpath, str(base_path))
+        paths = {location: location_path(root, *location) for location in iter_locations()}
+        if self.local:
+            await asyncio.gather(*(file_io.makedirs(path) for path in paths.values()))
+            logger.info("Prepared {folders} location folders under {root}", folders=len(paths), root=root)
+        self.root = root
+        self._paths = paths
+        return len(paths)
+
+    async def path(self, location: Location) -> str:
+        """
+        Upload folder of a location; folders outside the prepared grid are
+        created on first use.
+        """
+        path = self._paths.get(location)
+        if path is None:
+            if self.root is None:
+                raise RuntimeError("Location tree is not prepared")
+            path = location_path(self.root, *location)
+            if self.local:
+                await file_io.makedirs(path)
+            self._paths[location] = path
+        return path
+
+
+location_tree = LocationTree()
@@ -0,0 +1,177 @@
+"""
+Media group (album) aggregation.
+
+Telegram delivers an album as separate messages sharing a media_group_id.
+Each group gets one long-lived collector task that gathers the items and
+flushes them as a single batch:
+
+- immediately when Telegram's album limit of 10 items is reached;
+- after a quiet period that adapts to how fast items are arriving
+  (between MEDIA_GROUP_MIN_WINDOW and MEDIA_GROUP_WINDOW seconds);
+- at the latest MEDIA_GROUP_TTL seconds after the first item.
+
+At most MEDIA_GROUP_MAX_GROUPS groups are held in memory; when the cap is
+reached the oldest group is flushed early. A group is always removed from
+memory once flushed, even if processing it fails.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from telebot.types import Message
+from app.services.metrics import album_seconds
+from app.utils.logger import logger
+from config import settings
+
+# Максимальный размер альбома в Telegram
+ALBUM_MAX_ITEMS = 10
+
+FlushCallback = Callable[[int, int, List[Message]], Awaitable[None]]
+
+
+@dataclass
+class MediaGroupStats:
+    """Aggregator counters."""
+
+    collecting: int = 0
+    flushing: int = 0
+    flushed_total: int = 0
+    evicted_total: int = 0
+    failed_total: int = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self.collecting + self.flushing
+
+
+@dataclass
+class _Collector:
+    key: str
+    user_id: int
+    chat_id: int
+    on_flush: FlushCallback
+    started_at: float
+    last_item_at: float
+    messages: List[Message] = field(default_factory=list)
+    gaps: List[float] = field(default_factory=list)
+    wakeup: asyncio.Event = field(default_factory=asyncio.Event)
+    force_flush: bool = False
+    task: Optional[asyncio.Task] = None
+
+
+class MediaGroupAggregator:
+    """
+    Collects album items into batches, one collector task per group.
+    """
+
+    def __init__(self):
+        self._groups: Dict[str, _Collector] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = MediaGroupStats()
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def add(self, message: Message, on_flush: FlushCallback):
+        """
+        Add an album item. on_flush(user_id, chat_id, messages) is awaited
+        once per group with all collected items; it is taken from the first
+        item of the group.
+        """
+        user_id = message.from_user.id
+        key = f"{user_id}_{message.media_group_id}"
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        collector = self._groups.get(key)
+        if collector is None:
+            if len(self._groups) >= settings.MEDIA_GROUP_MAX_GROUPS:
+                self._evict_oldest()
+            collector = _Collector(key, user_id, message.chat.id, on_flush, started_at=now, last_item_at=now)
+            self._groups[key] = collector
+            self.stats.collecting += 1
+            collector.task = asyncio.create_task(self._collect(collector), name=f"media_group_{key}")
+            self._tasks.add(collector.task)
+            collector.task.add_done_callback(self._tasks.discard)
+        else:
+            collector.gaps.append(now - collector.last_item_at)
+            collector.last_item_at = now
+
+        collector.messages.append(message)
+        collector.wakeup.set()
+
+    def _evict_oldest(self):
+        oldest = min(self._groups.values(), key=lambda c: c.started_at)
+        if not oldest.force_flush:
+            oldest.force_flush = True
+            oldest.wakeup.set()
+            self.stats.evicted_total += 1
+            logger.warning("Media group limit reached, flushing {group} early", group=oldest.key)
+        # Группа освобождает место сразу, даже если ее обработка еще идет
+        self._groups.pop(oldest.key, None)
+
+    def _window(self, collector: _Collector) -> float:
+        """
+        Quiet period to wait for the next item. Albums arrive in quick
+        bursts, so once the arrival rate is known the window shrinks to a few
+        inter-arrival gaps.
+        """
+        if not collector.gaps:
+            return settings.MEDIA_GROUP_WINDOW
+        average_gap = sum(collector.gaps) / len(collector.gaps)
+        return min(settings.MEDIA_GROUP_WINDOW, max(settings.MEDIA_GROUP_MIN_WINDOW, average_gap * 3))
+
+    async def _wait_for_items(self, collector: _Collector):
+        loop = asyncio.get_running_loop()
+        while not collector.force_flush and len(collector.messages) < ALBUM_MAX_ITEMS:
+            collector.wakeup.clear()
+            ttl_left = collector.started_at + settings.MEDIA_GROUP_TTL - loop.time()
+            if ttl_left <= 0:
+                logger.warning("Media group {group} reached TTL, flushing {files} items", group=collector.key, files=len(collector.messages))
+                return
+            try:
+                await asyncio.wait_for(collector.wakeup.wait(), timeout=min(self._window(collector), ttl_left))
+            except asyncio.TimeoutError:
+                return
+
+    async def _collect(self, collector: _Collector):
+        flushing = False
+        try:
+            await self._wait_for_items(collector)
+
+            # Группа покидает память до обработки: поздние элементы начнут новую
+            if self._groups.get(collector.key) is collector:
+                del self._groups[collector.key]
+            self.stats.collecting -= 1
+            self.stats.flushing += 1
+            flushing = True
+
+            await collector.on_flush(collector.user_id, collector.chat_id, list(collector.messages))
+            self.stats.flushed_total += 1
+            # От первого элемента альбома до отправленного отчета
+            album_seconds.observe(asyncio.get_running_loop().time() - collector.started_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats.failed_total += 1
+            logger.error("Error processing media group {group}: {error}", group=collector.key, error=e)
+        finally:
+            if self._groups.get(collector.key) is collector:
+                del self._groups[collector.key]
+            if flushing:
+                self.stats.flushing -= 1
+            else:
+                self.stats.collecting -= 1
+
+    async def shutdown(self):
+        """
+        Flush every group that is still collecting and wait for processing.
+        """
+        for collector in list(self._groups.values()):
+            collector.force_flush = True
+            collector.wakeup.set()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+media_group_aggregator = MediaGroupAggregator()
@@ -0,0 +1,287 @@
+"""
+Append-only metadata index of saved photos.
+
+Every saved file gets a record in METADATA_DB_PATH with its location, the
+uploader, the Telegram photo info (size, caption, original name, upload
+time) and the EXIF capture time and camera, so photos can be searched by
+location, uploader, date range and caption without opening image files.
+
+Records are queued by the upload queue's post-save stage and written in
+batches by a background task; EXIF is parsed on the I/O executor. EXIF
+parsing needs the optional Pillow package and local photo storage, without
+them the EXIF columns stay empty. Compressed Telegram photos carry no EXIF,
+only files sent as documents do.
+"""
+
+import os
+import asyncio
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+from app.services import file_io
+from app.utils.logger import logger
+from config import settings
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS photos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    inspection TEXT NOT NULL,
+    block TEXT NOT NULL,
+    orientation TEXT NOT NULL,
+    level TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    file_unique_id TEXT NOT NULL,
+    type TEXT,
+    original_name TEXT,
+    caption TEXT,
+    width INTEGER,
+    height INTEGER,
+    file_size INTEGER,
+    duplicate INTEGER NOT NULL DEFAULT 0,
+    uploaded_at TEXT NOT NULL,
+    taken_at TEXT,
+    camera_make TEXT,
+    camera_model TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_photos_location ON photos (inspection, block, orientation, level);
+CREATE INDEX IF NOT EXISTS idx_photos_user ON photos (user_id, uploaded_at);
+CREATE INDEX IF NOT EXISTS idx_photos_uploaded ON photos (uploaded_at);
+CREATE INDEX IF NOT EXISTS idx_photos_taken ON photos (taken_at);
+"""
+
+_COLUMNS = (
+    "path", "inspection", "block", "orientation", "level", "user_id", "chat_id", "file_unique_id",
+    "type", "original_name", "caption", "width", "height", "file_size", "duplicate", "uploaded_at",
+    "taken_at", "camera_make", "camera_model", "created_at"
+)
+
+# EXIF теги: DateTimeOriginal (в Exif IFD), DateTime, Make, Model
+_EXIF_IFD = 0x8769
+_TAG_DATETIME_ORIGINAL = 36867
+_TAG_DATETIME = 306
+_TAG_MAKE = 271
+_TAG_MODEL = 272
+
+# Записи сбрасываются в базу пачками не больше этого размера
+_BATCH_SIZE = 200
+
+
+@dataclass
+class PhotoRecord:
+    """Metadata of one saved photo."""
+
+    path: str
+    inspection: str
+    block: str
+    orientation: str
+    level: str
+    user_id: int
+    chat_id: int
+    file_unique_id: str
+    type: Optional[str] = None
+    original_name: Optional[str] = None
+    caption: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    file_size: Optional[int] = None
+    duplicate: bool = False
+    uploaded_at: str = ""
+    taken_at: Optional[str] = None
+    camera_make: Optional[str] = None
+    camera_model: Optional[str] = None
+    created_at: str = ""
+
+
+def _clean(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode(errors="ignore")
+    value = str(value).strip("\x00 ").strip()
+    return value or None
+
+
+def read_exif(path: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Read capture time (ISO format), camera make and model from a file.
+    Only the image header is parsed; missing data is returned as None.
+    """
+    if Image is None:
+        return None, None, None
+    try:
+        with Image.open(path) as image:
+            exif = image.getexif()
+            taken = exif.get_ifd(_EXIF_IFD).get(_TAG_DATETIME_ORIGINAL) or exif.get(_TAG_DATETIME)
+            make, model = exif.get(_TAG_MAKE), exif.get(_TAG_MODEL)
+    except Exception:
+        return None, None, None
+
+    taken_at = None
+    if _clean(taken):
+        try:
+            taken_at = datetime.strptime(_clean(taken), "%Y:%m:%d %H:%M:%S").isoformat()
+        except ValueError:
+            pass
+    return taken_at, _clean(make), _clean(model)
+
+
+class MetadataStore:
+    """
+    SQLite-backed, append-only photo metadata index.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    # --- storage (runs on the I/O executor) ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _append(self, records: List[PhotoRecord]):
+        # В S3 файлов на диске нет, EXIF не читаем
+        if settings.PHOTO_STORAGE == "local":
+            for record in records:
+                record.taken_at, record.camera_make, record.camera_model = read_exif(record.path)
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        rows = [tuple(getattr(record, column) for column in _COLUMNS) for record in records]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(f"INSERT INTO photos ({', '.join(_COLUMNS)}) VALUES ({placeholders})", rows)
+
+    def _select(self, sql: str, params: list) -> List[PhotoRecord]:
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        records = [PhotoRecord(**{column: row[column] for column in _COLUMNS}) for row in rows]
+        for record in records:
+            record.duplicate = bool(record.duplicate)
+        return records
+
+    # --- lifecycle ---
+
+    def start(self):
+        if not settings.METADATA_ENABLED:
+            return
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop(), name="metadata_writer")
+
+    async def stop(self):
+        """
+        Write all queued records and close the database.
+        """
+        if self._writer is not None:
+            await self._queue.join()
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # --- producer side ---
+
+    async def on_saved(self, job, result):
+        """
+        Upload queue listener: record every saved file.
+        """
+        if self._queue is None:
+            return
+        info = job.photo_info
+        self._queue.put_nowait(PhotoRecord(
+            path=os.path.join(job.save_path, result.filename),
+            inspection=job.inspection,
+            block=job.block,
+            orientation=job.orientation,
+            level=job.level,
+            user_id=job.user_id,
+            chat_id=job.chat_id,
+            file_unique_id=info['file_unique_id'],
+            type=info.get('type'),
+            original_name=info.get('file_name'),
+            caption=info.get('caption') or None,
+            width=info.get('width') or None,
+            height=info.get('height') or None,
+            file_size=info.get('file_size'),
+            duplicate=bool(result.duplicate),
+            uploaded_at=info.get('timestamp') or datetime.now().isoformat(),
+            created_at=datetime.now().isoformat()
+        ))
+
+    async def _write_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < _BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await file_io.run_io(self._append, batch)
+            except Exception as e:
+                logger.error("Failed to write {records} metadata records: {error}", records=len(batch), error=e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    # --- queries ---
+
+    async def query(self, inspection: Optional[str] = None, block: Optional[str] = None,
+                    orientation: Optional[str] = None, level: Optional[str] = None,
+                    user_id: Optional[int] = None, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None, caption: Optional[str] = None,
+                    by_capture_time: bool = False, limit: int = 100) -> List[PhotoRecord]:
+        """
+        Search saved photos, newest first.
+
+        Args:
+            inspection, block, orientation, level: Location filters
+            user_id: Uploader
+            since, until: Date range (inclusive start, exclusive end)
+            caption: Case-insensitive substring of the caption
+            by_capture_time: Apply the date range to the EXIF capture time instead of the upload time
+            limit: Maximum number of records
+        """
+        date_column = "taken_at" if by_capture_time else "uploaded_at"
+        conditions, params = [], []
+        for column, value in (("inspection", inspection), ("block", block),
+                              ("orientation", orientation), ("level", level), ("user_id", user_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append(f"{date_column} >= ?")
+            params.append(since.isoformat())
+        if until is not None:
+            conditions.append(f"{date_column} < ?")
+            params.append(until.isoformat())
+        if caption:
+            escaped = caption.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append("caption LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM photos {where} ORDER BY {date_column} DESC, id DESC LIMIT ?"
+        return await file_io.run_io(self._select, sql, params + [limit])
+
+
+metadata_store = MetadataStore(settings.METADATA_DB_PATH)
@@ -0,0 +1,245 @@
+"""
+Prometheus metrics for the update and upload path.
+
+A small in-process registry of counters, histograms and gauges rendered in
+the Prometheus text exposition format. With METRICS_ENABLED the registry is
+served by an aiohttp endpoint on METRICS_HOST:METRICS_PORT/METRICS_PATH.
+Recording is a dictionary update on the event loop, so call sites record
+unconditionally; gauges are read from callbacks at scrape time.
+"""
+
+import math
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from aiohttp import web
+from app.utils.logger import logger
+from config import settings
+
+PREFIX = "facade_bot_"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labels), 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Для каждой комбинации меток: счетчики по бакетам, сумма, количество
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        counts, totals = self._values.setdefault(key, ([0] * len(self.buckets), [0.0, 0]))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        totals[0] += value
+        totals[1] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(tuple(str(labels[name]) for name in self.labels))
+        return entry[1][1] if entry else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, (total, count)) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time (None - not exported)."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, source: Callable[[], Optional[float]]):
+        self.name = name
+        self.documentation = documentation
+        self.source = source
+
+    def samples(self) -> List[str]:
+        try:
+            value = self.source()
+        except Exception as e:
+            logger.warning("Metric {metric} could not be read: {error}", metric=self.name, error=e)
+            return []
+        return [] if value is None else [f"{self.name} {_format_value(value)}"]
+
+
+class MetricsRegistry:
+    """
+    Named metrics rendered together on scrape.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(PREFIX + name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float],
+                  labels: Sequence[str] = ()) -> Histogram:
+        return self._register(Histogram(PREFIX + name, documentation, buckets, labels))
+
+    def gauge(self, name: str, documentation: str, source: Callable[[], Optional[float]]) -> Gauge:
+        return self._register(Gauge(PREFIX + name, documentation, source))
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Бакеты: задержки запросов, длительности скачивания, запись на диск, альбом целиком
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_DOWNLOAD_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+_THROUGHPUT_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+_DISK_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5)
+_ALBUM_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+updates_total = registry.counter("updates_total", "Updates received by type", ("type", "content_type"))
+callbacks_total = registry.counter("callbacks_total", "Inline button presses by action", ("action",))
+files_saved_total = registry.counter("files_saved_total", "Files saved (duplicate=true: linked or skipped)", ("duplicate",))
+files_failed_total = registry.counter("files_failed_total", "Files that failed after all download attempts")
+bytes_written_total = registry.counter("bytes_written_total", "Bytes of downloaded files written to disk")
+get_file_seconds = registry.histogram("get_file_seconds", "Latency of getFile calls", _LATENCY_BUCKETS)
+download_seconds = registry.histogram("download_seconds", "Duration of file downloads to disk", _DOWNLOAD_BUCKETS)
+download_throughput = registry.histogram(
+    "download_throughput_bytes_per_second", "Throughput of individual file downloads", _THROUGHPUT_BUCKETS
+)
+disk_write_seconds = registry.histogram("disk_write_seconds", "Time spent writing one file to disk", _DISK_BUCKETS)
+handler_seconds = registry.histogram("handler_seconds", "Wall time of update handlers", _LATENCY_BUCKETS, ("handler",))
+album_seconds = registry.histogram("album_seconds", "Time from the first album item to the upload report", _ALBUM_BUCKETS)
+staging_migrated_total = registry.counter("staging_migrated_total", "Staged files moved to the inspection share")
+staging_migration_failed_total = registry.counter(
+    "staging_migration_failed_total", "Failed attempts to move a staged file to the inspection share"
+)
+staging_migration_lag_seconds = registry.histogram(
+    "staging_migration_lag_seconds", "Time from staging a file to its arrival on the inspection share", _ALBUM_BUCKETS
+)
+local_ingest_total = registry.counter(
+    "local_ingest_total", "Files taken from a local Bot API server's disk by method", ("method",)
+)
+http_connections_total = registry.counter(
+    "http_connections_total", "Connections taken from the HTTP pools (reused=true: kept alive)", ("pool", "reused")
+)
+http_pool_wait_seconds = registry.histogram(
+    "http_pool_wait_seconds", "Time requests waited for a free pool connection", _DISK_BUCKETS, ("pool",)
+)
+previews_total = registry.counter(
+    "previews_total", "Images handed to the preview pipeline by result (rendered, failed or skipped)", ("result",)
+)
+rate_limit_requests_total = registry.counter(
+    "rate_limit_requests_total", "Bot API requests passing the outbound rate limiter"
+)
+rate_limit_wait_seconds = registry.histogram(
+    "rate_limit_wait_seconds", "Time throttled requests waited for a rate limit token", _LATENCY_BUCKETS, ("bucket",)
+)
+rate_limit_coalesced_total = registry.counter(
+    "rate_limit_coalesced_total", "Message edits replaced by a newer edit before being sent"
+)
+rate_limit_retries_total = registry.counter(
+    "rate_limit_retries_total", "Requests retried after a 429 flood control response"
+)
+
+
+class MetricsServer:
+    """
+    aiohttp endpoint serving the registry.
+    """
+
+    def __init__(self, metrics: MetricsRegistry, path: str):
+        self.metrics = metrics
+        self.path = path
+        self._runner: Optional[web.AppRunner] = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info("Metrics endpoint listening on {host}:{port}{path}", host=host, port=port, path=self.path)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics_server = MetricsServer(registry, settings.METRICS_PATH)
@@ -0,0 +1,380 @@
+"""
+Backends storing saved photos.
+
+PHOTO_STORAGE selects where downloaded files end up:
+- local (default): folders under INSPECTIONS_BASE_PATH;
+- s3: objects in an S3-compatible bucket (S3_* settings), keyed by the same
+  layout {Inspection}/{Block}/{Level}/{Orientation}/unsorted/{filename}
+  below S3_PREFIX.
+
+The rest of the bot keeps addressing files by their path under the storage
+root (location folder plus file name); the s3 backend maps that path to a key.
+Files are written through a writer fed chunk by chunk: for s3 it is a
+multipart upload of S3_PART_SIZE parts, so a download from Telegram goes to
+the bucket without touching the local disk. S3 requests are signed with AWS
+Signature V4 and use their own keep-alive connection pool.
+
+Staging, previews and EXIF parsing need local files and are not available
+with s3.
+"""
+
+import os
+import hmac
+import shutil
+import hashlib
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+import aiohttp
+from yarl import URL
+from app.services import file_io
+from app.services.http_pools import ConnectionPool
+from app.services.location_tree import location_tree
+from app.services.staging import staging_area
+from app.utils.logger import logger
+from config import settings
+
+# Файл в хранилище: путь, размер в байтах, время изменения
+StoredFile = Tuple[str, int, datetime]
+
+_S3_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+
+class S3Error(Exception):
+    """Error response of the S3 API."""
+
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(f"S3 error {status} {code}: {message}")
+        self.status = status
+        self.code = code
+
+
+# --- local filesystem ---
+
+
+class LocalWriter:
+    """
+    Writes to "<path>.part" and renames it into place on commit.
+    """
+
+    def __init__(self, path: str, durable: bool):
+        self.path = path
+        self.tmp_path = path + ".part"
+        self.durable = durable
+        self._file: Optional[file_io.AsyncFile] = None
+
+    async def open(self) -> "LocalWriter":
+        self._file = await file_io.AsyncFile.open(self.tmp_path, 'wb')
+        return self
+
+    async def write(self, data: bytes):
+        await self._file.write(data)
+
+    async def commit(self):
+        if self.durable:
+            await self._file.sync()
+        await self._file.close()
+        await file_io.replace(self.tmp_path, self.path)
+        if self.durable:
+            await file_io.fsync_dir(os.path.dirname(self.path))
+
+    async def abort(self):
+        if self._file is not None:
+            await self._file.close()
+        await file_io.remove(self.tmp_path)
+
+
+def _link_or_copy(src: str, dst: str):
+    src = staging_area.locate(src)
+    tmp_path = dst + ".part"
+    try:
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            # Разные файловые системы или ФС без жестких ссылок
+            shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _list_files(directory: str) -> List[StoredFile]:
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return []
+    files = []
+    with entries:
+        for entry in entries:
+            # Недокачанные файлы (.part) не учитываем
+            if entry.name.endswith(".part") or not entry.is_file():
+                continue
+            info = entry.stat()
+            files.append((entry.path, info.st_size, datetime.fromtimestamp(info.st_mtime)))
+    return files
+
+
+class LocalStorage:
+    """
+    Files in folders under INSPECTIONS_BASE_PATH.
+    """
+
+    local = True
+
+    async def open_writer(self, path: str, durable: bool = False) -> LocalWriter:
+        return await LocalWriter(path, durable).open()
+
+    async def exists(self, path: str) -> bool:
+        # Еще не перенесенный файл находится в промежуточной папке
+        return await file_io.run_io(lambda: os.path.exists(staging_area.locate(path)))
+
+    async def size(self, path: str) -> int:
+        return await file_io.run_io(os.path.getsize, path)
+
+    async def link(self, src: str, dst: str):
+        await file_io.run_io(_link_or_copy, src, dst)
+
+    async def remove(self, path: str):
+        await file_io.remove(path)
+
+    async def list_files(self, directory: str) -> List[StoredFile]:
+        return await file_io.run_io(_list_files, directory)
+
+    async def close(self):
+        pass
+
+
+# --- S3-compatible object storage ---
+
+
+def _sign(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+class S3Client:
+    """
+    Minimal S3 API client (path-style requests, Signature V4, unsigned payload).
+    """
+
+    def __init__(self, endpoint: str, bucket: str, region: str, access_key: str, secret_key: str,
+                 pool: ConnectionPool):
+        self.endpoint = endpoint.rstrip("/")
+        self.host = urlsplit(self.endpoint).netloc
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.pool = pool
+
+    def _signed_headers(self, method: str, uri: str, query: str, headers: dict, now: datetime,
+                        payload_hash: str = "UNSIGNED-PAYLOAD") -> dict:
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{now:%Y%m%d}/{self.region}/s3/aws4_request"
+        headers = {**headers, "host": self.host, "x-amz-date": amz_date, "x-amz-content-sha256": payload_hash}
+        names = sorted(name.lower() for name in headers)
+        values = {name.lower(): str(value).strip() for name, value in headers.items()}
+        signed = ";".join(names)
+        canonical = "\n".join([
+            method, uri, query,
+            "".join(f"{name}:{values[name]}\n" for name in names),
+            signed, payload_hash
+        ])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest()
+        ])
+        key = ("AWS4" + self.secret_key).encode()
+        for part in (f"{now:%Y%m%d}", self.region, "s3", "aws4_request"):
+            key = _sign(key, part)
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, SignedHeaders={signed}, Signature={signature}"
+        )
+        return headers
+
+    async def request(self, method: str, key: Optional[str] = None, query: Optional[dict] = None,
+                      data: Optional[bytes] = None, headers: Optional[dict] = None,
+                      allow_missing: bool = False) -> Tuple[int, dict, bytes]:
+        """
+        Send a signed request for key (None - the bucket itself).
+
+        Returns:
+            Status, response headers and body; errors are raised as S3Error
+            (except 404 with allow_missing)
+        """
+        uri = quote(f"/{self.bucket}" if key is None else f"/{self.bucket}/{key}")
+        canonical_query = "&".join(
+            f"{quote(name, safe='~')}={quote(str(value), safe='~')}" for name, value in sorted((query or {}).items())
+        )
+        signed = self._signed_headers(method, uri, canonical_query, headers or {}, datetime.now(timezone.utc))
+        url = URL(f"{self.endpoint}{uri}" + (f"?{canonical_query}" if canonical_query else ""), encoded=True)
+
+        session = await self.pool.get_session()
+        async with session.request(method, url, data=data, headers=signed) as response:
+            body = await response.read()
+            if response.status == 404 and allow_missing:
+                return response.status, response.headers, body
+            if response.status >= 300:
+                code, message = "", body.decode(errors="replace")[:200]
+                if body:
+                    try:
+                        root = ElementTree.fromstring(body)
+                        code, message = root.findtext("Code", ""), root.findtext("Message", "")
+                    except ElementTree.ParseError:
+                        pass
+                raise S3Error(response.status, code, message)
+            return response.status, response.headers, body
+
+
+def _find_all(root: ElementTree.Element, path: str) -> List[ElementTree.Element]:
+    # Ответы S3 обычно в пространстве имен, у совместимых серверов - не всегда
+    return root.findall(path.replace("{ns}", _S3_NAMESPACE)) or root.findall(path.replace("{ns}", ""))
+
+
+def _find_text(root: ElementTree.Element, path: str) -> Optional[str]:
+    value = root.findtext(path.replace("{ns}", _S3_NAMESPACE))
+    return value if value is not None else root.findtext(path.replace("{ns}", ""))
+
+
+class S3Writer:
+    """
+    Streams an object to S3: one PutObject for small files, a multipart
+    upload of part_size parts otherwise. Holds at most one part in memory.
+    """
+
+    def __init__(self, client: S3Client, key: str, part_size: int):
+        self.client = client
+        self.key = key
+        self.part_size = part_size
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Tuple[int, str]] = []
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        if len(self._buffer) >= self.part_size:
+            await self._upload_part()
+
+    async def _upload_part(self):
+        if self._upload_id is None:
+            _, _, body = await self.client.request("POST", self.key, {"uploads": ""})
+            self._upload_id = _find_text(ElementTree.fromstring(body), "{ns}UploadId")
+        number = len(self._parts) + 1
+        data, self._buffer = bytes(self._buffer), bytearray()
+        _, headers, _ = await self.client.request(
+            "PUT", self.key, {"partNumber": number, "uploadId": self._upload_id}, data=data
+        )
+        self._parts.append((number, headers.get("ETag", "")))
+
+    async def commit(self):
+        if self._upload_id is None:
+            await self.client.request("PUT", self.key, data=bytes(self._buffer))
+            return
+        if self._buffer:
+            await self._upload_part()
+        parts = "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in self._parts
+        )
+        await self.client.request(
+            "POST", self.key, {"uploadId": self._upload_id},
+            data=f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode()
+        )
+
+    async def abort(self):
+        if self._upload_id is not None:
+            await self.client.request("DELETE", self.key, {"uploadId": self._upload_id}, allow_missing=True)
+            self._upload_id = None
+
+
+class S3Storage:
+    """
+    Objects in an S3-compatible bucket, keyed like the local folder layout.
+    """
+
+    local = False
+
+    def __init__(self):
+        self.pool = ConnectionPool(
+            "s3", settings.S3_CONNECTIONS,
+            aiohttp.ClientTimeout(total=None, connect=settings.HTTP_CONNECT_TIMEOUT,
+                                  sock_read=settings.HTTP_DOWNLOAD_READ_TIMEOUT)
+        )
+        self.client = S3Client(settings.S3_ENDPOINT_URL, settings.S3_BUCKET, settings.S3_REGION,
+                               settings.S3_ACCESS_KEY, settings.S3_SECRET_KEY, self.pool)
+        self.prefix = settings.S3_PREFIX.strip("/")
+
+    def key(self, path: str) -> str:
+        """
+        Object key of a path under the storage root.
+        """
+        relative = os.path.relpath(path, location_tree.root)
+        if relative.startswith(os.pardir):
+            raise ValueError(f"{path} is outside of the storage root")
+        relative = "" if relative == os.curdir else relative.replace(os.sep, "/")
+        return "/".join(part for part in (self.prefix, relative) if part)
+
+    def path(self, key: str) -> str:
+        relative = key[len(self.prefix) + 1:] if self.prefix else key
+        return os.path.join(location_tree.root, *relative.split("/"))
+
+    async def open_writer(self, path: str, durable: bool = False) -> S3Writer:
+        # Объект появляется только после завершения загрузки, durable не нужен
+        return S3Writer(self.client, self.key(path), settings.S3_PART_SIZE)
+
+    async def exists(self, path: str) -> bool:
+        status, _, _ = await self.client.request("HEAD", self.key(path), allow_missing=True)
+        return status != 404
+
+    async def size(self, path: str) -> int:
+        _, headers, _ = await self.client.request("HEAD", self.key(path))
+        return int(headers.get("Content-Length", 0))
+
+    async def link(self, src: str, dst: str):
+        # Копирование на стороне сервера, данные через бота не проходят
+        await self.client.request("PUT", self.key(dst), headers={
+            "x-amz-copy-source": quote(f"/{self.client.bucket}/{self.key(src)}")
+        })
+
+    async def remove(self, path: str):
+        await self.client.request("DELETE", self.key(path), allow_missing=True)
+
+    async def list_files(self, directory: str) -> List[StoredFile]:
+        prefix = self.key(directory)
+        prefix = prefix + "/" if prefix else ""
+        files = []
+        token = None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if token:
+                query["continuation-token"] = token
+            _, _, body = await self.client.request("GET", query=query)
+            root = ElementTree.fromstring(body)
+            for item in _find_all(root, "{ns}Contents"):
+                modified = _find_text(item, "{ns}LastModified") or ""
+                files.append((
+                    self.path(_find_text(item, "{ns}Key")),
+                    int(_find_text(item, "{ns}Size") or 0),
+                    datetime.fromisoformat(modified.replace("Z", "+00:00")).astimezone().replace(tzinfo=None)
+                    if modified else datetime.now()
+                ))
+            token = _find_text(root, "{ns}NextContinuationToken")
+            if _find_text(root, "{ns}IsTruncated") != "true" or not token:
+                return files
+
+    async def close(self):
+        await self.pool.close()
+
+
+def create_photo_storage():
+    """
+    Build the backend selected by PHOTO_STORAGE.
+    """
+    if settings.PHOTO_STORAGE == "s3":
+        logger.info("Saving photos to S3 bucket {bucket} at {endpoint}", bucket=settings.S3_BUCKET, endpoint=settings.S3_ENDPOINT_URL)
+        return S3Storage()
+    return LocalStorage()
+
+
+photo_storage = create_photo_storage()
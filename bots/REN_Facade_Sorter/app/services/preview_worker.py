@@ -0,0 +1,47 @@
+"""
+Image rendering executed in preview worker processes.
+
+This module is imported by the worker processes, so it must stay free of
+bot, settings and event loop imports.
+"""
+
+import os
+from typing import Tuple
+from PIL import Image, ImageOps
+
+
+def _save_jpeg(image: Image.Image, path: str, quality: int):
+    tmp_path = path + ".part"
+    try:
+        image.save(tmp_path, "JPEG", quality=quality, optimize=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def render_previews(source: str, preview_path: str, thumbnail_path: str,
+                    preview_size: int, thumbnail_size: int, quality: int) -> Tuple[int, int]:
+    """
+    Write a downscaled preview and a thumbnail of source as JPEG files.
+
+    Returns:
+        Size (width, height) of the original image
+    """
+    with Image.open(source) as image:
+        original_size = image.size
+        # Для JPEG декодируем сразу в уменьшенном масштабе
+        image.draft("RGB", (preview_size, preview_size))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        image.thumbnail((preview_size, preview_size), Image.LANCZOS)
+        os.makedirs(os.path.dirname(preview_path), exist_ok=True)
+        _save_jpeg(image, preview_path, quality)
+
+        image.thumbnail((thumbnail_size, thumbnail_size), Image.LANCZOS)
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        _save_jpeg(image, thumbnail_path, quality)
+    return original_size
@@ -0,0 +1,145 @@
+"""
+Background preview and thumbnail generation.
+
+Every saved image is handed to a ProcessPoolExecutor of PREVIEW_WORKERS
+processes, which writes a downscaled preview and a thumbnail next to the
+unsorted folder:
+
+    .../{Orientation}/unsorted/{name}.jpg
+    .../{Orientation}/previews/{name}.jpg
+    .../{Orientation}/thumbnails/{name}.jpg
+
+At most PREVIEW_WORKERS images are rendered at once and at most
+PREVIEW_QUEUE_SIZE wait; images beyond that are skipped, so previews never
+hold back downloads. The outcome of every image is counted in the
+previews_total metric. Requires the optional Pillow package; without it the
+pipeline stays disabled.
+"""
+
+import os
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+from app.services import file_io
+from app.services.metrics import previews_total
+from app.utils.logger import logger
+from config import settings
+
+try:
+    from app.services.preview_worker import render_previews
+    PILLOW_AVAILABLE = True
+except ImportError:
+    render_previews = None
+    PILLOW_AVAILABLE = False
+
+PREVIEWS_DIR = "previews"
+THUMBNAILS_DIR = "thumbnails"
+
+# Расширения, которые Pillow умеет открывать
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff", ".gif"}
+
+
+def preview_paths(source: str) -> tuple:
+    """
+    Preview and thumbnail paths for a file stored in an unsorted folder.
+    """
+    folder, filename = os.path.split(source)
+    orientation_dir = os.path.dirname(folder)
+    name = os.path.splitext(filename)[0] + ".jpg"
+    return (
+        os.path.join(orientation_dir, PREVIEWS_DIR, name),
+        os.path.join(orientation_dir, THUMBNAILS_DIR, name)
+    )
+
+
+class PreviewPipeline:
+    """
+    Bounded queue feeding image paths to a process pool.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers_count = workers
+        self.queue_size = queue_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self._queue is not None
+
+    @property
+    def pending(self) -> int:
+        """Images waiting for a worker."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        if not settings.PREVIEWS_ENABLED:
+            return
+        if not PILLOW_AVAILABLE:
+            logger.warning("Pillow is not installed, previews and thumbnails are disabled")
+            return
+        if settings.PHOTO_STORAGE != "local":
+            logger.info("Previews and thumbnails need local photo storage and are disabled")
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers_count)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"preview_worker_{i}")
+            for i in range(self.workers_count)
+        ]
+        logger.info("Preview pipeline started with {workers} worker processes", workers=self.workers_count)
+
+    async def stop(self):
+        """
+        Stop rendering. Images still waiting in the queue are skipped.
+        """
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        if self._executor is not None:
+            await file_io.run_io(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, source: str):
+        """
+        Queue an image for rendering. Non-images and overflow are skipped.
+        """
+        if self._queue is None or os.path.splitext(source)[1].lower() not in IMAGE_EXTENSIONS:
+            return
+        try:
+            self._queue.put_nowait(source)
+        except asyncio.QueueFull:
+            # Превью можно сгенерировать позже, загрузки важнее
+            previews_total.inc(result="skipped")
+            logger.warning("Preview queue is full ({queue_size}), skipping {source}",
+                           queue_size=self.queue_size, source=source)
+
+    async def on_saved(self, job, result):
+        """
+        Upload queue listener: render previews for every saved file.
+        """
+        self.submit(os.path.join(job.save_path, result.filename))
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            source = await self._queue.get()
+            preview_path, thumbnail_path = preview_paths(source)
+            try:
+                await loop.run_in_executor(
+                    self._executor, render_previews, source, preview_path, thumbnail_path,
+                    settings.PREVIEW_MAX_SIZE, settings.THUMBNAIL_SIZE, settings.PREVIEW_QUALITY
+                )
+                previews_total.inc(result="rendered")
+                logger.debug("Rendered previews for {source}", source=source, sample="preview")
+            except Exception as e:
+                previews_total.inc(result="failed")
+                logger.warning("Failed to render previews for {source}: {error}", source=source, error=e)
+            finally:
+                self._queue.task_done()
+
+
+preview_pipeline = PreviewPipeline(settings.PREVIEW_WORKERS, settings.PREVIEW_QUEUE_SIZE)
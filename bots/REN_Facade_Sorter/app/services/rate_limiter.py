@@ -0,0 +1,245 @@
+"""
+Rate-limit-aware scheduler for outbound Bot API calls.
+
+Every request made through telebot passes through OutboundScheduler once
+install() has been called, so handlers keep calling bot.send_message(),
+bot.edit_message_text() etc. as usual:
+
+- message-producing methods wait for a token from a global bucket
+  (RATE_LIMIT_GLOBAL per second) and a per-chat bucket (RATE_LIMIT_PER_CHAT
+  for private chats, RATE_LIMIT_PER_GROUP for groups); edits made while
+  answering a button press (inside callback_edits()) only use the global
+  bucket, so navigating the menu is never held back by earlier messages;
+- an edit of a message that is still waiting for its turn is replaced by a
+  newer edit of the same message, so only the latest text is sent and every
+  caller receives the result of that request; such edits leave the last
+  token of the chat's burst to new messages;
+- a 429 response blocks the affected bucket for retry_after seconds and the
+  request is retried up to RATE_LIMIT_RETRIES times.
+
+Waits for a token, replaced edits and retries are exported as rate_limit_*
+metrics.
+
+Long polling, file downloads and webhook management are not throttled.
+"""
+
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from telebot import asyncio_helper
+from telebot.asyncio_helper import ApiTelegramException
+from app.services.metrics import (
+    rate_limit_coalesced_total, rate_limit_requests_total, rate_limit_retries_total, rate_limit_wait_seconds
+)
+from app.utils.logger import logger
+from config import settings
+
+# Методы, которые отправляют или изменяют сообщения в чате
+_CHAT_METHOD_PREFIXES = ("send", "edit", "copy", "forward")
+# Методы, которые учитываются только глобальным лимитом
+_GLOBAL_METHODS = {"deleteMessage", "deleteMessages", "answerCallbackQuery"}
+# Правки, в которых важен только последний вариант
+_COALESCED_METHODS = {"editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+
+# Задан внутри обработчика нажатия кнопки (см. callback_edits)
+_in_callback: ContextVar[bool] = ContextVar("rate_limit_in_callback", default=False)
+
+# Простаивающие корзины чатов удаляются при превышении этого количества
+_MAX_IDLE_BUCKETS = 1000
+
+
+@contextmanager
+def callback_edits():
+    """
+    Mark requests of the enclosed block as the answer to a button press.
+    """
+    token = _in_callback.set(True)
+    try:
+        yield
+    finally:
+        _in_callback.reset(token)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens per second, holding at most capacity
+    tokens. Waiters are served in FIFO order.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = 0.0
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        if self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, reserve: int = 0) -> float:
+        """
+        Take one token, waiting if necessary. With reserve the token is only
+        taken while that many more stay in the bucket.
+
+        Returns:
+            Seconds spent waiting
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1 + reserve:
+                        self.tokens -= 1
+                        return now - started
+                    wait = (1 + reserve - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def block(self, seconds: float):
+        """Refuse tokens for the given number of seconds (after a 429)."""
+        now = asyncio.get_running_loop().time()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return not self._lock.locked() and self.tokens >= self.capacity and now >= self.blocked_until
+
+
+@dataclass
+class _PendingEdit:
+    params: dict
+    future: asyncio.Future
+
+
+class OutboundScheduler:
+    """
+    Throttles, coalesces and retries Bot API requests.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(settings.RATE_LIMIT_GLOBAL, settings.RATE_LIMIT_GLOBAL)
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._pending_edits: Dict[Tuple[str, str, str], _PendingEdit] = {}
+        self._send = None
+
+    def install(self):
+        """
+        Route all telebot requests through the scheduler.
+        """
+        if self._send is not None:
+            return
+        self._send = asyncio_helper._process_request
+        asyncio_helper._process_request = self.process_request
+        logger.info(
+            "Outbound rate limits: {global_rate}/s global, {chat_rate}/s per chat, {group_rate:.2f}/s per group",
+            global_rate=settings.RATE_LIMIT_GLOBAL, chat_rate=settings.RATE_LIMIT_PER_CHAT,
+            group_rate=settings.RATE_LIMIT_PER_GROUP
+        )
+
+    # --- buckets ---
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= _MAX_IDLE_BUCKETS:
+                self._drop_idle_buckets()
+            if chat_id.startswith("-"):
+                rate = settings.RATE_LIMIT_PER_GROUP
+            else:
+                rate = settings.RATE_LIMIT_PER_CHAT
+            bucket = TokenBucket(rate, settings.RATE_LIMIT_CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _drop_idle_buckets(self):
+        now = asyncio.get_running_loop().time()
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.is_idle(now)]:
+            del self._chat_buckets[chat_id]
+
+    async def _acquire(self, bucket: TokenBucket, reserve: int = 0):
+        waited = await bucket.acquire(reserve)
+        if waited >= 0.001:
+            rate_limit_wait_seconds.observe(waited, bucket="global" if bucket is self.global_bucket else "chat")
+
+    # --- requests ---
+
+    async def process_request(self, token, url, method='get', params=None, files=None, **kwargs):
+        """
+        Drop-in replacement for asyncio_helper._process_request.
+        """
+        per_chat = url.startswith(_CHAT_METHOD_PREFIXES)
+        if not per_chat and url not in _GLOBAL_METHODS:
+            return await self._send(token, url, method, params, files, **kwargs)
+
+        rate_limit_requests_total.inc()
+        chat_id = str(params["chat_id"]) if per_chat and params and "chat_id" in params else None
+        # Правка сообщения, на кнопку которого нажал пользователь, не тратит лимит чата
+        chat_bucket = self._chat_bucket(chat_id) if chat_id and not (
+            url.startswith("edit") and _in_callback.get()
+        ) else None
+
+        if url in _COALESCED_METHODS and chat_id and "message_id" in params and not files:
+            key = (url, chat_id, str(params["message_id"]))
+            pending = self._pending_edits.get(key)
+            if pending is not None:
+                # Предыдущая правка еще ждет очереди: отправим только последнюю
+                pending.params = params
+                rate_limit_coalesced_total.inc()
+                return await asyncio.shield(pending.future)
+            pending = _PendingEdit(params, asyncio.get_running_loop().create_future())
+            self._pending_edits[key] = pending
+            try:
+                if chat_bucket:
+                    # Промежуточная правка оставляет токен для нового сообщения
+                    await self._acquire(chat_bucket, reserve=1 if chat_bucket.capacity > 1 else 0)
+                await self._acquire(self.global_bucket)
+            except BaseException:
+                self._pending_edits.pop(key, None)
+                pending.future.cancel()
+                raise
+            self._pending_edits.pop(key, None)
+            try:
+                result = await self._send_with_retry(token, url, method, pending.params, files, chat_id, **kwargs)
+            except Exception as e:
+                pending.future.set_exception(e)
+                # Исключение получают все ожидающие, но не все могут его забрать
+                pending.future.exception()
+                raise
+            pending.future.set_result(result)
+            return result
+
+        if chat_bucket:
+            await self._acquire(chat_bucket)
+        await self._acquire(self.global_bucket)
+        return await self._send_with_retry(token, url, method, params, files, chat_id, **kwargs)
+
+    async def _send_with_retry(self, token, url, method, params, files, chat_id: Optional[str], **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return await self._send(token, url, method, dict(params) if params else params, files, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 429 or attempt >= settings.RATE_LIMIT_RETRIES:
+                    raise
+                attempt += 1
+                retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+                rate_limit_retries_total.inc()
+                logger.warning("Flood control on {method} (chat {chat_id}), retrying in {retry_after}s (try #{attempt})",
+                               method=url, chat_id=chat_id, retry_after=retry_after, attempt=attempt)
+                bucket = self._chat_bucket(chat_id) if chat_id else self.global_bucket
+                bucket.block(retry_after)
+                await self._acquire(bucket)
+                if bucket is not self.global_bucket:
+                    await self._acquire(self.global_bucket)
+
+
+outbound_scheduler = OutboundScheduler()
@@ -0,0 +1,276 @@
+"""
+Local staging area in front of the inspection share.
+
+With STAGING_DIR set, new downloads are written (temporary file, fsync,
+rename) to a local directory mirroring the location tree, and the user gets
+the upload report as soon as the file is there. A background migrator then
+moves staged files to their folders under INSPECTIONS_BASE_PATH in batches
+of STAGING_BATCH_SIZE, with STAGING_MIGRATE_WORKERS batches in flight. A file
+already on the share is never replaced: if its content differs the job fails
+and the staged copy is kept for manual recovery.
+
+Staged files are tracked by the upload queue (job status "staged"): the
+post-save stages (catalog, previews, metadata) run once a file has reached
+its final folder, and files not migrated before a stop are migrated after
+the next start. Until then locate() resolves a final path to its staged copy,
+so duplicate detection already sees the file.
+"""
+
+import os
+import time
+import errno
+import shutil
+import filecmp
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from app.services import file_io
+from app.services.location_tree import location_tree
+from app.services.metrics import (
+    staging_migrated_total, staging_migration_failed_total, staging_migration_lag_seconds
+)
+from app.utils.logger import logger
+from config import settings
+
+# Размер блока при копировании между файловыми системами
+_BLOCK_SIZE = 1024 * 1024
+
+# Ошибки os.link на файловых системах без жестких ссылок
+_NO_HARDLINKS = {errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOSYS, errno.EMLINK}
+
+MigratedCallback = Callable[[object, object, Optional[Exception]], Awaitable[None]]
+
+
+class StagedFileMissing(Exception):
+    """The staged copy of a file is gone (and it is not on the share either)."""
+
+
+class StagedFileConflict(Exception):
+    """A different file already exists at the final path of a staged file."""
+
+
+@dataclass
+class StagedFile:
+    """A staged file waiting for migration, with the upload job it belongs to."""
+
+    job: object
+    result: object
+    staged_path: str
+    final_path: str
+    staged_at: float
+
+
+def _place(src: str, dst: str):
+    """
+    Move src to dst on the same file system, failing with FileExistsError
+    instead of replacing an existing dst.
+    """
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in _NO_HARDLINKS:
+            raise
+        # Без жестких ссылок: проверка и переименование
+        if os.path.exists(dst):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        os.rename(src, dst)
+        return
+    os.remove(src)
+
+
+def _migrate_file(staged_path: str, final_path: str):
+    if not os.path.exists(staged_path):
+        if os.path.exists(final_path):
+            # Перенос завершился до остановки бота
+            return
+        raise StagedFileMissing(staged_path)
+    try:
+        try:
+            _place(staged_path, final_path)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+        # Другая файловая система: копия с fsync, затем удаление локальной копии
+        tmp_path = final_path + ".part"
+        try:
+            with open(staged_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, _BLOCK_SIZE)
+                dst.flush()
+                os.fsync(dst.fileno())
+            _place(tmp_path, final_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.remove(staged_path)
+    except FileExistsError:
+        # Та же копия уже на месте (перенос прервался после ссылки) - иначе конфликт
+        if not (os.path.samefile(staged_path, final_path) or filecmp.cmp(staged_path, final_path, shallow=False)):
+            raise StagedFileConflict(final_path) from None
+        os.remove(staged_path)
+
+
+def _migrate_batch(pairs: List[Tuple[str, str]]) -> List[Optional[Exception]]:
+    errors = []
+    for staged_path, final_path in pairs:
+        try:
+            _migrate_file(staged_path, final_path)
+            errors.append(None)
+        except Exception as e:
+            errors.append(e)
+    return errors
+
+
+class StagingArea:
+    """
+    Staging directory and the migrator moving its files to the share.
+    """
+
+    def __init__(self, directory: Optional[str]):
+        self.directory = directory
+        self.root: Optional[str] = None
+        self._dirs: Set[str] = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._pending: Dict[int, StagedFile] = {}
+        self._on_migrated: Optional[MigratedCallback] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    @property
+    def backlog(self) -> int:
+        """Number of staged files not migrated yet."""
+        return len(self._pending)
+
+    @property
+    def lag(self) -> float:
+        """Seconds the oldest staged file has been waiting for migration."""
+        if not self._pending:
+            return 0.0
+        return time.time() - min(staged.staged_at for staged in self._pending.values())
+
+    def staged_path(self, final_path: str) -> Optional[str]:
+        """
+        Staging counterpart of a path under the storage root.
+        """
+        if self.root is None or location_tree.root is None:
+            return None
+        relative = os.path.relpath(final_path, location_tree.root)
+        if relative.startswith(os.pardir):
+            return None
+        return os.path.join(self.root, relative)
+
+    def locate(self, path: str) -> str:
+        """
+        Existing copy of a saved file: the path itself, or its staged copy
+        while it is not migrated. Blocking, call on the I/O executor.
+        """
+        if self.root is None or os.path.exists(path):
+            return path
+        staged = self.staged_path(path)
+        return staged if staged is not None and os.path.exists(staged) else path
+
+    async def dir_for(self, save_path: str) -> Optional[str]:
+        """
+        Staging folder for downloads into save_path, or None to write directly.
+        """
+        staged = self.staged_path(save_path)
+        if staged is not None and staged not in self._dirs:
+            await file_io.makedirs(staged)
+            self._dirs.add(staged)
+        return staged
+
+    # --- migrator ---
+
+    async def start(self, on_migrated: MigratedCallback):
+        """
+        Start the migration workers. on_migrated(job, result, error) is
+        awaited after every file that reached its final folder (error is None)
+        or cannot get there: its staged copy is gone or a different file
+        already has its name (error is set).
+        """
+        self.root = await file_io.run_io(os.path.realpath, self.directory)
+        await file_io.makedirs(self.root)
+        self._on_migrated = on_migrated
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"staging_migrator_{i}")
+            for i in range(settings.STAGING_MIGRATE_WORKERS)
+        ]
+        logger.info("Staging uploads in {root}, {workers} migration workers",
+                    root=self.root, workers=settings.STAGING_MIGRATE_WORKERS)
+
+    async def stop(self):
+        """
+        Stop the workers. Files not migrated yet stay staged for the next start.
+        """
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._pending:
+            logger.warning("{files} staged files left for migration after restart", files=len(self._pending))
+
+    def submit(self, job, result, staged_at: Optional[float] = None):
+        """
+        Queue the staged file of a finished upload job for migration.
+        """
+        final_path = os.path.join(job.save_path, result.filename)
+        staged = StagedFile(job, result, self.staged_path(final_path), final_path, staged_at or time.time())
+        self._pending[job.id] = staged
+        self._queue.put_nowait(staged)
+
+    async def _worker(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < settings.STAGING_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._migrate(batch)
+            except Exception as e:
+                logger.exception("Staging migration batch crashed: {error}", error=e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _migrate(self, batch: List[StagedFile]):
+        errors = await file_io.run_io(_migrate_batch, [(staged.staged_path, staged.final_path) for staged in batch])
+        # Переносы должны пережить сбой до того, как задания будут удалены
+        for directory in {os.path.dirname(staged.final_path) for staged, error in zip(batch, errors) if error is None}:
+            await file_io.fsync_dir(directory)
+        loop = asyncio.get_running_loop()
+        for staged, error in zip(batch, errors):
+            if isinstance(error, StagedFileConflict):
+                # Файл на шаре не перезаписываем, локальная копия остается для ручного разбора
+                self._pending.pop(staged.job.id, None)
+                staging_migration_failed_total.inc()
+                logger.error("A different file already exists at {path}, upload job {job_id} failed, "
+                             "staged copy kept at {staged_path}",
+                             path=staged.final_path, job_id=staged.job.id, staged_path=staged.staged_path)
+                await self._on_migrated(staged.job, staged.result, error)
+                continue
+            if isinstance(error, StagedFileMissing):
+                # Локальная копия пропала, повтор не поможет
+                self._pending.pop(staged.job.id, None)
+                staging_migration_failed_total.inc()
+                logger.error("Staged file {path} is missing, upload job {job_id} failed",
+                             path=staged.staged_path, job_id=staged.job.id)
+                await self._on_migrated(staged.job, staged.result, error)
+                continue
+            if error is not None:
+                staging_migration_failed_total.inc()
+                logger.warning("Failed to migrate {path}, retrying in {delay}s: {error}",
+                               path=staged.staged_path, delay=settings.STAGING_RETRY_DELAY, error=error)
+                loop.call_later(settings.STAGING_RETRY_DELAY, self._queue.put_nowait, staged)
+                continue
+            self._pending.pop(staged.job.id, None)
+            staging_migrated_total.inc()
+            staging_migration_lag_seconds.observe(time.time() - staged.staged_at)
+            await self._on_migrated(staged.job, staged.result, None)
+
+
+staging_area = StagingArea(settings.STAGING_DIR)
@@ -0,0 +1,142 @@
+"""
+Per-update handler tracing.
+
+The handler timing middleware opens a Trace for every update; it lives in a
+context variable, so awaited sub-steps of the handler record spans into it
+without being passed around:
+
+- Telegram API calls (install() wraps telebot's request function; time spent
+  waiting in the outbound rate limiter is included);
+- FSM storage access (instrument_storage());
+- file I/O on the I/O executor (file_io.run_io).
+
+Tasks started by a handler inherit the trace, but spans recorded after the
+handler returned (e.g. album processing) are ignored.
+"""
+
+import time
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from telebot import asyncio_helper
+
+# Методы хранилища FSM, время которых попадает в трассировку
+_FSM_METHODS = ("get_state", "set_state", "delete_state", "get_data", "set_data", "reset_data", "save")
+
+
+@dataclass
+class Trace:
+    """Timing of one update: total wall time and the spans of its sub-steps."""
+
+    name: str
+    started: float = field(default_factory=time.perf_counter)
+    spans: List[Tuple[str, float, int]] = field(default_factory=list)
+    duration: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.duration is not None
+
+    def finish(self) -> float:
+        self.duration = time.perf_counter() - self.started
+        return self.duration
+
+    def breakdown(self) -> Dict[str, Tuple[int, float]]:
+        """
+        Span name -> (calls, total seconds), slowest first, plus "other" for
+        time not covered by top-level spans.
+        """
+        totals: Dict[str, List[float]] = {}
+        covered = 0.0
+        for name, duration, depth in self.spans:
+            entry = totals.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += duration
+            if depth == 0:
+                covered += duration
+        result = {name: (int(count), total) for name, (count, total) in
+                  sorted(totals.items(), key=lambda item: item[1][1], reverse=True)}
+        if self.duration is not None:
+            result["other"] = (1, max(self.duration - covered, 0.0))
+        return result
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("handler_trace", default=None)
+# Вложенность спанов своя у каждой задачи: параллельные задачи делят трассу, но не глубину
+_depth: ContextVar[int] = ContextVar("span_depth", default=0)
+
+
+def start_trace(name: str) -> Trace:
+    trace = Trace(name)
+    _current.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    trace = _current.get()
+    return None if trace is None or trace.finished else trace
+
+
+def rename_trace(name: str):
+    """
+    Give the current trace a more specific name once the handler is known.
+    """
+    trace = current_trace()
+    if trace is not None:
+        trace.name = name
+
+
+@contextmanager
+def span(name: str):
+    """
+    Record the wall time of the enclosed block in the current trace.
+    """
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _depth.reset(token)
+        trace.spans.append((name, time.perf_counter() - started, depth))
+
+
+def _traced(func, name: str):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with span(name):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+def instrument_storage(storage):
+    """
+    Record FSM storage calls of this storage instance as "fsm:<method>" spans.
+    """
+    for method in _FSM_METHODS:
+        setattr(storage, method, _traced(getattr(storage, method), f"fsm:{method}"))
+
+
+_send = None
+
+
+def install():
+    """
+    Record every Bot API request as an "api:<method>" span.
+    """
+    global _send
+    if _send is not None:
+        return
+    _send = asyncio_helper._process_request
+
+    async def process_request(token, url, method='get', params=None, files=None, **kwargs):
+        with span(f"api:{url}"):
+            return await _send(token, url, method, params, files, **kwargs)
+
+    asyncio_helper._process_request = process_request
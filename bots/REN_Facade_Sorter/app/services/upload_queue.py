@@ -0,0 +1,453 @@
+"""
+Durable upload job queue.
+
+Every accepted file is written to a SQLite job table (UPLOAD_QUEUE_DB_PATH)
+before the user is acknowledged. A pool of DOWNLOAD_CONCURRENCY workers
+drains the queue, retrying failed downloads with exponential backoff, and
+unfinished jobs are replayed when the bot starts again, so a deploy or crash
+in the middle of an album does not lose photos. Album items are recorded as
+"held" jobs as soon as they arrive and released to the workers when the
+album is complete. With a staging area (app.services.staging) a downloaded
+file is reported to the user right away and its job stays "staged" until the
+file has been moved to the share. Finished jobs are deleted.
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from telebot.async_telebot import AsyncTeleBot
+from app.services import file_io
+from app.services.downloader import DownloadResult, download_one, is_retryable
+from app.services.metrics import files_failed_total, files_saved_total
+from app.services.staging import staging_area
+from app.utils.logger import logger
+from config import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    inspection TEXT NOT NULL,
+    block TEXT NOT NULL,
+    orientation TEXT NOT NULL,
+    level TEXT NOT NULL,
+    save_path TEXT NOT NULL,
+    photo_info TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    filename TEXT,
+    duplicate INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+"""
+
+ProgressCallback = Callable[[int, List[DownloadResult]], Awaitable[None]]
+SavedListener = Callable[["UploadJob", DownloadResult], Awaitable[None]]
+
+
+@dataclass
+class UploadJob:
+    """A single file waiting to be downloaded."""
+
+    id: int
+    batch_id: str
+    position: int
+    user_id: int
+    chat_id: int
+    inspection: str
+    block: str
+    orientation: str
+    level: str
+    save_path: str
+    photo_info: dict
+    attempts: int = 0
+
+
+@dataclass
+class UploadTicket:
+    """Handle returned to the submitter of a job."""
+
+    job: UploadJob
+    result: DownloadResult
+    future: asyncio.Future
+
+
+class UploadQueue:
+    """
+    SQLite-backed job queue with an asyncio worker pool.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._bot: Optional[AsyncTeleBot] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._tickets: Dict[int, UploadTicket] = {}
+        self._saved_listeners: List[SavedListener] = []
+
+    # --- storage (runs on the I/O executor) ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(sql, params)
+            conn.commit()
+
+    def _insert_held(self, row: tuple) -> int:
+        now = datetime.now().isoformat()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                # Позиция в альбоме - порядок поступления элементов
+                position = conn.execute(
+                    "SELECT COALESCE(MAX(position), 0) + 1 FROM jobs WHERE batch_id = ? AND status = 'held'",
+                    (row[0],)
+                ).fetchone()[0]
+                cursor = conn.execute(
+                    "INSERT INTO jobs (batch_id, position, user_id, chat_id, inspection, block, orientation, "
+                    "level, save_path, photo_info, status, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'held', ?, ?)",
+                    (row[0], position) + row[1:] + (now, now)
+                )
+        return cursor.lastrowid
+
+    def _release_held(self, job_ids: List[int]) -> List[UploadJob]:
+        if not job_ids:
+            return []
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    f"UPDATE jobs SET status = 'pending', updated_at = ? WHERE id IN ({placeholders}) AND status = 'held'",
+                    (datetime.now().isoformat(), *job_ids)
+                )
+            rows = conn.execute(f"SELECT * FROM jobs WHERE id IN ({placeholders})", tuple(job_ids)).fetchall()
+        jobs = {row['id']: self._job_from_row(row) for row in rows}
+        return [jobs[job_id] for job_id in job_ids if job_id in jobs]
+
+    def _insert_batch(self, rows: List[tuple]) -> List[int]:
+        now = datetime.now().isoformat()
+        ids = []
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for row in rows:
+                    cursor = conn.execute(
+                        "INSERT INTO jobs (batch_id, position, user_id, chat_id, inspection, block, orientation, "
+                        "level, save_path, photo_info, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        row + (now, now)
+                    )
+                    ids.append(cursor.lastrowid)
+        return ids
+
+    @staticmethod
+    def _job_from_row(row: sqlite3.Row) -> UploadJob:
+        return UploadJob(
+            id=row['id'], batch_id=row['batch_id'], position=row['position'],
+            user_id=row['user_id'], chat_id=row['chat_id'],
+            inspection=row['inspection'], block=row['block'],
+            orientation=row['orientation'], level=row['level'],
+            save_path=row['save_path'], photo_info=json.loads(row['photo_info']),
+            attempts=row['attempts']
+        )
+
+    def _load_unfinished(self) -> List[UploadJob]:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                # Задания, прерванные остановкой бота, и элементы незавершенных альбомов выполняем заново
+                conn.execute("UPDATE jobs SET status = 'pending' WHERE status IN ('running', 'held')")
+                # Записи прежних версий, которые не удаляли завершенные задания
+                conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed')")
+            rows = conn.execute("SELECT * FROM jobs WHERE status = 'pending' ORDER BY id").fetchall()
+        return [self._job_from_row(row) for row in rows]
+
+    def _load_staged(self) -> List[Tuple[UploadJob, DownloadResult, float]]:
+        with self._lock:
+            rows = self._connect().execute("SELECT * FROM jobs WHERE status = 'staged' ORDER BY id").fetchall()
+        return [
+            (
+                self._job_from_row(row),
+                DownloadResult(index=row['position'], photo_info=json.loads(row['photo_info']),
+                               filename=row['filename'], done=True, duplicate=bool(row['duplicate']), staged=True),
+                datetime.fromisoformat(row['updated_at']).timestamp()
+            )
+            for row in rows
+        ]
+
+    async def _update(self, job_id: int, **fields):
+        fields['updated_at'] = datetime.now().isoformat()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        await file_io.run_io(self._execute, f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    async def _delete(self, job_id: int):
+        # Завершенное задание не нужно для повтора, таблица не растет
+        await file_io.run_io(self._execute, "DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    # --- lifecycle ---
+
+    async def start(self, bot: AsyncTeleBot) -> Dict[str, List[UploadTicket]]:
+        """
+        Start the worker pool and replay unfinished jobs.
+
+        Returns:
+            Replayed tickets grouped by batch, so the caller can report them
+        """
+        self._bot = bot
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"upload_worker_{i}")
+            for i in range(settings.DOWNLOAD_CONCURRENCY)
+        ]
+
+        await self._recover_staged()
+
+        recovered: Dict[str, List[UploadTicket]] = {}
+        for job in await file_io.run_io(self._load_unfinished):
+            ticket = self._track(job)
+            recovered.setdefault(job.batch_id, []).append(ticket)
+            self._queue.put_nowait(job)
+
+        if recovered:
+            jobs_count = sum(len(tickets) for tickets in recovered.values())
+            logger.warning("Replaying {jobs} unfinished upload jobs from {batches} batches",
+                           jobs=jobs_count, batches=len(recovered))
+        return recovered
+
+    async def _recover_staged(self):
+        staged = await file_io.run_io(self._load_staged)
+        if staging_area.enabled:
+            await staging_area.start(self._on_migrated)
+        elif staged:
+            logger.error("{files} staged files are not migrated: STAGING_DIR is not set", files=len(staged))
+            return
+        for job, result, staged_at in staged:
+            staging_area.submit(job, result, staged_at)
+        if staged:
+            logger.warning("Migrating {files} staged files left from the previous run", files=len(staged))
+
+    async def stop(self):
+        """
+        Stop the workers. Unfinished jobs stay in the database for replay.
+        """
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if staging_area.enabled:
+            await staging_area.stop()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def add_saved_listener(self, listener: SavedListener):
+        """
+        Register a post-save stage. listener(job, result) is awaited after
+        every successfully saved file; its errors do not fail the job.
+        """
+        self._saved_listeners.append(listener)
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs accepted but not finished yet."""
+        return len(self._tickets)
+
+    # --- producer side ---
+
+    def _track(self, job: UploadJob) -> UploadTicket:
+        ticket = UploadTicket(
+            job=job,
+            result=DownloadResult(index=job.position, photo_info=job.photo_info),
+            future=asyncio.get_running_loop().create_future()
+        )
+        self._tickets[job.id] = ticket
+        return ticket
+
+    async def submit(self, user_id: int, chat_id: int, photos: List[dict], save_path: str,
+                     location: Tuple[str, str, str, str]) -> List[UploadTicket]:
+        """
+        Durably record photos as jobs and hand them to the workers.
+
+        Args:
+            user_id: User ID
+            chat_id: Chat ID
+            photos: List of photo info dictionaries
+            save_path: Target directory (must exist)
+            location: (inspection, block, orientation, level)
+
+        Returns:
+            One ticket per photo, in the original order
+        """
+        if self._queue is None:
+            raise RuntimeError("Upload queue is not started")
+
+        batch_id = uuid.uuid4().hex
+        rows = [
+            (batch_id, position, user_id, chat_id, *location, save_path, json.dumps(info))
+            for position, info in enumerate(photos, 1)
+        ]
+        ids = await file_io.run_io(self._insert_batch, rows)
+
+        tickets = []
+        for job_id, (position, info) in zip(ids, enumerate(photos, 1)):
+            job = UploadJob(job_id, batch_id, position, user_id, chat_id, *location, save_path, info)
+            tickets.append(self._track(job))
+            self._queue.put_nowait(job)
+        return tickets
+
+    async def hold(self, batch_id: str, user_id: int, chat_id: int, photo_info: dict, save_path: str,
+                   location: Tuple[str, str, str, str]) -> int:
+        """
+        Durably record an album item that is not handed to the workers yet.
+        Held jobs are replayed like pending ones after a restart.
+
+        Args:
+            batch_id: Album key; items of one batch are numbered in arrival order
+            user_id: User ID
+            chat_id: Chat ID
+            photo_info: Photo info dictionary
+            save_path: Target directory (must exist)
+            location: (inspection, block, orientation, level)
+
+        Returns:
+            Job ID to pass to release()
+        """
+        return await file_io.run_io(
+            self._insert_held, (batch_id, user_id, chat_id, *location, save_path, json.dumps(photo_info))
+        )
+
+    async def release(self, job_ids: List[int]) -> List[UploadTicket]:
+        """
+        Hand held jobs to the workers.
+
+        Returns:
+            One ticket per job, in the order of job_ids
+        """
+        if self._queue is None:
+            raise RuntimeError("Upload queue is not started")
+        tickets = []
+        for job in await file_io.run_io(self._release_held, job_ids):
+            tickets.append(self._track(job))
+            self._queue.put_nowait(job)
+        return tickets
+
+    # --- consumer side ---
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.exception("Upload job {job_id} crashed: {error}", job_id=job.id, error=e)
+                self._resolve(job, error=e)
+            finally:
+                self._queue.task_done()
+
+    def _retry_delay(self, attempts: int) -> float:
+        return min(settings.DOWNLOAD_RETRY_DELAY * 2 ** (attempts - 1), settings.UPLOAD_RETRY_MAX_DELAY)
+
+    async def _run(self, job: UploadJob):
+        result = (self._tickets.get(job.id) or self._track(job)).result
+        job.attempts += 1
+        await self._update(job.id, status='running', attempts=job.attempts)
+
+        try:
+            staging_dir = await staging_area.dir_for(job.save_path) if staging_area.enabled else None
+            await download_one(self._bot, result, job.save_path, staging_dir)
+        except Exception as e:
+            result.error = e
+            if job.attempts < settings.DOWNLOAD_RETRIES and is_retryable(e):
+                delay = self._retry_delay(job.attempts)
+                logger.warning("Upload job {job_id} failed (try #{attempt}), retrying in {delay:.1f}s: {error}",
+                               job_id=job.id, attempt=job.attempts, delay=delay, error=e)
+                await self._update(job.id, status='pending', error=str(e))
+                asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job)
+                return
+            await self._delete(job.id)
+            files_failed_total.inc()
+        else:
+            result.error = None
+            files_saved_total.inc(duplicate=str(result.duplicate).lower())
+            if result.staged:
+                # Пользователь получает ответ сразу, файл переносится на общий ресурс в фоне
+                await self._update(job.id, status='staged', filename=result.filename, duplicate=int(result.duplicate))
+                staging_area.submit(job, result)
+            else:
+                await self._delete(job.id)
+                await self._notify_saved(job, result)
+
+        self._resolve(job)
+
+    async def _on_migrated(self, job: UploadJob, result: DownloadResult, error: Optional[Exception]):
+        await self._delete(job.id)
+        if error is None:
+            await self._notify_saved(job, result)
+
+    async def _notify_saved(self, job: UploadJob, result: DownloadResult):
+        for listener in self._saved_listeners:
+            try:
+                await listener(job, result)
+            except Exception as e:
+                logger.error("Post-save stage {stage} failed for job {job_id}: {error}",
+                             stage=getattr(listener, '__qualname__', str(listener)), job_id=job.id, error=e)
+
+    def _resolve(self, job: UploadJob, error: Optional[Exception] = None):
+        ticket = self._tickets.pop(job.id, None)
+        if ticket is None:
+            return
+        if error is not None:
+            ticket.result.error = error
+        ticket.result.done = True
+        if not ticket.future.done():
+            ticket.future.set_result(ticket.result)
+
+
+async def wait_for_tickets(tickets: List[UploadTicket],
+                           on_progress: Optional[ProgressCallback] = None) -> List[DownloadResult]:
+    """
+    Wait until all tickets are finished.
+
+    The progress callback is awaited sequentially after each completed file,
+    so callers may edit a progress message from it without racing.
+
+    Returns:
+        Download results in the original order
+    """
+    results = [ticket.result for ticket in tickets]
+    for completed, future in enumerate(asyncio.as_completed([ticket.future for ticket in tickets]), 1):
+        await future
+        if on_progress:
+            await on_progress(completed, results)
+    return results
+
+
+upload_queue = UploadQueue(settings.UPLOAD_QUEUE_DB_PATH)
@@ -0,0 +1,143 @@
+"""
+Webhook delivery mode served by aiohttp.
+
+Telegram POSTs each update to WEBHOOK_PATH. The request is authenticated by
+the X-Telegram-Bot-Api-Secret-Token header, parsed and put on a bounded
+intake queue; the HTTP response is returned immediately and a pool of
+WEBHOOK_WORKERS tasks feeds the updates to the bot's handlers. When the
+queue is full the server answers 503 so Telegram redelivers the update
+later instead of it being dropped.
+"""
+
+import hmac
+import asyncio
+import secrets
+from typing import List, Optional
+from aiohttp import web
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Update
+from app.utils.logger import logger
+from config import settings
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    aiohttp application receiving updates from Telegram.
+
+    The server does not depend on the real Bot API: make_app() can be served
+    by aiohttp's test client and fed updates by a local fake Telegram client.
+    """
+
+    def __init__(self, bot: AsyncTeleBot, path: str, secret_token: str,
+                 queue_size: int, workers: int):
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.workers_count = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._workers: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+        self.received = 0
+        self.rejected = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.on_startup.append(self._start_workers)
+        app.on_cleanup.append(self._stop_workers)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """
+        Validate and enqueue a single update.
+        """
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, self.secret_token):
+            logger.warning("Rejected webhook request with invalid secret token from {remote}", remote=request.remote)
+            return web.Response(status=401)
+
+        try:
+            update = Update.de_json(await request.text())
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Rejected malformed webhook update: {error}", error=e)
+            return web.Response(status=400)
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            self.rejected += 1
+            logger.warning("Webhook intake queue is full ({queue_size}), update {update_id} deferred",
+                           queue_size=self.queue.maxsize, update_id=update.update_id)
+            return web.Response(status=503)
+
+        self.received += 1
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.bot.process_new_updates([update])
+            except Exception as e:
+                logger.exception("Error processing webhook update {update_id}: {error}", update_id=update.update_id, error=e)
+            finally:
+                self.queue.task_done()
+
+    async def _start_workers(self, app: web.Application):
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"webhook_worker_{i}")
+            for i in range(self.workers_count)
+        ]
+
+    async def _stop_workers(self, app: web.Application):
+        # Даем воркерам обработать уже принятые обновления
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=10)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping {updates} unprocessed webhook updates on shutdown", updates=self.queue.qsize())
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info("Webhook server listening on {host}:{port}{path}", host=host, port=port, path=self.path)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_webhook(bot: AsyncTeleBot):
+    """
+    Register the webhook with Telegram and serve updates until cancelled.
+    """
+    secret_token = settings.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = WebhookServer(
+        bot,
+        path=settings.WEBHOOK_PATH,
+        secret_token=secret_token,
+        queue_size=settings.WEBHOOK_QUEUE_SIZE,
+        workers=settings.WEBHOOK_WORKERS
+    )
+    await server.start(settings.WEBHOOK_HOST, settings.WEBHOOK_PORT)
+
+    url = settings.WEBHOOK_URL.rstrip("/") + settings.WEBHOOK_PATH
+    await bot.set_webhook(
+        url=url,
+        secret_token=secret_token,
+        max_connections=settings.WEBHOOK_MAX_CONNECTIONS
+    )
+    logger.info("Webhook registered at {url}", url=url)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
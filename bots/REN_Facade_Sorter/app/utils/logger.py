@@ -1,10 +1,25 @@
 """
 Logging configuration using loguru.
+
+LOG_PROFILE selects the sinks:
+- development: human-readable text with full backtraces and variable values;
+- production: JSON lines with the message and its typed fields (keyword
+  arguments of the log call, e.g. user_id, location, files), no variable
+  values in tracebacks, and per-photo DEBUG/INFO lines sampled to
+  LOG_SAMPLE_PER_SECOND per kind (warnings and errors are never dropped).
+
+Log calls pass values as keyword arguments instead of f-strings, so the
+message is only formatted when the record passes the level filter:
+    logger.info("User {user_id} saved {files} files", user_id=user_id, files=count)
+Per-photo DEBUG/INFO lines additionally carry sample="<kind>" to be rate limited.
 """
 
 from loguru import logger
 import sys
 import os
+import json
+import time
+import traceback
 from config import settings
 
 # Ensure logs directory exists
@@ -13,32 +28,119 @@ os.makedirs("logs", exist_ok=True)
 # Remove default loguru handler
 logger.remove()
 
-# Add handler: human-readable format to stdout
-logger.add(
-    sys.stdout,
-    level=settings.LOG_LEVEL,
-    format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level:<8} | {name}:{function}:{line} - {message}",
-    colorize=True,
-    enqueue=True,
-    backtrace=True,
-    diagnose=True,
-)
-
-# Add handler: log to file with rotation (10 MB)
-logger.add(
-    "logs/bot.log",
-    level=settings.LOG_LEVEL,
-    format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level:<8} | {name}:{function}:{line} - {message}",
-    rotation="10 MB",
-    retention="10 days",
-    compression="zip",
-    enqueue=True,
-    backtrace=True,
-    diagnose=True,
-)
+TEXT_FORMAT = "{time:YYYY-MM-DD HH:mm:ss.SSS} | {level:<8} | {name}:{function}:{line} - {message}"
+
+# Выборка применяется только к записям не выше этого уровня
+_SAMPLED_MAX_LEVEL = logger.level("INFO").no
+
+# Служебные поля extra, которые не выводятся в JSON
+_INTERNAL_EXTRA = ("sample", "dropped", "json")
+
+
+class _Sampler:
+    """
+    Per-kind rate limit for sampled DEBUG/INFO records: at most `rate` records
+    per second of each kind pass, the rest are counted and reported with the
+    next record that passes. Warnings and errors always pass.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._windows = {}
+
+    def __call__(self, record):
+        kind = record["extra"].get("sample")
+        if kind is None or self.rate <= 0 or record["level"].no > _SAMPLED_MAX_LEVEL:
+            return
+        now = time.monotonic()
+        second, passed, suppressed = self._windows.get(kind, (now, 0, 0))
+        if now - second >= 1.0:
+            second, passed = now, 0
+        if passed < self.rate:
+            if suppressed:
+                record["extra"]["suppressed"] = suppressed
+            self._windows[kind] = (second, passed + 1, 0)
+        else:
+            record["extra"]["dropped"] = True
+            self._windows[kind] = (second, passed, suppressed + 1)
+
+
+def _not_dropped(record) -> bool:
+    return not record["extra"].get("dropped")
+
+
+def _json_format(record) -> str:
+    data = {
+        "ts": record["time"].isoformat(),
+        "level": record["level"].name,
+        "logger": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "msg": record["message"],
+    }
+    data.update((key, value) for key, value in record["extra"].items() if key not in _INTERNAL_EXTRA)
+    if record["exception"] is not None:
+        exc_type, exc_value, exc_traceback = record["exception"]
+        data["exception"] = "".join(traceback.format_exception(exc_type, exc_value, exc_traceback))
+    record["extra"]["json"] = json.dumps(data, ensure_ascii=False, default=str)
+    return "{extra[json]}\n"
+
+
+if settings.LOG_PROFILE == "production":
+    logger.configure(patcher=_Sampler(settings.LOG_SAMPLE_PER_SECOND))
+
+    # Add handler: JSON lines to stdout
+    logger.add(
+        sys.stdout,
+        level=settings.LOG_LEVEL,
+        format=_json_format,
+        filter=_not_dropped,
+        enqueue=True,
+        backtrace=False,
+        diagnose=False,
+    )
+
+    # Add handler: JSON lines to file with rotation (10 MB)
+    logger.add(
+        "logs/bot.jsonl",
+        level=settings.LOG_LEVEL,
+        format=_json_format,
+        filter=_not_dropped,
+        rotation="10 MB",
+        retention="10 days",
+        compression="zip",
+        enqueue=True,
+        backtrace=False,
+        diagnose=False,
+    )
+else:
+    # Add handler: human-readable format to stdout
+    logger.add(
+        sys.stdout,
+        level=settings.LOG_LEVEL,
+        format=TEXT_FORMAT,
+        colorize=True,
+        enqueue=True,
+        backtrace=True,
+        diagnose=True,
+    )
+
+    # Add handler: log to file with rotation (10 MB)
+    logger.add(
+        "logs/bot.log",
+        level=settings.LOG_LEVEL,
+        format=TEXT_FORMAT,
+        rotation="10 MB",
+        retention="10 days",
+        compression="zip",
+        enqueue=True,
+        backtrace=True,
+        diagnose=True,
+    )
 
 # Example of usage:
 # logger.info("This is an info message")
+# logger.info("User {user_id} uploaded {files} files", user_id=user_id, files=files)
 # logger.warning("This is a warning message")
 # logger.error("This is an error message")
-# logger.critical("This is a critical message")
\ No newline at end of file
+# logger.critical("This is a critical message")
@@ -0,0 +1,3 @@
+"""
+Load testing tools for the REN Facade Sorter bot.
+"""
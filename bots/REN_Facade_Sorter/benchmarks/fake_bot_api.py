@@ -0,0 +1,355 @@
+"""
+Local aiohttp server emulating the Bot API endpoints used by the bot.
+
+Updates are injected with push_*() and handed out by getUpdates (long
+polling). Files announced by push_photo_album()/push_document() are served by
+getFile and the file download endpoint; each file gets unique content so
+duplicate detection does not skip it. Once the bot calls setWebhook the
+updates are POSTed to its webhook instead, in order, with the registered
+secret token; an update answered with 503 is redelivered like Telegram does. With local_dir the server behaves like
+telegram-bot-api --local: getFile writes the file there and returns its
+absolute path. Every outbound call of the bot is recorded and can be awaited
+with wait_for().
+"""
+
+import io
+import os
+import time
+import asyncio
+import itertools
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+from aiohttp import ClientSession, web
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CallPredicate = Callable[[str, dict], bool]
+
+# Размер куска при отдаче файла
+_CHUNK_SIZE = 64 * 1024
+
+# Пауза перед повторной доставкой апдейта, на который вебхук ответил 503
+_REDELIVERY_DELAY = 0.05
+
+
+def _make_blob(size: int) -> bytes:
+    """
+    File body of at least size bytes. With Pillow it starts with a real JPEG
+    (readers ignore the padding after it), so the preview stage does real work.
+    """
+    head = b""
+    if Image is not None:
+        buffer = io.BytesIO()
+        Image.new("RGB", (2560, 1920), (120, 130, 140)).save(buffer, "JPEG", quality=85)
+        head = buffer.getvalue()
+    padding = bytes(range(256)) * (max(size - len(head), 0) // 256 + 1)
+    return head + padding
+
+
+class FakeBotAPI:
+    """
+    In-memory Bot API: update queue, file store and call log.
+    """
+
+    def __init__(self, file_delay: float = 0.0, local_dir: Optional[str] = None):
+        self.file_delay = file_delay
+        self.local_dir = local_dir
+        self._updates: List[dict] = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._files: Dict[str, int] = {}
+        self._blob = b""
+        self._waiters: List[Tuple[CallPredicate, asyncio.Future]] = []
+        self.pushed_at: Dict[int, float] = {}
+        self.delivered_at: Dict[int, float] = {}
+        self.last_message: Dict[int, int] = {}
+        self.calls: Counter = Counter()
+        self.updates_delivered = 0
+        self.bytes_served = 0
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret = ""
+        self.webhook_statuses: Counter = Counter()
+        self._webhook_task: Optional[asyncio.Task] = None
+        self._webhook_session: Optional[ClientSession] = None
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    # --- server ---
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.*}", self.handle_file)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start serving. Returns the base URL.
+        """
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}"
+
+    async def stop(self):
+        if self._webhook_task is not None:
+            self._webhook_task.cancel()
+            await asyncio.gather(self._webhook_task, return_exceptions=True)
+            self._webhook_task = None
+        if self._webhook_session is not None:
+            await self._webhook_session.close()
+            self._webhook_session = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    async def _read_params(request: web.Request) -> dict:
+        params = dict(request.query)
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    await part.read()
+                    params[part.name] = part.filename
+                else:
+                    params[part.name] = await part.text()
+        else:
+            body = await request.text()
+            if body:
+                params.update(parse_qsl(body))
+        return params
+
+    def _message(self, chat_id, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            **fields
+        }
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._read_params(request)
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "setWebhook":
+            self.webhook_url = params["url"]
+            self.webhook_secret = params.get("secret_token", "")
+            if self._webhook_task is None:
+                self._webhook_task = asyncio.create_task(self._deliver_webhook())
+            result = True
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        elif method == "getFile":
+            file_id = params["file_id"]
+            file_path = f"files/{file_id}.jpg"
+            if self.local_dir is not None:
+                file_path = os.path.join(self.local_dir, file_path)
+                await asyncio.get_running_loop().run_in_executor(None, self._write_local, file_id, file_path)
+            result = {
+                "file_id": file_id,
+                "file_unique_id": f"u{file_id}",
+                "file_size": self._files.get(file_id, 0),
+                "file_path": file_path
+            }
+        elif method == "sendMessage":
+            result = self._message(params["chat_id"], text=params.get("text", ""))
+        elif method == "sendPhoto":
+            result = self._message(params["chat_id"], caption=params.get("caption", ""), photo=[
+                {"file_id": "scheme", "file_unique_id": "scheme", "width": 800, "height": 600}
+            ])
+        elif method.startswith("editMessage") and "chat_id" in params:
+            result = {
+                "message_id": int(params["message_id"]),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", "")
+            }
+        else:
+            # deleteMessage, answerCallbackQuery, setMyCommands и т.п.
+            result = True
+
+        if method in ("sendMessage", "sendPhoto"):
+            self.last_message[result["chat"]["id"]] = result["message_id"]
+
+        self._notify(method, params)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        now = time.perf_counter()
+        updates = self._updates[:100]
+        for update in updates:
+            self._mark_delivered(update["update_id"], now)
+        return updates
+
+    def _mark_delivered(self, update_id: int, now: float):
+        if update_id not in self.delivered_at:
+            self.delivered_at[update_id] = now
+            self.updates_delivered += 1
+
+    async def post_update(self, update: dict, secret_token: Optional[str] = None) -> int:
+        """
+        POST one update to the registered webhook. Returns the HTTP status.
+        """
+        if self._webhook_session is None:
+            self._webhook_session = ClientSession()
+        token = self.webhook_secret if secret_token is None else secret_token
+        async with self._webhook_session.post(self.webhook_url, json=update,
+                                              headers={"X-Telegram-Bot-Api-Secret-Token": token}) as response:
+            await response.read()
+            self.webhook_statuses[response.status] += 1
+            return response.status
+
+    async def _deliver_webhook(self):
+        # Как Telegram: по одному апдейту, по порядку, 503 - повторить позже
+        while True:
+            if not self._updates:
+                self._new_updates.clear()
+                await self._new_updates.wait()
+                continue
+            update = self._updates[0]
+            status = await self.post_update(update)
+            if status == 503:
+                await asyncio.sleep(_REDELIVERY_DELAY)
+                continue
+            self._updates.pop(0)
+            if status == 200:
+                self._mark_delivered(update["update_id"], time.perf_counter())
+
+    def _body(self, file_id: str, size: int) -> Tuple[int, bytes]:
+        # Общий блок плюс file_id в конце, чтобы содержимое файлов различалось
+        suffix = file_id.encode()
+        body_size = max(size - len(suffix), 0)
+        if len(self._blob) < body_size:
+            self._blob = _make_blob(body_size)
+        return body_size, suffix
+
+    def _write_local(self, file_id: str, file_path: str):
+        body_size, suffix = self._body(file_id, self._files[file_id])
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(memoryview(self._blob)[:body_size])
+            f.write(suffix)
+        self.bytes_served += body_size + len(suffix)
+
+    async def handle_file(self, request: web.Request) -> web.StreamResponse:
+        file_id = request.match_info["path"].rsplit("/", 1)[-1].split(".")[0]
+        size = self._files.get(file_id)
+        if size is None:
+            return web.Response(status=404)
+        if self.file_delay:
+            await asyncio.sleep(self.file_delay)
+
+        body_size, suffix = self._body(file_id, size)
+        response = web.StreamResponse()
+        response.content_length = body_size + len(suffix)
+        await response.prepare(request)
+        for start in range(0, body_size, _CHUNK_SIZE):
+            await response.write(self._blob[start:min(start + _CHUNK_SIZE, body_size)])
+        await response.write(suffix)
+        await response.write_eof()
+        self.bytes_served += body_size + len(suffix)
+        return response
+
+    def wake(self):
+        """
+        Release a pending getUpdates long poll (used on shutdown).
+        """
+        self._new_updates.set()
+
+    # --- call log ---
+
+    def _notify(self, method: str, params: dict):
+        for predicate, future in list(self._waiters):
+            if not future.done() and predicate(method, params):
+                future.set_result(params)
+        self._waiters = [(p, f) for p, f in self._waiters if not f.done()]
+
+    async def wait_for(self, predicate: CallPredicate, timeout: float = 60.0) -> dict:
+        """
+        Wait until the bot makes a call matching predicate(method, params).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((predicate, future))
+        return await asyncio.wait_for(future, timeout)
+
+    # --- update injection ---
+
+    def _push(self, kind: str, payload: dict) -> int:
+        update_id = next(self._update_ids)
+        self._updates.append({"update_id": update_id, kind: payload})
+        self.pushed_at[update_id] = time.perf_counter()
+        self._new_updates.set()
+        return update_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Inspector{user_id}", "username": f"inspector{user_id}"}
+
+    def _new_file(self, size: int) -> str:
+        file_id = f"f{next(self._file_ids)}"
+        self._files[file_id] = size
+        return file_id
+
+    def push_text(self, user_id: int, text: str) -> int:
+        entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith("/") else None
+        message = self._message(user_id, text=text, **{"from": self._user(user_id)})
+        if entities:
+            message["entities"] = entities
+        return self._push("message", message)
+
+    def push_callback(self, user_id: int, message_id: int, data: str) -> str:
+        callback_id = str(next(self._callback_ids))
+        self._push("callback_query", {
+            "id": callback_id,
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "photo": [{"file_id": "scheme", "file_unique_id": "scheme", "width": 800, "height": 600}],
+                "caption": "menu"
+            }
+        })
+        return callback_id
+
+    def push_photo_album(self, user_id: int, count: int, size: int) -> List[int]:
+        media_group_id = f"g{next(self._file_ids)}"
+        update_ids = []
+        for _ in range(count):
+            file_id = self._new_file(size)
+            message = self._message(user_id, media_group_id=media_group_id, **{"from": self._user(user_id)})
+            message["photo"] = [{"file_id": file_id, "file_unique_id": f"u{file_id}",
+                                 "width": 2560, "height": 1920, "file_size": size}]
+            update_ids.append(self._push("message", message))
+        return update_ids
+
+    def push_document(self, user_id: int, size: int) -> int:
+        file_id = self._new_file(size)
+        message = self._message(user_id, **{"from": self._user(user_id)})
+        message["document"] = {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_name": f"{file_id}.jpg",
+                               "mime_type": "image/jpeg", "file_size": size}
+        return self._push("message", message)
@@ -0,0 +1,232 @@
+"""
+Local aiohttp server emulating the S3 API subset used by s3 photo storage.
+
+Objects live in memory. Supported: PutObject, CopyObject, HeadObject,
+GetObject, DeleteObject, ListObjectsV2 and multipart uploads (create, upload
+part, complete, abort) with S3's 5 MB minimum part size. Every request must
+carry a valid Signature V4 for the configured credentials, checked with an
+implementation independent of the bot's client, so the server stands in for
+MinIO in load tests.
+"""
+
+import hmac
+import uuid
+import hashlib
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote, unquote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+from aiohttp import web
+
+_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def _error(status: int, code: str, message: str) -> web.Response:
+    body = f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>"
+    return web.Response(status=status, body=body.encode(), content_type="application/xml")
+
+
+def _xml(body: str) -> web.Response:
+    return web.Response(body=f"<?xml version=\"1.0\" encoding=\"UTF-8\"?>{body}".encode(),
+                        content_type="application/xml")
+
+
+def _etag(data: bytes) -> str:
+    return f"\"{hashlib.md5(data).hexdigest()}\""
+
+
+class FakeS3:
+    """
+    In-memory S3 endpoint with request counters.
+    """
+
+    def __init__(self, access_key: str, secret_key: str, region: str = "us-east-1"):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.objects: Dict[Tuple[str, str], Tuple[bytes, datetime]] = {}
+        self._uploads: Dict[str, Tuple[str, str, Dict[int, bytes]]] = {}
+        self.calls: Counter = Counter()
+        self.bytes_received = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    # --- server ---
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024 * 1024, middlewares=[self._auth])
+        app.router.add_route("GET", "/{bucket}", self.handle_list)
+        app.router.add_route("*", "/{bucket}/{key:.+}", self.handle_object)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start serving. Returns the endpoint URL.
+        """
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @property
+    def pending_uploads(self) -> int:
+        return len(self._uploads)
+
+    def count(self, bucket: str, prefix: str = "") -> Tuple[int, int]:
+        """
+        Number and total size of the objects under prefix.
+        """
+        sizes = [len(data) for (name, key), (data, _) in self.objects.items()
+                 if name == bucket and key.startswith(prefix)]
+        return len(sizes), sum(sizes)
+
+    # --- Signature V4 ---
+
+    def _expected_signature(self, request: web.Request, signed_headers: str, date: str) -> str:
+        query = sorted(
+            (quote(unquote(name), safe="-_.~"), quote(unquote(value), safe="-_.~"))
+            for name, _, value in (pair.partition("=") for pair in request.query_string.split("&") if pair)
+        )
+        headers = "".join(
+            f"{name}:{' '.join(request.headers.get(name, '').split())}\n" for name in signed_headers.split(";")
+        )
+        canonical = "\n".join([
+            request.method, request.raw_path.split("?")[0], "&".join(f"{k}={v}" for k, v in query),
+            headers, signed_headers, request.headers.get("x-amz-content-sha256", "")
+        ])
+        scope = f"{date[:8]}/{self.region}/s3/aws4_request"
+        string_to_sign = f"AWS4-HMAC-SHA256\n{date}\n{scope}\n{hashlib.sha256(canonical.encode()).hexdigest()}"
+        key = f"AWS4{self.secret_key}".encode()
+        for part in scope.split("/"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    @web.middleware
+    async def _auth(self, request: web.Request, handler):
+        authorization = request.headers.get("Authorization", "")
+        if not authorization.startswith("AWS4-HMAC-SHA256 "):
+            return _error(403, "AccessDenied", "Signature V4 required")
+        fields = dict(
+            item.strip().split("=", 1) for item in authorization[len("AWS4-HMAC-SHA256 "):].split(",")
+        )
+        if not fields.get("Credential", "").startswith(self.access_key + "/"):
+            return _error(403, "InvalidAccessKeyId", "Unknown access key")
+        date = request.headers.get("x-amz-date", "")
+        expected = self._expected_signature(request, fields.get("SignedHeaders", ""), date)
+        if not hmac.compare_digest(expected, fields.get("Signature", "")):
+            return _error(403, "SignatureDoesNotMatch", "Signature mismatch")
+        self.calls[request.method] += 1
+        return await handler(request)
+
+    # --- handlers ---
+
+    async def handle_list(self, request: web.Request) -> web.Response:
+        bucket = request.match_info["bucket"]
+        if request.query.get("list-type") != "2":
+            return _error(400, "NotImplemented", "Only ListObjectsV2 is supported")
+        prefix = request.query.get("prefix", "")
+        max_keys = int(request.query.get("max-keys", 1000))
+        start_after = request.query.get("continuation-token", "")
+        keys = sorted(key for name, key in self.objects if name == bucket and key.startswith(prefix) and key > start_after)
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        contents = "".join(
+            f"<Contents><Key>{escape(key)}</Key>"
+            f"<LastModified>{self.objects[(bucket, key)][1].strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified>"
+            f"<ETag>{escape(_etag(self.objects[(bucket, key)][0]))}</ETag>"
+            f"<Size>{len(self.objects[(bucket, key)][0])}</Size></Contents>"
+            for key in page
+        )
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+        return _xml(
+            f"<ListBucketResult xmlns=\"{_NAMESPACE}\"><Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix>"
+            f"<KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>"
+            f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{token}{contents}</ListBucketResult>"
+        )
+
+    async def handle_object(self, request: web.Request) -> web.Response:
+        bucket, key = request.match_info["bucket"], request.match_info["key"]
+        query = request.query
+
+        if request.method == "PUT" and "uploadId" in query:
+            upload = self._uploads.get(query["uploadId"])
+            if upload is None:
+                return _error(404, "NoSuchUpload", "Unknown upload")
+            data = await request.read()
+            self.bytes_received += len(data)
+            upload[2][int(query["partNumber"])] = data
+            return web.Response(headers={"ETag": _etag(data)})
+
+        if request.method == "PUT" and "x-amz-copy-source" in request.headers:
+            source_bucket, _, source_key = unquote(request.headers["x-amz-copy-source"]).lstrip("/").partition("/")
+            source = self.objects.get((source_bucket, source_key))
+            if source is None:
+                return _error(404, "NoSuchKey", "Copy source does not exist")
+            self.objects[(bucket, key)] = (source[0], datetime.now(timezone.utc))
+            return _xml(f"<CopyObjectResult xmlns=\"{_NAMESPACE}\"><ETag>{escape(_etag(source[0]))}</ETag></CopyObjectResult>")
+
+        if request.method == "PUT":
+            data = await request.read()
+            self.bytes_received += len(data)
+            self.objects[(bucket, key)] = (data, datetime.now(timezone.utc))
+            return web.Response(headers={"ETag": _etag(data)})
+
+        if request.method == "POST" and "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self._uploads[upload_id] = (bucket, key, {})
+            return _xml(
+                f"<InitiateMultipartUploadResult xmlns=\"{_NAMESPACE}\"><Bucket>{bucket}</Bucket>"
+                f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            )
+
+        if request.method == "POST" and "uploadId" in query:
+            upload = self._uploads.get(query["uploadId"])
+            if upload is None:
+                return _error(404, "NoSuchUpload", "Unknown upload")
+            parts = upload[2]
+            root = ElementTree.fromstring(await request.read())
+            chunks = []
+            listed = root.findall("Part") or root.findall(f"{{{_NAMESPACE}}}Part")
+            for index, part in enumerate(listed):
+                number = int(part.findtext("PartNumber") or part.findtext(f"{{{_NAMESPACE}}}PartNumber"))
+                etag = part.findtext("ETag") or part.findtext(f"{{{_NAMESPACE}}}ETag")
+                if number not in parts or _etag(parts[number]) != etag:
+                    return _error(400, "InvalidPart", f"Part {number} not uploaded or ETag mismatch")
+                if index < len(listed) - 1 and len(parts[number]) < _MIN_PART_SIZE:
+                    return _error(400, "EntityTooSmall", f"Part {number} is smaller than 5 MB")
+                chunks.append(parts[number])
+            data = b"".join(chunks)
+            self.objects[(bucket, key)] = (data, datetime.now(timezone.utc))
+            del self._uploads[query["uploadId"]]
+            return _xml(
+                f"<CompleteMultipartUploadResult xmlns=\"{_NAMESPACE}\"><Bucket>{bucket}</Bucket>"
+                f"<Key>{escape(key)}</Key><ETag>{escape(_etag(data))}</ETag></CompleteMultipartUploadResult>"
+            )
+
+        if request.method == "DELETE" and "uploadId" in query:
+            if self._uploads.pop(query["uploadId"], None) is None:
+                return _error(404, "NoSuchUpload", "Unknown upload")
+            return web.Response(status=204)
+
+        if request.method == "DELETE":
+            self.objects.pop((bucket, key), None)
+            return web.Response(status=204)
+
+        stored = self.objects.get((bucket, key))
+        if request.method == "HEAD":
+            if stored is None:
+                return web.Response(status=404)
+            return web.Response(headers={"Content-Length": str(len(stored[0])), "ETag": _etag(stored[0])})
+        if request.method == "GET":
+            if stored is None:
+                return _error(404, "NoSuchKey", "The specified key does not exist")
+            return web.Response(body=stored[0], headers={"ETag": _etag(stored[0])})
+        return _error(405, "MethodNotAllowed", request.method)
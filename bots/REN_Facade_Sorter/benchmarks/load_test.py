@@ -0,0 +1,500 @@
+"""
+Load test of the bot against a local fake Bot API server.
+
+The bot runs unmodified (main.main()) with telebot's API_URL and FILE_URL
+pointed at benchmarks.fake_bot_api. Simulated users click through the
+selection menu and upload albums and documents; the run reports updates/s,
+handler latency percentiles, album end-to-end time, bytes/s written to disk
+and peak RSS. All files, databases and logs go to a temporary directory.
+With --s3 photos are saved to benchmarks.fake_s3 instead of the disk. With
+--webhook the bot runs in webhook mode and the fake server POSTs the updates
+to it; the webhook server is also checked on its own for secret token
+rejection, 503 on a full queue and draining the queue on shutdown. --fsm
+selects the FSM storage; with redis telebot's StateRedisStorage talks to an
+in-memory fakeredis client and the run checks that states reach it and that
+the client is closed on shutdown.
+
+Usage (from the bot directory):
+    python -m benchmarks.load_test --users 30 --albums 3 --album-size 10
+    python -m benchmarks.load_test --json results.json
+    python -m benchmarks.load_test --baseline results.json --max-regression 20
+    python -m benchmarks.load_test --local-files
+    python -m benchmarks.load_test --s3 --document-size 20000000
+    python -m benchmarks.load_test --webhook
+    python -m benchmarks.load_test --fsm redis
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import socket
+import resource
+import tempfile
+import importlib.util
+from typing import List, Optional
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Учетные данные и бакет для --s3
+S3_ACCESS_KEY = "benchmark"
+S3_SECRET_KEY = "benchmark-secret"
+S3_BUCKET = "inspections"
+
+# Секрет вебхука для --webhook
+WEBHOOK_SECRET = "benchmark-webhook-secret"
+
+# Метрики, по которым сравнивается с базовым прогоном: имя -> больше значит лучше
+REGRESSION_METRICS = {
+    "updates_per_sec": True,
+    "bytes_per_sec": True,
+    "handler_p95_ms": False,
+    "album_p95_ms": False,
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_environment(workdir: str, rate_limit: bool, local_files: bool = False, staging: bool = False,
+                        s3: bool = False, webhook_queue_size: Optional[int] = None, fsm: str = "memory"):
+    """
+    Point settings and relative paths (data/, logs/, storage) at workdir.
+    Must run before the app is imported.
+    """
+    scheme_dir = os.path.join(workdir, "app", "assets", "images")
+    os.makedirs(scheme_dir, exist_ok=True)
+    os.symlink(os.path.join(BOT_DIR, "app", "assets", "images", "scheme"), os.path.join(scheme_dir, "scheme"))
+    os.makedirs(os.path.join(workdir, "structure_inspections"), exist_ok=True)
+
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456789:benchmark-token-not-a-real-one",
+        "INSPECTIONS_BASE_PATH": os.path.join(workdir, "structure_inspections"),
+        "LOG_LEVEL": "WARNING",
+        "DELIVERY_MODE": "polling",
+        "FSM_STORAGE": fsm,
+        "RATE_LIMIT_ENABLED": "true" if rate_limit else "false",
+        "BOT_API_LOCAL": "true" if local_files else "false",
+    })
+    if staging:
+        os.environ["STAGING_DIR"] = os.path.join(workdir, "staging")
+    if s3:
+        # S3_ENDPOINT_URL задается после запуска сервера
+        os.environ.update({
+            "PHOTO_STORAGE": "s3",
+            "S3_BUCKET": S3_BUCKET,
+            "S3_ACCESS_KEY": S3_ACCESS_KEY,
+            "S3_SECRET_KEY": S3_SECRET_KEY,
+        })
+    if fsm == "redis":
+        # Адрес не используется: клиент подменяется fakeredis
+        os.environ["REDIS_URL"] = "redis://127.0.0.1:6379/0"
+    if webhook_queue_size is not None:
+        port = free_port()
+        os.environ.update({
+            "DELIVERY_MODE": "webhook",
+            "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(port),
+            "WEBHOOK_SECRET": WEBHOOK_SECRET,
+            "WEBHOOK_QUEUE_SIZE": str(webhook_queue_size),
+        })
+    os.chdir(workdir)
+    sys.path.insert(0, BOT_DIR)
+
+
+class _HeldBot:
+    """
+    Stand-in for the bot in check_webhook_server(): updates wait for release.
+    """
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.processed: List[int] = []
+
+    async def process_new_updates(self, updates):
+        await self.release.wait()
+        self.processed.extend(update.update_id for update in updates)
+
+
+async def check_webhook_server() -> List[str]:
+    """
+    Check WebhookServer on its own: a wrong secret token is rejected, a full
+    intake queue answers 503 and shutdown processes the accepted updates
+    before stopping the workers. Returns the failed checks.
+    """
+    from aiohttp.test_utils import TestClient, TestServer
+    from app.services.webhook import SECRET_HEADER, WebhookServer
+
+    bot = _HeldBot()
+    server = WebhookServer(bot, path="/hook", secret_token="secret", queue_size=1, workers=1)
+    client = TestClient(TestServer(server.make_app()))
+    await client.start_server()
+    failures = []
+
+    async def post(update_id: int, secret: str) -> int:
+        response = await client.post("/hook", json={"update_id": update_id}, headers={SECRET_HEADER: secret})
+        await response.release()
+        return response.status
+
+    async def worker_busy():
+        while not server.queue.empty():
+            await asyncio.sleep(0.01)
+
+    try:
+        if await post(1, "wrong-secret") != 401 or server.received:
+            failures.append("update with a wrong secret token was not rejected with 401")
+            return failures
+        # Первый апдейт занимает воркер, второй ждет в очереди, третьему места нет
+        statuses = [await post(2, "secret")]
+        await asyncio.wait_for(worker_busy(), timeout=5)
+        statuses += [await post(3, "secret"), await post(4, "secret")]
+        if statuses != [200, 200, 503] or server.rejected != 1:
+            failures.append(f"full intake queue answered {statuses}, expected [200, 200, 503]")
+    finally:
+        bot.release.set()
+        await client.close()
+
+    if bot.processed != [2, 3] or server._workers:
+        failures.append(f"shutdown processed updates {bot.processed} and left {len(server._workers)} workers, "
+                        f"expected [2, 3] and none")
+    return failures
+
+
+class LoadTest:
+    """
+    One load test run: fake server, bot task and user scenarios.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.api = None
+        self.s3 = None
+        self.handler_latencies: List[float] = []
+        self.album_latencies: List[float] = []
+        self.errors = 0
+        self.redis_closed = False
+
+    def _instrument(self, bot):
+        # Время обработки каждого апдейта всеми middleware и хендлерами
+        original = bot._run_middlewares_and_handlers
+
+        async def timed(message, handlers, middlewares, update_type):
+            started = time.perf_counter()
+            try:
+                return await original(message, handlers, middlewares, update_type)
+            finally:
+                self.handler_latencies.append(time.perf_counter() - started)
+
+        bot._run_middlewares_and_handlers = timed
+
+    def _use_fake_redis(self):
+        # StateRedisStorage создает клиент через redis.asyncio.from_url
+        import fakeredis
+        import redis.asyncio
+
+        def from_url(url, **kwargs):
+            client = fakeredis.FakeAsyncRedis.from_url(url, **kwargs)
+            close = client.aclose
+
+            async def aclose(*args, **close_kwargs):
+                self.redis_closed = True
+                return await close(*args, **close_kwargs)
+
+            client.aclose = aclose
+            return client
+
+        redis.asyncio.from_url = from_url
+
+    async def _fsm_states(self, storage) -> int:
+        if hasattr(storage, "redis"):
+            from app.services.fsm_storage import STORAGE_PREFIX
+            return len(await storage.redis.keys(STORAGE_PREFIX + "*"))
+        return len(storage.data)
+
+    async def _expect(self, method: str, chat_id: Optional[int] = None, text: Optional[str] = None, **match):
+        def predicate(called: str, params: dict) -> bool:
+            if called != method:
+                return False
+            if chat_id is not None and str(params.get("chat_id")) != str(chat_id):
+                return False
+            if text is not None and text not in params.get("text", ""):
+                return False
+            return all(str(params.get(key)) == str(value) for key, value in match.items())
+        return await self.api.wait_for(predicate, timeout=self.args.timeout)
+
+    async def _click(self, user_id: int, data: str):
+        callback_id = self.api.push_callback(user_id, self.api.last_message.get(user_id, 0), data)
+        await self._expect("answerCallbackQuery", callback_query_id=callback_id)
+
+    async def _user(self, user_id: int):
+        from app.keyboards.callback_data import (
+            OP_BLOCK, OP_CONFIRM, OP_INSPECTION, OP_LEVEL, OP_NEXT_LOCATION, OP_ORIENTATION, encode
+        )
+        from app.locations import BLOCKS, INSPECTIONS, LEVELS, orientations_for
+
+        rng = random.Random(user_id)
+        try:
+            start = asyncio.ensure_future(self._expect("sendPhoto", chat_id=user_id))
+            self.api.push_text(user_id, "/start")
+            await start
+
+            for album in range(self.args.albums):
+                if album:
+                    await self._click(user_id, encode(OP_NEXT_LOCATION))
+                inspection, block = rng.choice(INSPECTIONS), rng.choice(BLOCKS)
+                orientation, level = rng.choice(orientations_for(block)), rng.choice(LEVELS)
+                for data in (encode(OP_INSPECTION, inspection), encode(OP_BLOCK, block),
+                             encode(OP_ORIENTATION, orientation),
+                             encode(OP_LEVEL, inspection, block, orientation, level),
+                             encode(OP_CONFIRM, inspection, block, orientation, level)):
+                    await self._click(user_id, data)
+
+                report = asyncio.ensure_future(self._expect("sendMessage", chat_id=user_id, text="Successfully saved"))
+                started = time.perf_counter()
+                self.api.push_photo_album(user_id, self.args.album_size, self.args.photo_size)
+                await report
+                self.album_latencies.append(time.perf_counter() - started)
+
+                for _ in range(self.args.documents):
+                    report = asyncio.ensure_future(self._expect("sendMessage", chat_id=user_id, text="Successfully saved"))
+                    self.api.push_document(user_id, self.args.document_size)
+                    await report
+        except asyncio.TimeoutError:
+            self.errors += 1
+            print(f"User {user_id}: timed out waiting for the bot", file=sys.stderr)
+
+    async def run(self) -> dict:
+        from telebot import asyncio_helper
+        from benchmarks.fake_bot_api import FakeBotAPI
+
+        local_dir = os.path.abspath("bot_api_files") if self.args.local_files else None
+        self.api = FakeBotAPI(file_delay=self.args.file_delay, local_dir=local_dir)
+        base_url = await self.api.start()
+        asyncio_helper.API_URL = base_url + "/bot{0}/{1}"
+        asyncio_helper.FILE_URL = base_url + "/file/bot{0}/{1}"
+        if self.args.s3:
+            from benchmarks.fake_s3 import FakeS3
+            self.s3 = FakeS3(S3_ACCESS_KEY, S3_SECRET_KEY)
+            os.environ["S3_ENDPOINT_URL"] = await self.s3.start()
+        if self.args.fsm == "redis":
+            self._use_fake_redis()
+
+        import main
+        from app.services.catalog import catalog
+        from app.services.http_pools import bulk_pool, control_pool
+        from app.services.photo_storage import photo_storage
+        pools = [control_pool, bulk_pool] + ([photo_storage.pool] if self.s3 else [])
+
+        if self.args.webhook:
+            for failure in await check_webhook_server():
+                print(f"Webhook server: {failure}", file=sys.stderr)
+                self.errors += 1
+
+        self._instrument(main.bot)
+        rss_before = peak_rss_mb()
+        bot_task = asyncio.create_task(main.main())
+        if self.args.webhook:
+            await self._expect("setWebhook")
+            # Апдейт с чужим секретом не должен дойти до хендлеров
+            forged = {"update_id": 0, "message": self.api._message(1, text="/start", **{"from": self.api._user(1)})}
+            if await self.api.post_update(forged, secret_token="forged") != 401:
+                print("Webhook accepted an update with a wrong secret token", file=sys.stderr)
+                self.errors += 1
+        else:
+            await self._expect("getMe")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(self._user(100000 + i) for i in range(self.args.users)))
+        elapsed = time.perf_counter() - started
+
+        # Каталог учитывает файл только после переноса из промежуточной папки
+        from app.services.staging import staging_area
+        while staging_area.backlog:
+            await asyncio.sleep(0.05)
+
+        saved_bytes = catalog.total().bytes
+        saved_files = catalog.total().files
+        fsm_states = await self._fsm_states(main.storage)
+        if fsm_states < self.args.users:
+            print(f"FSM storage holds {fsm_states} states for {self.args.users} users", file=sys.stderr)
+            self.errors += 1
+        if self.args.webhook:
+            bot_task.cancel()
+            try:
+                await asyncio.wait_for(bot_task, timeout=self.args.timeout)
+            except asyncio.CancelledError:
+                pass
+            if 1 in self.api.last_message:
+                print("Bot answered the update with a wrong secret token", file=sys.stderr)
+                self.errors += 1
+        else:
+            main.bot._polling = False
+            self.api.wake()
+            await asyncio.wait_for(bot_task, timeout=self.args.timeout)
+        await self.api.stop()
+        if self.args.fsm == "redis" and not self.redis_closed:
+            print("Redis client was not closed on shutdown", file=sys.stderr)
+            self.errors += 1
+
+        s3_objects = None
+        if self.s3 is not None:
+            await self.s3.stop()
+            objects, size = self.s3.count(S3_BUCKET)
+            s3_objects = {"objects": objects, "bytes": size, "pending_uploads": self.s3.pending_uploads,
+                          "requests": dict(self.s3.calls.most_common())}
+            # Каждый учтенный каталогом файл должен быть в бакете
+            if objects != saved_files or size != saved_bytes or self.s3.pending_uploads:
+                print(f"S3 bucket holds {objects} objects / {size} bytes, catalog counted "
+                      f"{saved_files} / {saved_bytes}", file=sys.stderr)
+                self.errors += 1
+
+        return {
+            "users": self.args.users,
+            "updates": self.api.updates_delivered,
+            "elapsed_sec": round(elapsed, 3),
+            "updates_per_sec": round(self.api.updates_delivered / elapsed, 1),
+            "handler_p50_ms": round(percentile(self.handler_latencies, 50) * 1000, 1),
+            "handler_p95_ms": round(percentile(self.handler_latencies, 95) * 1000, 1),
+            "handler_p99_ms": round(percentile(self.handler_latencies, 99) * 1000, 1),
+            "album_p50_ms": round(percentile(self.album_latencies, 50) * 1000, 1),
+            "album_p95_ms": round(percentile(self.album_latencies, 95) * 1000, 1),
+            "files_saved": saved_files,
+            "bytes_saved": saved_bytes,
+            "bytes_per_sec": round(saved_bytes / elapsed),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "startup_rss_mb": round(rss_before, 1),
+            "api_calls": dict(self.api.calls.most_common()),
+            "http_pools": {pool.name: {"connections": pool.stats.connections_created,
+                                       "reused": pool.stats.connections_reused,
+                                       "queue_wait_ms": round(pool.stats.queue_wait * 1000, 1)}
+                           for pool in pools},
+            "fsm": {"storage": self.args.fsm, "states": fsm_states},
+            "s3": s3_objects,
+            "webhook": {str(status): count for status, count in sorted(self.api.webhook_statuses.items())}
+            if self.args.webhook else None,
+            "errors": self.errors,
+        }
+
+
+def print_report(result: dict):
+    print(f"Users:             {result['users']} ({result['errors']} failed)")
+    print(f"Updates:           {result['updates']} in {result['elapsed_sec']:.1f}s = {result['updates_per_sec']} updates/s")
+    print(f"Handler latency:   p50 {result['handler_p50_ms']} ms, p95 {result['handler_p95_ms']} ms, p99 {result['handler_p99_ms']} ms")
+    print(f"Album end-to-end:  p50 {result['album_p50_ms']} ms, p95 {result['album_p95_ms']} ms")
+    print(f"Saved:             {result['files_saved']} files, {result['bytes_saved'] / (1024 * 1024):.1f} MB, "
+          f"{result['bytes_per_sec'] / (1024 * 1024):.1f} MB/s")
+    print(f"Peak RSS:          {result['peak_rss_mb']} MB (after import {result['startup_rss_mb']} MB)")
+    print(f"FSM storage:       {result['fsm']['storage']}, {result['fsm']['states']} states")
+    print(f"Bot API calls:     {', '.join(f'{k}={v}' for k, v in result['api_calls'].items())}")
+    for name, pool in result['http_pools'].items():
+        print(f"HTTP pool {name + ':':<8} {pool['connections']} connections, {pool['reused']} reuses, "
+              f"{pool['queue_wait_ms']} ms waiting for a connection")
+    if result.get('s3'):
+        s3 = result['s3']
+        print(f"S3 bucket:         {s3['objects']} objects, {s3['bytes'] / (1024 * 1024):.1f} MB, "
+              f"requests {', '.join(f'{k}={v}' for k, v in s3['requests'].items())}")
+    if result.get('webhook'):
+        print(f"Webhook responses: {', '.join(f'{k}={v}' for k, v in result['webhook'].items())}")
+
+
+def compare(result: dict, baseline: dict, max_regression: float) -> List[str]:
+    """
+    Metrics that regressed by more than max_regression percent.
+    """
+    regressions = []
+    for metric, higher_is_better in REGRESSION_METRICS.items():
+        old, new = baseline.get(metric), result.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        if (-change if higher_is_better else change) > max_regression:
+            regressions.append(f"{metric}: {old} -> {new} ({change:+.1f}%)")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test the bot against a local fake Bot API server")
+    parser.add_argument("--users", type=int, default=30, help="Concurrent simulated users")
+    parser.add_argument("--albums", type=int, default=2, help="Albums per user, each to a new location")
+    parser.add_argument("--album-size", type=int, default=10, help="Photos per album")
+    parser.add_argument("--documents", type=int, default=1, help="Image documents per user after each album")
+    parser.add_argument("--photo-size", type=int, default=300 * 1024, help="Photo size in bytes")
+    parser.add_argument("--document-size", type=int, default=3 * 1024 * 1024, help="Document size in bytes")
+    parser.add_argument("--file-delay", type=float, default=0.0, help="Seconds before the fake server starts sending a file")
+    parser.add_argument("--local-files", action="store_true",
+                        help="Emulate a local Bot API server: files are taken from disk instead of downloaded")
+    parser.add_argument("--staging", action="store_true",
+                        help="Write files to a local staging directory and migrate them in the background")
+    parser.add_argument("--s3", action="store_true",
+                        help="Save photos to an in-memory S3 server (benchmarks.fake_s3) instead of the disk")
+    parser.add_argument("--webhook", action="store_true",
+                        help="Deliver updates to the bot's webhook server instead of getUpdates")
+    parser.add_argument("--webhook-queue-size", type=int, default=1000,
+                        help="WEBHOOK_QUEUE_SIZE for --webhook")
+    parser.add_argument("--fsm", choices=("memory", "sqlite", "redis"), default="memory",
+                        help="FSM storage; redis uses an in-memory fakeredis client (pip install redis fakeredis)")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Disable the outbound rate limiter")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for any single bot reply")
+    parser.add_argument("--json", metavar="PATH", help="Write results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="JSON results of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="Allowed regression in percent vs --baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.json) if args.json else None
+    if args.fsm == "redis" and not all(importlib.util.find_spec(name) for name in ("redis", "fakeredis")):
+        print("--fsm redis needs the redis and fakeredis packages: pip install redis fakeredis", file=sys.stderr)
+        return 2
+
+    with tempfile.TemporaryDirectory(prefix="ren_facade_load_") as workdir:
+        prepare_environment(workdir, rate_limit=not args.no_rate_limit, local_files=args.local_files,
+                            staging=args.staging, s3=args.s3,
+                            webhook_queue_size=args.webhook_queue_size if args.webhook else None, fsm=args.fsm)
+        result = asyncio.run(LoadTest(args).run())
+        os.chdir(BOT_DIR)
+
+    print_report(result)
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if result["errors"]:
+        return 1
+    if baseline is not None:
+        regressions = compare(result, baseline, args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,129 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from pydantic import Field, DirectoryPath
+from pydantic import Field, DirectoryPath, model_validator
 from typing import Literal, Optional
 import os
 
 class Settings(BaseSettings):
     TELEGRAM_BOT_TOKEN: str = Field(..., min_length=30, description="Telegram Bot API token")
     LOG_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = Field("INFO", description="Logging level")
+    LOG_PROFILE: Literal["development", "production"] = Field("development", description="development: text logs with variable values in tracebacks; production: JSON lines, sampled per-photo lines")
+    LOG_SAMPLE_PER_SECOND: float = Field(5.0, ge=0, description="Per-photo log lines kept per second of each kind in the production profile (0 - keep all)")
     INSPECTIONS_BASE_PATH: DirectoryPath = Field(..., description="Base path for structure_inspections")
 
-    # REDIS_HOST: str = Field("redis", description="Redis host")
-    # REDIS_PORT: int = Field(6379, description="Redis port")
-    # REDIS_DB: int = Field(0, description="Redis database number")
-    # REDIS_PASSWORD: Optional[str] = Field(None, description="Redis password (optional)")
+    DOWNLOAD_CONCURRENCY: int = Field(4, ge=1, le=32, description="Number of upload queue workers downloading files in parallel")
+    DOWNLOAD_RETRIES: int = Field(3, ge=1, description="Download attempts per file before it is counted as failed")
+    DOWNLOAD_RETRY_DELAY: float = Field(1.0, ge=0, description="Base delay in seconds for exponential retry backoff")
+    DOWNLOAD_CHUNK_SIZE: int = Field(64 * 1024, ge=1024, description="Chunk size in bytes for streaming downloads to disk")
+
+    BOT_API_URL: Optional[str] = Field(None, description="Base URL of a self-hosted Bot API server, e.g. http://localhost:8081 (default: api.telegram.org)")
+    BOT_API_LOCAL: bool = Field(False, description="The Bot API server runs with --local: files are taken from its disk instead of downloaded")
+    BOT_API_LOCAL_INGEST: Literal["link", "move", "copy"] = Field("link", description="How local server files are placed into location folders (link and move fall back to copy)")
+    BOT_API_SERVER_DIR: Optional[str] = Field(None, description="Working directory of the local server as it appears in getFile paths")
+    BOT_API_LOCAL_DIR: Optional[str] = Field(None, description="Where BOT_API_SERVER_DIR is mounted for the bot, if different")
+
+    HTTP_CONTROL_CONNECTIONS: int = Field(30, ge=1, description="Connections for Bot API calls (messages, buttons, getFile)")
+    HTTP_BULK_CONNECTIONS: int = Field(8, ge=1, description="Connections for file downloads, at least DOWNLOAD_CONCURRENCY")
+    HTTP_LIMIT_PER_HOST: int = Field(0, ge=0, description="Connections per host in each pool (0 - only the pool limit)")
+    HTTP_KEEPALIVE_TIMEOUT: float = Field(30.0, ge=0, description="Seconds an idle connection is kept open for reuse")
+    HTTP_DNS_CACHE_TTL: int = Field(300, ge=0, description="Seconds resolved host addresses are cached")
+    HTTP_CONNECT_TIMEOUT: float = Field(10.0, gt=0, description="Timeout in seconds for opening a connection")
+    HTTP_REQUEST_TIMEOUT: int = Field(300, gt=0, description="Total timeout in seconds of a Bot API call (long polling adds its own)")
+    HTTP_DOWNLOAD_READ_TIMEOUT: float = Field(60.0, gt=0, description="Seconds a file download may wait for the next data")
+
+    IO_WORKERS: int = Field(8, ge=1, le=64, description="Thread pool size for blocking filesystem operations")
+
+    ASSET_CACHE_PATH: str = Field("data/asset_cache.json", description="File where uploaded scheme file_ids are cached")
+
+    DEDUP_ENABLED: bool = Field(True, description="Skip or hard-link photos that were already saved")
+    DEDUP_DB_PATH: str = Field("data/dedup.sqlite3", description="SQLite index of saved files by file_unique_id and content hash")
+
+    UPLOAD_QUEUE_DB_PATH: str = Field("data/upload_queue.sqlite3", description="SQLite job queue of accepted files not yet saved")
+    UPLOAD_RETRY_MAX_DELAY: float = Field(60.0, ge=0, description="Upper bound in seconds for the retry backoff")
+
+    PHOTO_STORAGE: Literal["local", "s3"] = Field("local", description="Where saved photos are stored: folders under INSPECTIONS_BASE_PATH or an S3-compatible bucket")
+    S3_ENDPOINT_URL: str = Field("https://s3.amazonaws.com", description="S3 API endpoint (e.g. http://minio:9000)")
+    S3_BUCKET: Optional[str] = Field(None, description="Bucket for saved photos (s3 storage)")
+    S3_REGION: str = Field("us-east-1", description="Region used for request signing")
+    S3_ACCESS_KEY: Optional[str] = Field(None, description="S3 access key ID")
+    S3_SECRET_KEY: Optional[str] = Field(None, description="S3 secret access key")
+    S3_PREFIX: str = Field("", description="Key prefix in front of the {Inspection}/{Block}/... layout")
+    S3_PART_SIZE: int = Field(8 * 1024 * 1024, ge=5 * 1024 * 1024, description="Multipart upload part size in bytes (S3 minimum is 5 MB)")
+    S3_CONNECTIONS: int = Field(16, ge=1, description="Connections to the S3 endpoint")
+
+    STAGING_DIR: Optional[str] = Field(None, description="Local directory new files are written to before moving to INSPECTIONS_BASE_PATH (disabled if not set)")
+    STAGING_MIGRATE_WORKERS: int = Field(2, ge=1, le=32, description="Batches of staged files moved to the share in parallel")
+    STAGING_BATCH_SIZE: int = Field(20, ge=1, description="Staged files moved per batch")
+    STAGING_RETRY_DELAY: float = Field(10.0, ge=0, description="Seconds before a failed move of a staged file is retried")
+
+    MEDIA_GROUP_WINDOW: float = Field(1.0, gt=0, description="Maximum quiet period in seconds before an album is processed")
+    MEDIA_GROUP_MIN_WINDOW: float = Field(0.3, gt=0, description="Minimum quiet period in seconds once album items arrive quickly")
+    MEDIA_GROUP_TTL: float = Field(30.0, gt=0, description="Albums are processed at the latest this many seconds after the first item")
+    MEDIA_GROUP_MAX_GROUPS: int = Field(500, ge=1, description="Maximum number of albums collected in memory at once")
+
+    COVERAGE_LEVEL_MARKS: bool = Field(False, description="Mark level buttons that already have photos in the selection keyboard")
+
+    METADATA_ENABLED: bool = Field(True, description="Record metadata of every saved photo")
+    METADATA_DB_PATH: str = Field("data/metadata.sqlite3", description="SQLite metadata index of saved photos")
+
+    PREVIEWS_ENABLED: bool = Field(True, description="Render previews and thumbnails of saved images (requires Pillow)")
+    PREVIEW_WORKERS: int = Field(2, ge=1, le=32, description="Worker processes rendering previews")
+    PREVIEW_QUEUE_SIZE: int = Field(1000, ge=1, description="Maximum images waiting for preview rendering before new ones are skipped")
+    PREVIEW_MAX_SIZE: int = Field(1600, ge=64, description="Longest side in pixels of the preview image")
+    THUMBNAIL_SIZE: int = Field(320, ge=16, description="Longest side in pixels of the thumbnail image")
+    PREVIEW_QUALITY: int = Field(80, ge=1, le=95, description="JPEG quality of previews and thumbnails")
+
+    DELIVERY_MODE: Literal["polling", "webhook"] = Field("polling", description="How updates are received from Telegram")
+    WEBHOOK_URL: Optional[str] = Field(None, description="Public HTTPS base URL Telegram sends updates to (webhook mode)")
+    WEBHOOK_PATH: str = Field("/telegram/webhook", description="URL path of the webhook endpoint")
+    WEBHOOK_HOST: str = Field("0.0.0.0", description="Interface the webhook server listens on")
+    WEBHOOK_PORT: int = Field(8080, ge=1, le=65535, description="Port the webhook server listens on")
+    WEBHOOK_SECRET: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_-]{1,256}$", description="Secret token Telegram sends with every update (random if not set)")
+    WEBHOOK_QUEUE_SIZE: int = Field(1000, ge=1, description="Maximum updates waiting for processing before Telegram is asked to retry")
+    WEBHOOK_WORKERS: int = Field(16, ge=1, description="Number of tasks processing webhook updates concurrently")
+    WEBHOOK_MAX_CONNECTIONS: int = Field(40, ge=1, le=100, description="Maximum simultaneous HTTPS connections from Telegram")
+
+    RATE_LIMIT_ENABLED: bool = Field(True, description="Throttle outbound Bot API calls and retry on flood control")
+    RATE_LIMIT_GLOBAL: float = Field(30.0, gt=0, description="Messages per second across all chats")
+    RATE_LIMIT_PER_CHAT: float = Field(1.0, gt=0, description="Messages per second in a private chat")
+    RATE_LIMIT_PER_GROUP: float = Field(20 / 60, gt=0, description="Messages per second in a group chat")
+    RATE_LIMIT_CHAT_BURST: int = Field(5, ge=1, description="Messages a chat may receive in a burst before throttling (one upload round: confirmation, progress, report, next menu)")
+    RATE_LIMIT_RETRIES: int = Field(3, ge=0, description="Retries after a 429 response, each waiting for retry_after")
+
+    METRICS_ENABLED: bool = Field(False, description="Serve Prometheus metrics over HTTP")
+    METRICS_HOST: str = Field("0.0.0.0", description="Interface the metrics endpoint listens on")
+    METRICS_PORT: int = Field(9108, ge=1, le=65535, description="Port the metrics endpoint listens on")
+    METRICS_PATH: str = Field("/metrics", description="URL path of the metrics endpoint")
+
+    HANDLER_TIMING_ENABLED: bool = Field(True, description="Trace every handler and log slow ones with a span breakdown")
+    HANDLER_SLOW_THRESHOLD: float = Field(1.0, gt=0, description="Handlers slower than this many seconds are logged")
+    HANDLER_PROFILE_RATE: float = Field(0.0, ge=0, le=1, description="Share of updates profiled to HANDLER_PROFILE_DIR")
+    HANDLER_PROFILER: Literal["cprofile", "pyinstrument"] = Field("cprofile", description="Profiler for sampled captures (pyinstrument must be installed)")
+    HANDLER_PROFILE_DIR: str = Field("data/profiles", description="Directory for sampled handler profiles")
+
+    FSM_STORAGE: Literal["memory", "sqlite", "redis"] = Field("sqlite", description="Backend for user FSM states")
+    FSM_SQLITE_PATH: str = Field("data/fsm.sqlite3", description="SQLite file with persisted FSM states (sqlite backend)")
+    FSM_FLUSH_INTERVAL: float = Field(1.0, gt=0, description="Seconds between write-behind flushes of changed FSM states (sqlite backend)")
+
+    REDIS_HOST: str = Field("redis", description="Redis host")
+    REDIS_PORT: int = Field(6379, description="Redis port")
+    REDIS_DB: int = Field(0, description="Redis database number")
+    REDIS_PASSWORD: Optional[str] = Field(None, description="Redis password (optional)")
+    REDIS_URL: Optional[str] = Field(None, description="Redis connection URL, overrides host/port/db/password (optional)")
+
+    @model_validator(mode="after")
+    def check_webhook(self):
+        if self.DELIVERY_MODE == "webhook" and not self.WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL is required when DELIVERY_MODE is 'webhook'")
+        return self
+
+    @model_validator(mode="after")
+    def check_photo_storage(self):
+        if self.PHOTO_STORAGE == "s3":
+            if not (self.S3_BUCKET and self.S3_ACCESS_KEY and self.S3_SECRET_KEY):
+                raise ValueError("S3_BUCKET, S3_ACCESS_KEY and S3_SECRET_KEY are required when PHOTO_STORAGE is 's3'")
+            if self.STAGING_DIR:
+                raise ValueError("STAGING_DIR can only be used with PHOTO_STORAGE 'local'")
+        return self
 
     model_config = SettingsConfigDict(
         env_file=os.path.join(os.path.dirname(__file__), ".env"),
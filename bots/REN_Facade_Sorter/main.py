@@ -1,40 +1,114 @@
 """
-Async entry point for the REN Facade Sorter bot with FSM and Memory storage.
+Async entry point for the REN Facade Sorter bot with FSM storage selected by FSM_STORAGE.
 """
 
 import asyncio
+from telebot import asyncio_helper
 from telebot.async_telebot import AsyncTeleBot
-from telebot.asyncio_storage import StateMemoryStorage
-# from telebot.asyncio_storage import StateRedisStorage
 from telebot.asyncio_filters import StateFilter
 from app.utils.logger import logger
 from config import settings
 from app.handlers import register_handlers
+from app.handlers.photos import resume_interrupted_uploads
+from app.keyboards import warm_keyboard_cache
+from app.middlewares import HandlerTimingMiddleware, UpdateMetricsMiddleware
+from app.services import file_io
+from app.services.assets import scheme_registry
+from app.services.catalog import catalog
+from app.services.downloader import active_downloads
+from app.services.location_tree import location_tree
+from app.services.fsm_storage import create_storage, start_storage, close_storage
+from app.services.media_groups import media_group_aggregator
+from app.services.metadata import metadata_store
+from app.services.metrics import metrics_server, registry
+from app.services.photo_storage import photo_storage
+from app.services.previews import preview_pipeline
+from app.services.rate_limiter import outbound_scheduler
+from app.services.staging import staging_area
+from app.services import http_pools, tracing
+from app.services.upload_queue import upload_queue
+from app.services.webhook import run_webhook
 
-# FSM storage (Memory)
-storage = StateMemoryStorage()
+# FSM storage (memory, sqlite or redis)
+storage = create_storage()
 
-# FSM storage (Redis)
-# storage = StateRedisStorage(
-#     host=settings.REDIS_HOST,
-#     port=settings.REDIS_PORT,
-#     db=settings.REDIS_DB,
-#     password=settings.REDIS_PASSWORD,
-#     prefix='ren_facade_sorter_bot_'
-# )
+# Self-hosted Bot API server (with BOT_API_LOCAL its files are read from disk)
+if settings.BOT_API_URL:
+    asyncio_helper.API_URL = settings.BOT_API_URL.rstrip("/") + "/bot{0}/{1}"
+    asyncio_helper.FILE_URL = settings.BOT_API_URL.rstrip("/") + "/file/bot{0}/{1}"
+
+# Separate connection pools for Bot API calls and file downloads
+http_pools.install()
+
+# Outbound rate limiting for all Bot API calls
+if settings.RATE_LIMIT_ENABLED:
+    outbound_scheduler.install()
 
 # Initialize bot
 bot = AsyncTeleBot(settings.TELEGRAM_BOT_TOKEN, state_storage=storage)
 
 bot.add_custom_filter(StateFilter(bot))
 
+# Handler timing: spans of Bot API calls (including rate limiter waits) and FSM access
+if settings.HANDLER_TIMING_ENABLED:
+    tracing.install()
+    tracing.instrument_storage(storage)
+    bot.setup_middleware(HandlerTimingMiddleware())
+
+# Prometheus metrics: update counters and gauges read on every scrape
+if settings.METRICS_ENABLED:
+    bot.setup_middleware(UpdateMetricsMiddleware())
+    registry.gauge("media_groups_in_flight", "Albums being collected or processed",
+                   lambda: media_group_aggregator.stats.in_flight)
+    registry.gauge("uploads_pending", "Files accepted but not saved yet", lambda: upload_queue.pending)
+    registry.gauge("active_downloads", "Files being downloaded from Telegram", active_downloads)
+    registry.gauge("fsm_users", "Users with an FSM state (memory and sqlite storage)",
+                   lambda: len(storage.data) if hasattr(storage, "data") else None)
+    registry.gauge("staging_backlog", "Staged files not moved to the inspection share yet",
+                   lambda: staging_area.backlog if staging_area.enabled else None)
+    registry.gauge("staging_oldest_seconds", "Age of the oldest staged file waiting for migration",
+                   lambda: staging_area.lag if staging_area.enabled else None)
+    registry.gauge("http_control_connections_in_use", "Bot API connections serving a request",
+                   lambda: http_pools.control_pool.in_use)
+    registry.gauge("http_bulk_connections_in_use", "File download connections serving a request",
+                   lambda: http_pools.bulk_pool.in_use)
+    registry.gauge("http_s3_connections_in_use", "S3 photo storage connections serving a request",
+                   lambda: None if photo_storage.local else photo_storage.pool.in_use)
+
 async def main():
-    logger.info("Starting REN Facade Sorter bot with Memory FSM...")
+    logger.info("Starting REN Facade Sorter bot with {fsm_storage} FSM storage...", fsm_storage=settings.FSM_STORAGE)
     register_handlers(bot)
+    await start_storage(storage)
+    await scheme_registry.load(settings.TELEGRAM_BOT_TOKEN)
+    await location_tree.prepare(settings.INSPECTIONS_BASE_PATH)
+    await catalog.build(location_tree.root)
+    upload_queue.add_saved_listener(catalog.on_saved)
+    logger.info("Prepared {keyboards} selection keyboards", keyboards=warm_keyboard_cache())
+    preview_pipeline.start()
+    upload_queue.add_saved_listener(preview_pipeline.on_saved)
+    metadata_store.start()
+    upload_queue.add_saved_listener(metadata_store.on_saved)
+    if settings.METRICS_ENABLED:
+        await metrics_server.start(settings.METRICS_HOST, settings.METRICS_PORT)
+    recovered = await upload_queue.start(bot)
+    await resume_interrupted_uploads(bot, recovered)
     try:
-        await bot.infinity_polling(timeout=30)
+        if settings.DELIVERY_MODE == "webhook":
+            await run_webhook(bot)
+        else:
+            await bot.infinity_polling(timeout=30)
     except Exception as e:
-        logger.exception(f"Bot infinity polling stopped: {e}")
+        logger.exception("Bot {mode} stopped: {error}", mode=settings.DELIVERY_MODE, error=e)
+    finally:
+        await media_group_aggregator.shutdown()
+        await upload_queue.stop()
+        await preview_pipeline.stop()
+        await metadata_store.stop()
+        await close_storage(storage)
+        await photo_storage.close()
+        await metrics_server.stop()
+        await http_pools.close()
+        file_io.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())